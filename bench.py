@@ -0,0 +1,579 @@
+#!/usr/bin/env python3
+"""
+Benchmark module for TermShare
+Measures FTPClient throughput and latency against the built-in FTPServer
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import queue
+import ssl
+import socket
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; CPU and RSS figures are reported as None
+    resource = None
+
+from ftp_client import FTPClient
+from ftp_server import FTPServer, listen_socket, tls_context
+from metrics import MetricsRegistry
+
+SCENARIOS = ("small_files", "huge_file", "deep_listing", "concurrent_clients", "metadata_batch")
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+def _cpu_seconds() -> Optional[float]:
+    """CPU time used so far by the whole process, including a built-in server"""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def _peak_rss_kb() -> Optional[int]:
+    """Peak RSS over the lifetime of the process; it cannot be split per scenario"""
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        # macOS reports bytes, Linux reports kilobytes
+        peak_rss //= 1024
+    return peak_rss
+
+class ThrottleProxy:
+    """Local TCP proxy that adds latency and caps bandwidth for FTP traffic
+
+    Passive-mode replies on the control connection are rewritten so that
+    data connections are throttled through the proxy as well.
+    """
+
+    PASV_RE = re.compile(rb"(\d+),(\d+),(\d+),(\d+),(\d+),(\d+)")
+    EPSV_RE = re.compile(rb"\(\|\|\|(\d+)\|\)")
+
+    def __init__(self, target: Tuple[str, int], latency: float = 0.0, bandwidth: Optional[float] = None):
+        self.target = target
+        self.delay = latency / 2.0  # one-way delay, applied in each direction
+        self.bandwidth = bandwidth  # bytes per second per direction, or None
+        self.listener = None
+        self.running = False
+
+    def start(self) -> int:
+        """Start proxying the control port and return the local port"""
+        self.listener = listen_socket("127.0.0.1", 0)
+        self.running = True
+        threading.Thread(target=self._serve, args=(self.listener, self.target, True), daemon=True).start()
+        return self.listener.getsockname()[1]
+
+    def stop(self) -> None:
+        """Stop accepting new connections"""
+        self.running = False
+        if self.listener:
+            self.listener.close()
+
+    def _serve(self, listener: socket.socket, target: Tuple[str, int], control: bool) -> None:
+        """Accept connections and link each to the target"""
+        while self.running:
+            try:
+                client, _ = listener.accept()
+                upstream = socket.create_connection(target)
+            except OSError:
+                break
+            self._link(client, upstream, control)
+            if not control:
+                # Data listeners serve exactly one connection
+                listener.close()
+                break
+
+    def _link(self, client: socket.socket, upstream: socket.socket, control: bool) -> None:
+        """Pump both directions between two sockets"""
+        remaining = [2]
+        lock = threading.Lock()
+
+        def finished():
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    client.close()
+                    upstream.close()
+
+        self._pipe(client, upstream, False, finished)
+        self._pipe(upstream, client, control, finished)
+
+    def _pipe(self, src: socket.socket, dst: socket.socket, rewrite: bool, finished) -> None:
+        """Forward one direction, delaying and pacing each chunk"""
+        chunks = queue.Queue()
+
+        def reader():
+            pending = b""
+            while True:
+                try:
+                    data = src.recv(65536)
+                except OSError:
+                    data = b""
+                if data and rewrite:
+                    pending += data
+                    lines = pending.split(b"\n")
+                    pending = lines.pop()
+                    data = b"".join(self._rewrite(line + b"\n") for line in lines)
+                    if not data:
+                        continue
+                chunks.put((time.monotonic() + self.delay, data))
+                if not data:
+                    break
+
+        def writer():
+            while True:
+                due, data = chunks.get()
+                wait = due - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                if not data:
+                    break
+                try:
+                    dst.sendall(data)
+                except OSError:
+                    break
+                if self.bandwidth:
+                    time.sleep(len(data) / self.bandwidth)
+            try:
+                dst.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+            finished()
+
+        threading.Thread(target=reader, daemon=True).start()
+        threading.Thread(target=writer, daemon=True).start()
+
+    def _rewrite(self, line: bytes) -> bytes:
+        """Redirect passive-mode replies to a throttled data listener"""
+        if line.startswith(b"227 "):
+            match = self.PASV_RE.search(line)
+            if match:
+                numbers = [int(n) for n in match.groups()]
+                host = ".".join(str(n) for n in numbers[:4])
+                port = self._proxy_data((host, numbers[4] << 8 | numbers[5]))
+                replacement = f"127,0,0,1,{port >> 8},{port & 0xff}".encode()
+                return line[:match.start()] + replacement + line[match.end():]
+        elif line.startswith(b"229 "):
+            match = self.EPSV_RE.search(line)
+            if match:
+                port = self._proxy_data((self.target[0], int(match.group(1))))
+                return line[:match.start()] + f"(|||{port}|)".encode() + line[match.end():]
+        return line
+
+    def _proxy_data(self, target: Tuple[str, int]) -> int:
+        """Open a one-shot throttled listener for a data connection"""
+        listener = listen_socket("127.0.0.1", 0, backlog=1)
+        threading.Thread(target=self._serve, args=(listener, target, False), daemon=True).start()
+        return listener.getsockname()[1]
+
+class BenchContext:
+    """Shared settings for one benchmark run"""
+
+    def __init__(self, host: str, port: int, workdir: str, args, metrics: MetricsRegistry,
+                 tls: Optional[ssl.SSLContext] = None):
+        self.host = host
+        self.port = port
+        self.workdir = workdir
+        self.args = args
+        self.metrics = metrics
+        self.tls = tls
+
+    def make_file(self, name: str, size: int) -> str:
+        """Create a local file of random-ish content"""
+        path = os.path.join(self.workdir, name)
+        if not os.path.exists(path):
+            block = os.urandom(min(size, 1024 * 1024))
+            with open(path, 'wb') as f:
+                remaining = size
+                while remaining > 0:
+                    f.write(block[:remaining])
+                    remaining -= len(block)
+        return path
+
+class Session:
+    """An FTPClient driven through either its sync or its async methods"""
+
+    def __init__(self, ctx: BenchContext, mode: str, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.ctx = ctx
+        self.mode = mode
+        self.loop = loop
+        self.client = FTPClient(metrics=ctx.metrics, tls=ctx.tls)
+        self.latencies = []
+        self.errors = 0
+
+    def call(self, name: str, *args):
+        """Run one client operation and record its latency"""
+        start = time.perf_counter()
+        if self.mode == "async":
+            success, result = self.loop.run_until_complete(getattr(self.client, f"async_{name}")(*args))
+        else:
+            success, result = getattr(self.client, name)(*args)
+        self.latencies.append(time.perf_counter() - start)
+        if not success:
+            self.errors += 1
+        return success, result
+
+    async def acall(self, name: str, *args):
+        """Coroutine variant of call() for concurrent async scenarios"""
+        start = time.perf_counter()
+        success, result = await getattr(self.client, f"async_{name}")(*args)
+        self.latencies.append(time.perf_counter() - start)
+        if not success:
+            self.errors += 1
+        return success, result
+
+    def open(self, directory: str) -> None:
+        """Connect, log in and enter (creating if needed) a scratch directory"""
+        success, message = self.client.connect(self.ctx.host, self.ctx.port, self.ctx.args.user, self.ctx.args.password)
+        if not success:
+            raise RuntimeError(message)
+        self.client.create_directory(directory)
+        success, message = self.client.change_directory(directory)
+        if not success:
+            raise RuntimeError(message)
+
+    def close(self) -> None:
+        self.client.disconnect()
+
+def scenario_small_files(ctx: BenchContext, mode: str, loop) -> Dict:
+    """Upload then download many small files"""
+    count, size = ctx.args.small_count, ctx.args.small_size
+    local = ctx.make_file("small.bin", size)
+    sink = os.path.join(ctx.workdir, f"small-{mode}.out")
+    session = Session(ctx, mode, loop)
+    session.open(f"small_files-{mode}")
+    try:
+        for i in range(count):
+            session.call("upload_file", local, f"f{i}.bin")
+        for i in range(count):
+            session.call("download_file", f"f{i}.bin", sink)
+    finally:
+        session.close()
+    return {"ops": 2 * count, "bytes": 2 * count * size, "latencies": session.latencies, "errors": session.errors}
+
+def scenario_huge_file(ctx: BenchContext, mode: str, loop) -> Dict:
+    """Upload then download one large file"""
+    size = ctx.args.huge_mb * 1024 * 1024
+    local = ctx.make_file("huge.bin", size)
+    sink = os.path.join(ctx.workdir, f"huge-{mode}.out")
+    session = Session(ctx, mode, loop)
+    session.open(f"huge_file-{mode}")
+    try:
+        session.call("upload_file", local, "huge.bin")
+        session.call("download_file", "huge.bin", sink)
+    finally:
+        session.close()
+    os.remove(sink)
+    return {"ops": 2, "bytes": 2 * size, "latencies": session.latencies, "errors": session.errors}
+
+def scenario_deep_listing(ctx: BenchContext, mode: str, loop) -> Dict:
+    """Walk a deep directory tree with many entries per level, listing each level"""
+    depth, entries = ctx.args.listing_depth, ctx.args.listing_entries
+    session = Session(ctx, mode, loop)
+    session.open(f"deep_listing-{mode}")
+    ops = 0
+    listed = 0
+    try:
+        # Build the tree once through the client so it works against any server
+        empty = ctx.make_file("empty.bin", 0)
+        for level in range(depth):
+            for i in range(entries):
+                session.client.upload_file(empty, f"e{i}")
+            session.client.create_directory("d")
+            session.client.change_directory("d")
+        for _ in range(depth):
+            session.client.change_directory("..")
+        session.latencies.clear()
+
+        for _ in range(ctx.args.listing_rounds):
+            for level in range(depth):
+                success, files = session.call("list_files")
+                listed += len(files) if success else 0
+                session.call("change_directory", "d")
+                ops += 2
+            for _ in range(depth):
+                session.client.change_directory("..")
+    finally:
+        session.close()
+    return {"ops": ops, "bytes": 0, "entries": listed, "latencies": session.latencies, "errors": session.errors}
+
+def scenario_concurrent_clients(ctx: BenchContext, mode: str, loop) -> Dict:
+    """Several clients downloading the same file at once"""
+    clients, rounds = ctx.args.clients, ctx.args.client_rounds
+    size = ctx.args.client_mb * 1024 * 1024
+    local = ctx.make_file("shared.bin", size)
+    directory = f"concurrent_clients-{mode}"
+
+    seed = Session(ctx, mode, loop)
+    seed.open(directory)
+    seed.client.upload_file(local, "shared.bin")
+    seed.close()
+
+    sessions = [Session(ctx, mode, loop) for _ in range(clients)]
+    for session in sessions:
+        session.open(directory)
+    # Each client gets its own target; downloads to one path would contend for its part file
+    sinks = {session: os.path.join(ctx.workdir, f"sink-{mode}-{i}.bin") for i, session in enumerate(sessions)}
+
+    if mode == "async":
+        async def worker(session):
+            for _ in range(rounds):
+                await session.acall("download_file", "shared.bin", sinks[session])
+
+        async def run_all():
+            await asyncio.gather(*(worker(session) for session in sessions))
+
+        loop.run_until_complete(run_all())
+    else:
+        def worker(session):
+            for _ in range(rounds):
+                session.call("download_file", "shared.bin", sinks[session])
+
+        threads = [threading.Thread(target=worker, args=(session,)) for session in sessions]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    for session in sessions:
+        session.close()
+    for sink in sinks.values():
+        if os.path.exists(sink):
+            os.remove(sink)
+    latencies = [latency for session in sessions for latency in session.latencies]
+    errors = sum(session.errors for session in sessions)
+    return {"ops": clients * rounds, "bytes": clients * rounds * size, "latencies": latencies, "errors": errors}
+
+def scenario_metadata_batch(ctx: BenchContext, mode: str, loop) -> Dict:
+    """Create and remove many directories through pipelined control commands"""
+    count = ctx.args.batch_count
+    session = Session(ctx, mode, loop)
+    session.open(f"metadata_batch-{mode}")
+    errors = 0
+    try:
+        for verb in ("MKD", "RMD"):
+            success, replies = session.call("run_batch", [f"{verb} d{i}" for i in range(count)])
+            errors += sum(1 for ok, _ in replies if not ok) if success else count
+    finally:
+        session.close()
+    return {"ops": 2 * count, "bytes": 0, "latencies": session.latencies, "errors": session.errors + errors}
+
+def run_scenario(ctx: BenchContext, name: str, mode: str) -> Dict:
+    """Run one scenario and turn its raw figures into a result record"""
+    loop = asyncio.new_event_loop() if mode == "async" else None
+    try:
+        cpu_before = _cpu_seconds()
+        start = time.perf_counter()
+        raw = globals()[f"scenario_{name}"](ctx, mode, loop)
+        elapsed = time.perf_counter() - start
+        cpu_after = _cpu_seconds()
+    finally:
+        if loop is not None:
+            loop.close()
+
+    latencies = raw.pop("latencies")
+    result = {
+        "scenario": name,
+        "mode": mode,
+        "seconds": round(elapsed, 6),
+        "ops": raw["ops"],
+        "bytes": raw["bytes"],
+        "errors": raw["errors"],
+        "mb_per_s": round(raw["bytes"] / elapsed / (1024 * 1024), 3) if elapsed else 0.0,
+        "ops_per_s": round(raw["ops"] / elapsed, 3) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "cpu_s": round(cpu_after - cpu_before, 3) if cpu_before is not None else None,
+    }
+    for key in raw:
+        result.setdefault(key, raw[key])
+    return result
+
+def _git_commit() -> Optional[str]:
+    """Return the current git commit, if running from a checkout"""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results: List[Dict], baseline: Dict, threshold: float) -> bool:
+    """Print changes against a baseline report; returns False on regression"""
+    base = {(r["scenario"], r["mode"]): r for r in baseline.get("results", [])}
+    # For these metrics a lower value is better
+    lower_is_better = {"p50_ms", "p99_ms", "cpu_s", "seconds"}
+    ok = True
+    print(f"\nCompared with {baseline.get('meta', {}).get('commit') or 'baseline'}:")
+    for result in results:
+        old = base.get((result["scenario"], result["mode"]))
+        if old is None:
+            continue
+        changes = []
+        for metric in ("mb_per_s", "ops_per_s", "p50_ms", "p99_ms", "cpu_s"):
+            before, after = old.get(metric), result.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before * 100
+            worse = change > threshold if metric in lower_is_better else change < -threshold
+            if worse and (metric in ("mb_per_s", "ops_per_s", "p99_ms")):
+                ok = False
+            changes.append(f"{metric} {change:+.1f}%{' !' if worse else ''}")
+        print(f"  {result['scenario']:<20} {result['mode']:<6} " + ", ".join(changes))
+    return ok
+
+def print_results(results: List[Dict]) -> None:
+    """Print a human-readable results table"""
+    header = f"{'scenario':<20} {'mode':<6} {'MB/s':>10} {'ops/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'CPU s':>7} {'err':>4}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        cpu = f"{r['cpu_s']:.2f}" if r["cpu_s"] is not None else "-"
+        print(f"{r['scenario']:<20} {r['mode']:<6} {r['mb_per_s']:>10.2f} {r['ops_per_s']:>10.1f} "
+              f"{r['p50_ms']:>9.2f} {r['p99_ms']:>9.2f} {cpu:>7} {r['errors']:>4}")
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build the benchmark argument parser"""
+    parser = argparse.ArgumentParser(prog="termshare bench", description="TermShare benchmark suite")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS,
+                        help="scenario to run; repeat for several (default: all)")
+    parser.add_argument("--mode", choices=("sync", "async", "both"), default="both",
+                        help="client code path to exercise (default: both)")
+    parser.add_argument("--host", help="benchmark an external server instead of a built-in one")
+    parser.add_argument("--port", type=int, default=2121, help="external server port (default: 2121)")
+    parser.add_argument("--user", default="anonymous", help="login name (default: anonymous)")
+    parser.add_argument("--password", default="", help="login password")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated round-trip latency in ms")
+    parser.add_argument("--bandwidth", type=float, help="simulated bandwidth cap in MB/s per direction")
+    parser.add_argument("--tls", action="store_true", help="connect with explicit FTPS")
+    parser.add_argument("--ca-file", metavar="FILE", help="CA certificates to trust (implies --tls)")
+    parser.add_argument("--tls-cert", metavar="FILE",
+                        help="certificate for the built-in server (with --tls); include the key or use --tls-key")
+    parser.add_argument("--tls-key", metavar="FILE", help="private key for --tls-cert")
+    parser.add_argument("--metrics", action="store_true",
+                        help="enable client and server metrics (measures their overhead)")
+    parser.add_argument("--json", metavar="PATH", help="write results as JSON to PATH")
+    parser.add_argument("--compare", metavar="PATH", help="compare against a previous JSON report")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="regression threshold in percent for --compare (default: 10)")
+    parser.add_argument("--small-count", type=int, default=200, help="files in small_files (default: 200)")
+    parser.add_argument("--small-size", type=int, default=4096, help="bytes per small file (default: 4096)")
+    parser.add_argument("--huge-mb", type=int, default=256, help="size of huge_file in MB (default: 256)")
+    parser.add_argument("--listing-depth", type=int, default=8, help="levels in deep_listing (default: 8)")
+    parser.add_argument("--listing-entries", type=int, default=200, help="entries per level (default: 200)")
+    parser.add_argument("--listing-rounds", type=int, default=5, help="walks of the tree (default: 5)")
+    parser.add_argument("--clients", type=int, default=8, help="clients in concurrent_clients (default: 8)")
+    parser.add_argument("--client-rounds", type=int, default=4, help="downloads per client (default: 4)")
+    parser.add_argument("--client-mb", type=int, default=16, help="file size per download in MB (default: 16)")
+    parser.add_argument("--batch-count", type=int, default=2000,
+                        help="directories in metadata_batch (default: 2000)")
+    return parser
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Run the selected scenarios and report the results"""
+    args = build_parser().parse_args(argv)
+    scenarios = args.scenario or list(SCENARIOS)
+    modes = ["sync", "async"] if args.mode == "both" else [args.mode]
+    use_tls = args.tls or bool(args.ca_file)
+    if use_tls and (args.latency or args.bandwidth):
+        # The proxy rewrites PASV replies, which it cannot read once they are encrypted
+        print("termshare: --latency/--bandwidth cannot be combined with TLS", file=sys.stderr)
+        return 1
+    if use_tls and not args.host and not args.tls_cert:
+        print("termshare: --tls with the built-in server needs --tls-cert", file=sys.stderr)
+        return 1
+
+    workdir = tempfile.mkdtemp(prefix="termshare-bench-")
+    server = proxy = None
+    registry = MetricsRegistry(enabled=args.metrics)
+    try:
+        if args.host:
+            host, port = args.host, args.port
+        else:
+            root = os.path.join(workdir, "served")
+            os.mkdir(root)
+            server_tls = tls_context(args.tls_cert, args.tls_key) if use_tls else None
+            # The scenarios upload, rename and delete, which needs a named user
+            args.user, args.password = "bench", os.urandom(8).hex()
+            server = FTPServer(root=root, metrics=registry, tls=server_tls,
+                               users={args.user: args.password})
+            success, message = server.start_server((0, 0))
+            if not success:
+                print(f"termshare: {message}", file=sys.stderr)
+                return 1
+            host, port = "127.0.0.1", server.port
+
+        if args.latency or args.bandwidth:
+            bandwidth = args.bandwidth * 1024 * 1024 if args.bandwidth else None
+            proxy = ThrottleProxy((host, port), args.latency / 1000.0, bandwidth)
+            host, port = "127.0.0.1", proxy.start()
+
+        local = os.path.join(workdir, "local")
+        os.mkdir(local)
+        client_tls = ssl.create_default_context(cafile=args.ca_file) if use_tls else None
+        ctx = BenchContext(host, port, local, args, registry, client_tls)
+        results = []
+        for name in scenarios:
+            for mode in modes:
+                results.append(run_scenario(ctx, name, mode))
+    finally:
+        if proxy:
+            proxy.stop()
+        if server:
+            server.stop_server()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_results(results)
+    peak_rss = _peak_rss_kb()
+    if peak_rss is not None:
+        print(f"\nPeak RSS of the whole run: {peak_rss / 1024:.1f} MB")
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "latency_ms": args.latency,
+            "bandwidth_mb_s": args.bandwidth,
+            "external_server": bool(args.host),
+            "tls": use_tls,
+            "peak_rss_kb": peak_rss,
+        },
+        "results": results,
+    }
+    if args.metrics:
+        report["metrics"] = registry.snapshot()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.threshold):
+            return 2
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
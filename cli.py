@@ -0,0 +1,521 @@
+#!/usr/bin/env python3
+"""
+Command line module for TermShare
+Headless entry point for scripting, cron and CI use
+"""
+
+import os
+import sys
+import time
+import signal
+import argparse
+from typing import List, Optional
+
+# Client and server modules are imported inside the command handlers so that
+# short invocations only pay for what they use.
+
+# Same as journal.DEFAULT_JOURNAL, repeated so that --help does not load sqlite3
+DEFAULT_JOURNAL = os.path.join(os.path.expanduser("~"), ".termshare", "journal.sqlite3")
+
+def _tracer(args):
+    """Create a Tracer if --trace was given"""
+    if not args.trace:
+        return None
+    from tracing import Tracer
+    return Tracer(args.trace, args.trace_format, args.trace_sample)
+
+def _client_tls(args):
+    """Create a client TLS context if --tls or --ca-file was given"""
+    if not (args.tls or args.ca_file):
+        return None
+    import ssl
+    return ssl.create_default_context(cafile=args.ca_file)
+
+def _connect(args):
+    """Create a connected FTPClient from the common connection options"""
+    from ftp_client import FTPClient
+    client = FTPClient(tracer=_tracer(args), tls=_client_tls(args))
+    success, message = client.connect(args.host, args.port, args.user, args.password)
+    if not success:
+        _error(message)
+        client.tracer.close()
+        return None
+    return client
+
+def _close(client) -> None:
+    """Disconnect and write out any trace"""
+    client.disconnect()
+    client.tracer.close()
+
+def _error(message: str) -> None:
+    """Report an error on stderr"""
+    print(f"termshare: {message}", file=sys.stderr)
+
+def _report(success: bool, message: str, quiet: bool = False) -> int:
+    """Print an operation result and convert it to an exit status"""
+    if not success:
+        _error(message)
+        return 1
+    if not quiet:
+        print(message)
+    return 0
+
+def cmd_serve(args) -> int:
+    """Run the built-in server until interrupted"""
+    from ftp_server import FTPServer
+    registry = metrics_server = None
+    if args.metrics_port is not None:
+        from metrics import MetricsRegistry, MetricsServer
+        registry = MetricsRegistry()
+        metrics_server = MetricsServer(registry, args.metrics_port)
+        if _report(*metrics_server.start()):
+            return 1
+
+    profiler = None
+    if args.profile:
+        from tracing import SamplingProfiler
+        profiler = SamplingProfiler(args.profile, args.profile_rate)
+
+    tls = None
+    if args.tls_cert:
+        from ftp_server import tls_context
+        try:
+            tls = tls_context(args.tls_cert, args.tls_key)
+        except (OSError, ValueError) as e:
+            _error(f"Cannot load TLS certificate: {e}")
+            return 1
+
+    users = {}
+    for entry in args.user or []:
+        name, sep, password = entry.partition(":")
+        if not sep or not name:
+            _error(f"--user expects NAME:PASSWORD, got {entry!r}")
+            return 1
+        users[name] = password
+
+    tracer = _tracer(args)
+    try:
+        server = FTPServer(root=args.root, metrics=registry, tracer=tracer, profiler=profiler,
+                           cache=not args.no_cache, tls=tls, tls_required=args.tls_required,
+                           fsync=args.fsync, users=users, anonymous=args.anonymous)
+    except (OSError, ValueError) as e:
+        _error(f"Cannot share {args.root}: {getattr(e, 'strerror', None) or e}")
+        if metrics_server:
+            metrics_server.stop()
+        if tracer:
+            tracer.close()
+        return 1
+    success, message = server.start_server((args.port, args.port_max or args.port))
+    if _report(success, message):
+        return 1
+    discovery = None
+    if args.announce:
+        from discovery import PeerDiscovery
+        discovery = PeerDiscovery(args.announce, interface=args.discovery_interface)
+        if _report(*discovery.start()):
+            discovery = None
+        else:
+            discovery.announce(server.port, tls=tls is not None)
+    # Treat SIGTERM (service managers, CI runners) like Ctrl-C so cleanup runs
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        while server.running:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if discovery:
+            discovery.stop()
+        if server.running:
+            server.stop_server()
+        if metrics_server:
+            metrics_server.stop()
+        if tracer:
+            tracer.close()
+        if profiler and profiler.dump():
+            print(f"Profile written to {args.profile}")
+    return 0
+
+def _sources(args):
+    """The --host server followed by each --mirror, or None if a mirror is malformed"""
+    from swarm import Source
+    tls = bool(args.tls or args.ca_file)
+    sources = [Source(args.host, args.port, tls)]
+    for entry in args.mirror:
+        host, sep, port = entry.rpartition(":")
+        if not sep:
+            host, port = entry, str(args.port)
+        if not host or not port.isdigit():
+            _error(f"--mirror expects HOST[:PORT], got {entry!r}")
+            return None
+        sources.append(Source(host, int(port), tls))
+    return sources
+
+def _journal(args):
+    """Open the transfer journal unless --no-journal was given; None if unavailable"""
+    if getattr(args, "no_journal", False):
+        return None
+    import sqlite3
+    from journal import TransferJournal
+    try:
+        return TransferJournal(args.journal)
+    except (OSError, sqlite3.Error) as e:
+        _error(f"Cannot open journal {args.journal}: {e}")
+        return None
+
+def _transfer(client, journal, direction: str, remote_path: str, local_path: str):
+    """Upload or download one file, recording it in the journal if there is one"""
+    if journal is None:
+        if direction == "download":
+            return client.download_file(remote_path, local_path)
+        return client.upload_file(local_path, remote_path)
+    from journal import remote_path_for, run_job
+    job = journal.add(direction, client.host, client.port, client.username, client.tls is not None,
+                      remote_path_for(client, remote_path), local_path)
+    return run_job(client, journal, job)
+
+def cmd_get(args) -> int:
+    """Download a single file"""
+    local_path = args.local or os.path.basename(args.remote)
+    if args.mirror:
+        from swarm import swarm_download
+        sources = _sources(args)
+        if sources is None:
+            return 1
+        tracer = _tracer(args)
+        try:
+            return _report(*swarm_download(sources, args.remote, local_path, args.user, args.password,
+                                           _client_tls(args), args.sha256, tracer=tracer),
+                           quiet=args.quiet)
+        finally:
+            if tracer:
+                tracer.close()
+    client = _connect(args)
+    if client is None:
+        return 1
+    journal = _journal(args)
+    try:
+        return _report(*_transfer(client, journal, "download", args.remote, local_path), quiet=args.quiet)
+    finally:
+        _close(client)
+        if journal:
+            journal.close()
+
+def cmd_put(args) -> int:
+    """Upload a single file"""
+    client = _connect(args)
+    if client is None:
+        return 1
+    journal = None if args.delta else _journal(args)
+    try:
+        remote_path = args.remote or os.path.basename(args.local)
+        if args.delta:
+            return _report(*client.upload_delta(args.local, remote_path), quiet=args.quiet)
+        return _report(*_transfer(client, journal, "upload", remote_path, args.local), quiet=args.quiet)
+    finally:
+        _close(client)
+        if journal:
+            journal.close()
+
+def cmd_ls(args) -> int:
+    """List a remote directory"""
+    client = _connect(args)
+    if client is None:
+        return 1
+    try:
+        if args.path:
+            success, message = client.change_directory(args.path)
+            if not success:
+                return _report(success, message)
+        success, files = client.list_files()
+        if not success:
+            return _report(success, files[0])
+        for line in files:
+            print(line)
+        return 0
+    finally:
+        _close(client)
+
+def _mirror_directory(client, local_dir: str, quiet: bool, journal=None) -> int:
+    """Recursively download the current remote directory into local_dir"""
+    from utils import ensure_directory_exists, parse_ftp_listing
+
+    if not ensure_directory_exists(local_dir):
+        _error(f"Cannot create local directory {local_dir}")
+        return 1
+
+    success, files = client.list_files()
+    if not success:
+        _error(files[0])
+        return 1
+
+    failures = 0
+    for name, _, file_type, _ in parse_ftp_listing(files):
+        if name in (".", ".."):
+            continue
+        local_path = os.path.join(local_dir, name)
+        if file_type == "DIR":
+            success, message = client.change_directory(name)
+            if not success:
+                _error(message)
+                failures += 1
+                continue
+            failures += _mirror_directory(client, local_path, quiet, journal)
+            client.change_directory("..")
+        else:
+            success, message = _transfer(client, journal, "download", name, local_path)
+            failures += _report(success, message, quiet=quiet)
+    return failures
+
+def cmd_mirror(args) -> int:
+    """Mirror a remote directory tree to a local directory"""
+    client = _connect(args)
+    if client is None:
+        return 1
+    journal = _journal(args)
+    try:
+        success, message = client.change_directory(args.remote)
+        if not success:
+            return _report(success, message)
+        return 1 if _mirror_directory(client, args.local, args.quiet, journal) else 0
+    finally:
+        _close(client)
+        if journal:
+            journal.close()
+
+def cmd_resume(args) -> int:
+    """Resume the transfers an interrupted get, put or mirror left unfinished"""
+    from ftp_client import FTPClient
+    from journal import run_job
+    journal = _journal(args)
+    if journal is None:
+        return 1
+    try:
+        for job_id in args.cancel:
+            if journal.get(job_id) is None:
+                _error(f"No job {job_id} in the journal")
+                return 1
+            journal.cancel(job_id)
+        jobs = journal.unfinished()
+        if args.list:
+            for job in jobs:
+                size = "?" if job.size is None else job.size
+                print(f"{job.id}\t{job.direction}\t{job.user}@{job.host}:{job.port}\t{job.remote_path}\t"
+                      f"{job.local_path}\t{job.committed}/{size}\t{job.status}")
+            return 0
+        if not jobs:
+            return _report(True, "Nothing to resume", quiet=args.quiet)
+
+        # One connection per server and login, taken in the order the jobs were recorded
+        groups = {}
+        for job in jobs:
+            groups.setdefault((job.host, job.port, job.user, job.tls), []).append(job)
+        failures = 0
+        for (host, port, user, tls), group in groups.items():
+            context = None
+            if tls:
+                import ssl
+                context = ssl.create_default_context(cafile=args.ca_file)
+            client = FTPClient(tracer=_tracer(args), tls=context)
+            success, message = client.connect(host, port, user, args.password)
+            if not success:
+                _error(f"{host}:{port}: {message}")
+                client.tracer.close()
+                failures += len(group)
+                continue
+            try:
+                for job in group:
+                    failures += _report(*run_job(client, journal, job), quiet=args.quiet)
+            finally:
+                _close(client)
+        return 1 if failures else 0
+    finally:
+        journal.close()
+
+def _discover(args):
+    """Listen for peers for --wait seconds and return them"""
+    from discovery import PeerDiscovery
+    discovery = PeerDiscovery("termshare-cli", interface=args.discovery_interface)
+    success, message = discovery.start()
+    if not success:
+        _error(message)
+        return None
+    try:
+        time.sleep(args.wait)
+        return discovery.list_peers()
+    finally:
+        discovery.stop()
+
+def cmd_peers(args) -> int:
+    """List TermShare servers announced on the local network"""
+    peers = _discover(args)
+    if peers is None:
+        return 1
+    for peer in peers:
+        print(f"{peer.name}\t{peer.host}:{peer.port}{' (TLS)' if peer.tls else ''}")
+    return 0
+
+def cmd_send(args) -> int:
+    """Upload a file to several discovered peers at once"""
+    from discovery import send_to_peers
+    peers = _discover(args)
+    if peers is None:
+        return 1
+    missing = set()
+    if args.to:
+        missing = set(args.to) - {peer.name for peer in peers}
+        for name in sorted(missing):
+            _error(f"No peer named {name} found")
+        peers = [peer for peer in peers if peer.name in args.to]
+    if not peers:
+        _error("No peers to send to")
+        return 1
+    results = send_to_peers(peers, args.local, args.remote, args.user, args.password,
+                            _client_tls(args), args.parallel)
+    failures = sum(_report(success, message, quiet=args.quiet) for _, success, message in results)
+    return 1 if failures or missing else 0
+
+def cmd_bench(args, extra: List[str]) -> int:
+    """Run the benchmark suite"""
+    from bench import main as bench_main
+    return bench_main(extra)
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build the argument parser for all subcommands"""
+    parser = argparse.ArgumentParser(prog="termshare", description="TermShare FTP file sharing")
+    subparsers = parser.add_subparsers(dest="command", metavar="command")
+    subparsers.required = True
+
+    login = argparse.ArgumentParser(add_help=False)
+    login.add_argument("--user", default="anonymous", help="login name (default: anonymous)")
+    login.add_argument("--password", default="", help="login password")
+    login.add_argument("--tls", action="store_true", help="use explicit FTPS (AUTH TLS, PROT P)")
+    login.add_argument("--ca-file", metavar="FILE",
+                       help="trust the CA certificates in FILE (implies --tls)")
+    login.add_argument("-q", "--quiet", action="store_true", help="only report errors")
+
+    connection = argparse.ArgumentParser(add_help=False, parents=[login])
+    connection.add_argument("--host", default="localhost", help="server host (default: localhost)")
+    connection.add_argument("--port", type=int, default=2121, help="server port (default: 2121)")
+
+    discovery = argparse.ArgumentParser(add_help=False)
+    discovery.add_argument("--discovery-interface", default="0.0.0.0", metavar="ADDR",
+                           help="address of the network interface used for peer discovery "
+                           "(default: the system's choice)")
+
+    journal = argparse.ArgumentParser(add_help=False)
+    journal.add_argument("--journal", default=DEFAULT_JOURNAL, metavar="FILE",
+                         help=f"transfer journal used to resume interrupted transfers (default: {DEFAULT_JOURNAL})")
+
+    journalled = argparse.ArgumentParser(add_help=False, parents=[journal])
+    journalled.add_argument("--no-journal", action="store_true",
+                            help="do not record transfers, so they cannot be resumed")
+
+    tracing = argparse.ArgumentParser(add_help=False)
+    tracing.add_argument("--trace", metavar="FILE", help="write trace spans to FILE")
+    tracing.add_argument("--trace-format", choices=("chrome", "otlp"), default="chrome",
+                         help="trace file format (default: chrome)")
+    tracing.add_argument("--trace-sample", type=float, default=1.0, metavar="RATE",
+                         help="fraction of commands to trace (default: 1.0)")
+
+    serve = subparsers.add_parser("serve", parents=[tracing, discovery], help="run the built-in server")
+    serve.add_argument("--port", type=int, default=2121, help="first port to try (default: 2121)")
+    serve.add_argument("--port-max", type=int, default=2140, help="last port to try (default: 2140)")
+    serve.add_argument("--root", help="directory, or tar/zip archive served read-only, to share "
+                       "(default: ~/TermShare)")
+    serve.add_argument("--user", action="append", metavar="NAME:PASSWORD",
+                       help="allow this login full read/write access (repeatable)")
+    serve.add_argument("--anonymous", choices=["off", "read", "upload"], default="read",
+                       help="what anonymous logins may do: nothing, download (default), "
+                       "or also upload new files without replacing existing ones")
+    serve.add_argument("--no-cache", action="store_true",
+                       help="stat the backend on every request instead of caching metadata")
+    serve.add_argument("--fsync", choices=["never", "always", "group"], default="never",
+                       help="when uploads are flushed to disk before being renamed into place: "
+                       "never (default), always (per upload) or group (batched across uploads)")
+    serve.add_argument("--tls-cert", metavar="FILE", help="PEM certificate chain; enables AUTH TLS")
+    serve.add_argument("--tls-key", metavar="FILE", help="PEM private key (default: read from --tls-cert)")
+    serve.add_argument("--tls-required", action="store_true",
+                       help="refuse logins and data connections that are not protected by TLS")
+    serve.add_argument("--announce", metavar="NAME",
+                       help="announce the server on the local network under display name NAME")
+    serve.add_argument("--metrics-port", type=int, metavar="PORT",
+                       help="serve Prometheus metrics on 127.0.0.1:PORT/metrics")
+    serve.add_argument("--profile", metavar="FILE", help="write sampled cProfile stats to FILE on exit")
+    serve.add_argument("--profile-rate", type=float, default=0.01, metavar="RATE",
+                       help="fraction of commands to profile (default: 0.01)")
+    serve.set_defaults(func=cmd_serve)
+
+    get = subparsers.add_parser("get", parents=[connection, journalled, tracing], help="download a file")
+    get.add_argument("remote", help="remote file path")
+    get.add_argument("local", nargs="?", help="local file path (default: remote file name)")
+    get.add_argument("--mirror", action="append", default=[], metavar="HOST[:PORT]",
+                     help="another server with the same file; download from all of them at once (repeatable)")
+    get.add_argument("--sha256", metavar="DIGEST",
+                     help="with --mirror, only use servers whose copy has this SHA-256")
+    get.set_defaults(func=cmd_get)
+
+    put = subparsers.add_parser("put", parents=[connection, journalled, tracing], help="upload a file")
+    put.add_argument("local", help="local file path")
+    put.add_argument("remote", nargs="?", help="remote file path (default: local file name)")
+    put.add_argument("--delta", action="store_true",
+                     help="only send the parts that differ from the server's copy (TermShare servers; not journalled)")
+    put.set_defaults(func=cmd_put)
+
+    ls = subparsers.add_parser("ls", parents=[connection, tracing], help="list a remote directory")
+    ls.add_argument("path", nargs="?", help="remote directory (default: current)")
+    ls.set_defaults(func=cmd_ls)
+
+    mirror = subparsers.add_parser("mirror", parents=[connection, journalled, tracing],
+                                   help="download a directory tree")
+    mirror.add_argument("remote", help="remote directory")
+    mirror.add_argument("local", help="local directory")
+    mirror.set_defaults(func=cmd_mirror)
+
+    resume = subparsers.add_parser("resume", parents=[journal, tracing],
+                                   help="resume transfers left unfinished by an interrupted run")
+    resume.add_argument("--password", default="",
+                        help="login password for the recorded logins (passwords are not journalled)")
+    resume.add_argument("--ca-file", metavar="FILE",
+                        help="trust the CA certificates in FILE for jobs recorded over TLS")
+    resume.add_argument("--list", action="store_true", help="list unfinished transfers instead of resuming them")
+    resume.add_argument("--cancel", action="append", type=int, default=[], metavar="JOB",
+                        help="drop the job with this id from the journal (repeatable)")
+    resume.add_argument("-q", "--quiet", action="store_true", help="only report errors")
+    resume.set_defaults(func=cmd_resume)
+
+    peers = subparsers.add_parser("peers", parents=[discovery], help="list servers on the local network")
+    peers.add_argument("--wait", type=float, default=3.0, metavar="SECONDS",
+                       help="how long to listen for announcements (default: 3)")
+    peers.set_defaults(func=cmd_peers)
+
+    send = subparsers.add_parser("send", parents=[login, discovery],
+                                 help="upload a file to several peers at once")
+    send.add_argument("local", help="local file path")
+    send.add_argument("remote", nargs="?", help="remote file path (default: local file name)")
+    send.add_argument("--to", action="append", metavar="NAME",
+                      help="send to the peer with this display name (repeatable; default: all peers)")
+    send.add_argument("--parallel", type=int, default=8, metavar="N",
+                      help="uploads to run at once (default: 8)")
+    send.add_argument("--wait", type=float, default=3.0, metavar="SECONDS",
+                      help="how long to listen for announcements (default: 3)")
+    send.set_defaults(func=cmd_send)
+
+    # Options are parsed by bench.py itself; see "termshare bench --help"
+    bench = subparsers.add_parser("bench", add_help=False, help="run the benchmark suite")
+    bench.set_defaults(func=cmd_bench)
+
+    return parser
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Parse arguments and run the selected subcommand"""
+    parser = build_parser()
+    args, extra = parser.parse_known_args(argv)
+    if args.func is cmd_bench:
+        return cmd_bench(args, extra)
+    if extra:
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
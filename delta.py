@@ -0,0 +1,340 @@
+"""
+Delta module for TermShare
+rsync-style block signatures and deltas, so a changed file is uploaded by sending only what changed
+"""
+
+import struct
+import hashlib
+from itertools import accumulate
+from typing import Dict, Iterator, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    # Checksums fall back to pure Python: correct, but far slower on large files
+    np = None
+
+# Bounds on the block size a client may ask for
+MIN_BLOCK_SIZE = 1024
+MAX_BLOCK_SIZE = 1024 * 1024
+
+# Longest literal run in one instruction
+MAX_LITERAL = 1024 * 1024
+
+# Bytes of the local file read at a time while looking for matching blocks
+SCAN_SIZE = 8 * 1024 * 1024
+
+# Offsets whose checksums are computed in one vectorised step
+SCAN_SPAN = 1024 * 1024
+
+# Bytes of the remote file signed in one vectorised step
+SIGN_SIZE = 4 * 1024 * 1024
+
+# Size in bits of the table that screens out most windows before a dictionary lookup
+FILTER_BITS = 20
+
+_MASK = 0xffffffff
+
+# Signature stream: header, then one record per block (the last may be short)
+HEADER = struct.Struct("<QI")        # file size, block size
+RECORD = struct.Struct("<Q16s")      # weak checksum, strong checksum
+
+# Delta stream: one-byte opcodes followed by their arguments
+COPY = struct.Struct("<QI")          # b"C": first block, number of consecutive blocks
+LITERAL = struct.Struct("<I")        # b"L": length, followed by that many bytes
+END_SIZE = 32                        # b"E": SHA-256 of the whole new file
+
+def block_size_for(size: int) -> int:
+    """Block size for a file of size bytes: the power of two nearest its square root, as rsync does"""
+    block = MIN_BLOCK_SIZE
+    while block * block < size and block < MAX_BLOCK_SIZE:
+        block *= 2
+    return block
+
+def weak_checksum(data) -> int:
+    """Rolling checksum of a block: a is the byte sum, b weights each byte by its distance from the end"""
+    a = sum(data)
+    b = sum(accumulate(data))
+    return ((a & _MASK) << 32) | (b & _MASK)
+
+def strong_checksum(data) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+def _block_weaks(data: bytes, block_size: int, count: int) -> List[int]:
+    """Weak checksums of the first count whole blocks of data"""
+    if np is None:
+        return [weak_checksum(data[i * block_size:(i + 1) * block_size]) for i in range(count)]
+    blocks = np.frombuffer(data, dtype=np.uint8, count=count * block_size).reshape(count, block_size)
+    a = blocks.sum(axis=1, dtype=np.uint64)
+    b = blocks.dot(np.arange(block_size, 0, -1, dtype=np.uint64))
+    return (((a & _MASK) << 32) | (b & _MASK)).tolist()
+
+def _read_full(f, size: int) -> bytes:
+    """Read exactly size bytes from a file that may return short reads"""
+    data = f.read(size)
+    while len(data) < size:
+        more = f.read(size - len(data))
+        if not more:
+            raise ValueError("file changed while it was being read")
+        data += more
+    return data
+
+def signature(f, size: int, block_size: int) -> Iterator[bytes]:
+    """Signature stream of the first size bytes of f, as sent for SITE SIGN"""
+    yield HEADER.pack(size, block_size)
+    step = max(1, SIGN_SIZE // block_size) * block_size
+    remaining = size
+    while remaining:
+        data = _read_full(f, min(step, remaining))
+        remaining -= len(data)
+        whole = len(data) // block_size
+        weaks = _block_weaks(data, block_size, whole)
+        if whole * block_size < len(data):
+            weaks.append(weak_checksum(data[whole * block_size:]))
+        yield b"".join(RECORD.pack(weak, strong_checksum(data[i * block_size:(i + 1) * block_size]))
+                       for i, weak in enumerate(weaks))
+
+class Signature:
+    """Parsed signature of the remote copy, indexed by weak checksum"""
+
+    def __init__(self, data: bytes):
+        if len(data) < HEADER.size:
+            raise ValueError("truncated signature")
+        self.size, self.block_size = HEADER.unpack_from(data)
+        if not MIN_BLOCK_SIZE <= self.block_size <= MAX_BLOCK_SIZE:
+            raise ValueError(f"unexpected block size {self.block_size}")
+        count = -(-self.size // self.block_size)
+        if len(data) != HEADER.size + count * RECORD.size:
+            raise ValueError("signature does not match the file size")
+        records = list(RECORD.iter_unpack(memoryview(data)[HEADER.size:]))
+        self.strongs = [strong for weak, strong in records]
+        # Only whole blocks can match at any offset; a short last block only at the end
+        self.tail = None
+        if self.size % self.block_size:
+            self.tail = (count - 1, self.size % self.block_size)
+            records.pop()
+        self.whole = len(records)
+        self.blocks: Dict[int, List[int]] = {}
+        for index, (weak, strong) in enumerate(records):
+            self.blocks.setdefault(weak, []).append(index)
+        self.weaks = self.filter = None
+        self.build_filter()
+
+    def build_filter(self) -> None:
+        """Index the weak checksums in blocks for vectorised scans
+
+        A table indexed by the low bits of (a ^ b) cheaply screens out most
+        windows; the few that pass are looked up in the sorted checksums.
+        """
+        if np is None:
+            return
+        self.weaks = np.sort(np.fromiter(self.blocks, dtype=np.uint64, count=len(self.blocks)))
+        self.filter = np.zeros(1 << FILTER_BITS, dtype=bool)
+        self.filter[((self.weaks >> 32) ^ self.weaks) & ((1 << FILTER_BITS) - 1)] = True
+
+    def match(self, data, weak: Optional[int] = None) -> Optional[int]:
+        """Index of a remote block holding exactly data, or None"""
+        if weak is None:
+            weak = weak_checksum(data)
+        indexes = self.blocks.get(weak)
+        if indexes is None:
+            return None
+        strong = strong_checksum(data)
+        return next((index for index in indexes if self.strongs[index] == strong), None)
+
+    def scan(self, buf: bytes, start: int) -> Iterator[Tuple[int, int]]:
+        """(offset, weak checksum) of each block-sized window of buf from start whose weak checksum is known"""
+        if np is not None and self.filter is not None:
+            return self._scan_vectorised(buf, start)
+        return self._scan_rolling(buf, start)
+
+    def _scan_rolling(self, buf: bytes, start: int) -> Iterator[Tuple[int, int]]:
+        size = self.block_size
+        last = len(buf) - size
+        if start > last:
+            return
+        window = buf[start:start + size]
+        a, b = sum(window), sum(accumulate(window))
+        blocks = self.blocks
+        for offset in range(start, last + 1):
+            if offset > start:
+                # Slide the window one byte: drop buf[offset - 1], take in buf[offset + size - 1]
+                out = buf[offset - 1]
+                a += buf[offset + size - 1] - out
+                b += a - size * out
+            weak = ((a & _MASK) << 32) | (b & _MASK)
+            if weak in blocks:
+                yield offset, weak
+
+    def _scan_vectorised(self, buf: bytes, start: int) -> Iterator[Tuple[int, int]]:
+        # For the window at o: a = S[o+L] - S[o] and b = (o+L)a - (T[o+L] - T[o]),
+        # where S and T are prefix sums of x[j] and j*x[j]. Only a and b mod 2**32
+        # are needed, so everything is done in wrapping uint32 arithmetic.
+        size = self.block_size
+        end = len(buf) - size + 1
+        for first in range(start, end, SCAN_SPAN):
+            count = min(SCAN_SPAN, end - first)
+            x = np.frombuffer(buf, dtype=np.uint8, count=count + size - 1, offset=first)
+            prefix = np.zeros(len(x) + 1, dtype=np.uint32)
+            np.cumsum(x, dtype=np.uint32, out=prefix[1:])
+            weighted = np.zeros(len(x) + 1, dtype=np.uint32)
+            np.cumsum(x * np.arange(len(x), dtype=np.uint32), dtype=np.uint32, out=weighted[1:])
+            a = prefix[size:size + count] - prefix[:count]
+            b = (np.arange(size, size + count, dtype=np.uint32) * a
+                 - (weighted[size:size + count] - weighted[:count]))
+            hits = np.flatnonzero(self.filter[(a ^ b) & ((1 << FILTER_BITS) - 1)])
+            weaks = (a[hits].astype(np.uint64) << 32) | b[hits]
+            if len(self.weaks):
+                found = self.weaks[np.minimum(np.searchsorted(self.weaks, weaks), len(self.weaks) - 1)] == weaks
+                hits, weaks = hits[found], weaks[found]
+            for offset, weak in zip(hits.tolist(), weaks.tolist()):
+                yield first + offset, weak
+
+class DeltaEncoder:
+    """Turns a local file into copy and literal instructions against a remote signature"""
+
+    def __init__(self, signature: Signature):
+        self.signature = signature
+        self.literal_bytes = 0
+        self.matched_bytes = 0
+        self.digest = hashlib.sha256()
+        # [first, count] of consecutive blocks still to be sent as one copy
+        self._run = None
+        # Block following the last one matched
+        self._next = 0
+
+    def encode(self, f, batch: int = 256 * 1024) -> Iterator[bytes]:
+        """The delta stream for SITE DELTA, in pieces of about batch bytes"""
+        pieces, pending = [], 0
+        for piece in self._instructions(f):
+            pieces.append(piece)
+            pending += len(piece)
+            if pending >= batch:
+                yield b"".join(pieces)
+                pieces, pending = [], 0
+        if pieces:
+            yield b"".join(pieces)
+
+    def _instructions(self, f) -> Iterator[bytes]:
+        signature = self.signature
+        size = signature.block_size
+        # buf[literal:position] is unmatched data not yet sent
+        buf, position, literal, eof = b"", 0, 0, False
+        while True:
+            if len(buf) - position < size and not eof:
+                yield from self._literal(buf[literal:position])
+                chunk = f.read(SCAN_SIZE)
+                eof = not chunk
+                self.digest.update(chunk)
+                buf, position, literal = buf[position:] + chunk, 0, 0
+                continue
+            if len(buf) - position < size:
+                break
+            # Unchanged data usually goes on with the remote copy's next block
+            index = self._next_block(buf[position:position + size])
+            if index is None:
+                for offset, weak in signature.scan(buf, position):
+                    index = signature.match(buf[offset:offset + size], weak)
+                    if index is not None:
+                        position = offset
+                        break
+                else:
+                    position = len(buf) - size + 1
+                    continue
+            yield from self._literal(buf[literal:position])
+            yield from self._copy(index, size)
+            position += size
+            literal = position
+
+        if signature.tail is not None:
+            index, length = signature.tail
+            start = len(buf) - length
+            if start >= literal and strong_checksum(buf[start:]) == signature.strongs[index]:
+                yield from self._literal(buf[literal:start])
+                yield from self._copy(index, length)
+                literal = len(buf)
+        yield from self._literal(buf[literal:])
+        yield from self._flush()
+        yield b"E" + self.digest.digest()
+
+    def _next_block(self, data: bytes) -> Optional[int]:
+        """Index of the block after the last match if data is that block, checked by strong checksum alone"""
+        index = self._next
+        if index < self.signature.whole and strong_checksum(data) == self.signature.strongs[index]:
+            return index
+        return None
+
+    def _flush(self) -> Iterator[bytes]:
+        if self._run is not None:
+            yield b"C" + COPY.pack(*self._run)
+            self._run = None
+
+    def _copy(self, index: int, length: int) -> Iterator[bytes]:
+        self.matched_bytes += length
+        self._next = index + 1
+        if self._run is not None and sum(self._run) == index:
+            self._run[1] += 1
+            return
+        yield from self._flush()
+        self._run = [index, 1]
+
+    def _literal(self, data: bytes) -> Iterator[bytes]:
+        if not data:
+            return
+        yield from self._flush()
+        for start in range(0, len(data), MAX_LITERAL):
+            piece = data[start:start + MAX_LITERAL]
+            yield b"L" + LITERAL.pack(len(piece))
+            yield piece
+        self.literal_bytes += len(data)
+
+def _read_exactly(read, size: int) -> bytes:
+    data = read(size)
+    if len(data) != size:
+        raise ConnectionError("delta stream ended early")
+    return data
+
+def apply_delta(read, basis, basis_size: int, block_size: int, writer, buffer: bytearray) -> Tuple[int, bool]:
+    """Rebuild a file into writer from a delta stream and the current copy
+
+    read(n) reads the delta stream; basis is the current copy open for
+    reading. Returns the delta bytes received and whether the rebuilt file
+    matches the SHA-256 the client sent, which fails if the current copy
+    changed since it was signed.
+    """
+    digest = hashlib.sha256()
+    view = memoryview(buffer)
+    received = 0
+    while True:
+        op = _read_exactly(read, 1)
+        received += 1
+        if op == b"C":
+            first, count = COPY.unpack(_read_exactly(read, COPY.size))
+            received += COPY.size
+            start = first * block_size
+            if not count or start + (count - 1) * block_size >= basis_size:
+                raise ValueError("delta refers to blocks past the end of the file")
+            remaining = min(count * block_size, basis_size - start)
+            basis.seek(start)
+            while remaining:
+                n = basis.readinto(view[:min(len(view), remaining)])
+                if not n:
+                    raise ValueError("file changed while it was being read")
+                writer.write(view[:n])
+                digest.update(view[:n])
+                remaining -= n
+        elif op == b"L":
+            (remaining,) = LITERAL.unpack(_read_exactly(read, LITERAL.size))
+            if remaining > MAX_LITERAL:
+                raise ValueError("delta literal too long")
+            received += LITERAL.size + remaining
+            while remaining:
+                data = _read_exactly(read, min(len(view), remaining))
+                writer.write(data)
+                digest.update(data)
+                remaining -= len(data)
+        elif op == b"E":
+            expected = _read_exactly(read, END_SIZE)
+            return received + END_SIZE, digest.digest() == expected
+        else:
+            raise ValueError(f"unknown delta instruction {op!r}")
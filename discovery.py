@@ -0,0 +1,246 @@
+"""
+Discovery module for TermShare
+Finds other TermShare instances on the LAN over UDP multicast and sends files to them
+"""
+
+import os
+import json
+import time
+import select
+import socket
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+# Administratively scoped group; announcements stay on the local network
+MULTICAST_GROUP = "239.255.42.99"
+MULTICAST_PORT = 42199
+
+# Seconds between announcements; peers are forgotten after missing three
+ANNOUNCE_INTERVAL = 2.0
+
+# Largest announcement accepted
+MAX_MESSAGE = 1024
+
+class Peer(NamedTuple):
+    """A TermShare instance whose server is reachable at host:port"""
+    name: str
+    host: str
+    port: int
+    tls: bool
+    instance: str
+    expires: float
+
+class PeerDiscovery:
+    """Announces this instance's server and keeps a live list of other instances
+
+    Messages are small JSON datagrams: "announce" (name and port), "query"
+    (asks servers to announce now, so a new instance does not wait a full
+    interval) and "bye" (the server stopped). The host of a peer is always
+    the source address of its announcements; a "host" field naming another
+    machine is ignored, so an announcement cannot point peers at a third
+    party's server.
+    on_change(peers) is called from the discovery thread whenever the list
+    changes. interface selects the network for multicast, e.g. "127.0.0.1"
+    to keep discovery on this machine.
+    """
+
+    def __init__(self, name: str, on_change: Optional[Callable[[List[Peer]], None]] = None,
+                 group: str = MULTICAST_GROUP, port: int = MULTICAST_PORT,
+                 interface: str = "0.0.0.0", interval: float = ANNOUNCE_INTERVAL, ttl: int = 1):
+        self.name = name
+        self.on_change = on_change
+        self.group = group
+        self.port = port
+        self.interface = interface
+        self.interval = interval
+        self.ttl = ttl
+        self.instance = os.urandom(8).hex()
+        # What this instance announces; server_port None means nothing to announce
+        self.server_port = None
+        self.tls = False
+        self.peers = {}
+        self.lock = threading.Lock()
+        self.sock = None
+        self.thread = None
+        self.running = False
+        self.next_announce = 0.0
+
+    def start(self) -> Tuple[bool, str]:
+        """Join the multicast group and start listening"""
+        if self.running:
+            return False, "Discovery is already running"
+        try:
+            self.sock = self._open_socket()
+        except OSError as e:
+            return False, f"Peer discovery unavailable: {e}"
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        self._send({"type": "query"})
+        return True, f"Discovering peers on {self.group}:{self.port}"
+
+    def stop(self) -> Tuple[bool, str]:
+        """Say goodbye and leave the multicast group"""
+        if not self.running:
+            return False, "Discovery is not running"
+        if self.server_port is not None:
+            self._send({"type": "bye"})
+        self.running = False
+        self.thread.join(timeout=1)
+        self.sock.close()
+        return True, "Discovery stopped"
+
+    def _open_socket(self) -> socket.socket:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        try:
+            # Several instances on one machine share the discovery port
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if hasattr(socket, "SO_REUSEPORT"):
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind(("", self.port))
+            interface = socket.inet_aton(self.interface)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                            struct.pack("4s4s", socket.inet_aton(self.group), interface))
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, interface)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, self.ttl)
+            # Instances on the same machine must hear each other
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def announce(self, port: Optional[int], name: Optional[str] = None, tls: bool = False) -> None:
+        """Advertise a server on port (None withdraws it) under name"""
+        if name is not None:
+            self.name = name
+        withdrawn = port is None and self.server_port is not None
+        self.server_port, self.tls = port, tls
+        if withdrawn:
+            self._send({"type": "bye"})
+        elif port is not None:
+            self._announce_now()
+
+    def _announce_now(self) -> None:
+        message = {"type": "announce", "name": self.name, "port": self.server_port,
+                   "tls": self.tls, "expires": 3 * self.interval}
+        self._send(message)
+        self.next_announce = time.monotonic() + self.interval
+
+    def _send(self, message: dict) -> None:
+        if self.sock is None or not self.running:
+            return
+        message.update(app="termshare", version=1, instance=self.instance)
+        try:
+            self.sock.sendto(json.dumps(message).encode(), (self.group, self.port))
+        except OSError:
+            # No route to the group (e.g. no network yet); the next interval retries
+            pass
+
+    def list_peers(self) -> List[Peer]:
+        """Peers currently announcing a server, sorted by name"""
+        with self.lock:
+            return sorted(self.peers.values(), key=lambda peer: (peer.name.lower(), peer.host, peer.port))
+
+    def _run(self) -> None:
+        while self.running:
+            now = time.monotonic()
+            if self.server_port is not None and now >= self.next_announce:
+                self._announce_now()
+            changed = self._expire(now)
+            timeout = self._timeout(now)
+            try:
+                readable, _, _ = select.select([self.sock], [], [], timeout)
+                if readable:
+                    data, address = self.sock.recvfrom(MAX_MESSAGE)
+                    changed |= self._receive(data, address[0])
+            except (OSError, ValueError):
+                # Socket closed by stop()
+                break
+            if changed and self.on_change is not None:
+                self.on_change(self.list_peers())
+
+    def _receive(self, data: bytes, source: str) -> bool:
+        """Apply one message; returns True if the peer list changed"""
+        try:
+            message = json.loads(data)
+            if message.get("app") != "termshare" or message.get("instance") == self.instance:
+                return False
+            kind = message.get("type")
+            instance = str(message["instance"])
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return False
+        if kind == "query":
+            if self.server_port is not None:
+                self._announce_now()
+            return False
+        if kind == "bye":
+            with self.lock:
+                return self.peers.pop(instance, None) is not None
+        if kind != "announce":
+            return False
+        try:
+            peer = Peer(str(message["name"]), source, int(message["port"]),
+                        bool(message.get("tls")), instance,
+                        time.monotonic() + float(message.get("expires", 3 * self.interval)))
+        except (KeyError, TypeError, ValueError):
+            return False
+        with self.lock:
+            previous = self.peers.get(instance)
+            self.peers[instance] = peer
+        if previous is None and self.server_port is not None:
+            # Let the newcomer see this instance without waiting an interval
+            self._announce_now()
+        return previous is None or previous[:4] != peer[:4]
+
+    def _timeout(self, now: float) -> float:
+        """Seconds until the next announcement is due or a peer expires"""
+        deadline = now + self.interval
+        if self.server_port is not None:
+            deadline = min(deadline, self.next_announce)
+        with self.lock:
+            if self.peers:
+                deadline = min(deadline, min(peer.expires for peer in self.peers.values()))
+        return max(0.0, deadline - now)
+
+    def _expire(self, now: float) -> bool:
+        with self.lock:
+            stale = [instance for instance, peer in self.peers.items() if peer.expires < now]
+            for instance in stale:
+                del self.peers[instance]
+        return bool(stale)
+
+def send_to_peers(peers: List[Peer], local_path: str, remote_path: Optional[str] = None,
+                  user: str = "anonymous", password: str = "", tls_context=None,
+                  max_workers: int = 8, on_result: Optional[Callable] = None) -> List[Tuple[Peer, bool, str]]:
+    """Upload one file to several peers at once
+
+    Each peer gets its own connection; up to max_workers uploads run in
+    parallel. Peers announcing TLS are connected with tls_context, or a
+    default context if none is given. on_result(peer, success, message) is
+    called as each upload finishes. Returns the results in peer order.
+    """
+    from ftp_client import FTPClient
+    remote_path = remote_path or os.path.basename(local_path)
+
+    def send(peer: Peer) -> Tuple[Peer, bool, str]:
+        tls = None
+        if peer.tls:
+            import ssl
+            tls = tls_context or ssl.create_default_context()
+        client = FTPClient(tls=tls, auto_reconnect=False)
+        success, message = client.connect(peer.host, peer.port, user, password)
+        if success:
+            success, message = client.upload_file(local_path, remote_path)
+            client.disconnect()
+        message = f"{peer.name} ({peer.host}:{peer.port}): {message}"
+        if on_result is not None:
+            on_result(peer, success, message)
+        return peer, success, message
+
+    if not peers:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(peers))) as pool:
+        return list(pool.map(send, peers))
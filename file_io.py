@@ -0,0 +1,251 @@
+"""
+Local file I/O module for TermShare
+Handles preallocated, buffer-reusing disk access for file transfers
+"""
+
+import os
+import mmap
+import stat
+import errno
+from typing import Iterator, Optional
+
+# Size of the reusable transfer buffer
+CHUNK_SIZE = 256 * 1024
+
+# fallocate() flag that reserves space without changing the file's length
+FALLOC_FL_KEEP_SIZE = 1
+
+_LIBC = None
+
+def load_libc():
+    """The C library through ctypes, or None where it cannot be loaded"""
+    global _LIBC
+    if _LIBC is None:
+        # Imported here: most transfers never need it
+        import ctypes
+        import ctypes.util
+        try:
+            _LIBC = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        except (OSError, TypeError):
+            _LIBC = False
+    return _LIBC or None
+
+def part_path(path: str) -> str:
+    """Hidden file next to path that an incomplete download is written to"""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}.termshare-part")
+
+def is_special_file(path: str) -> bool:
+    """Whether path exists and is not a regular file (e.g. /dev/null or a pipe), so it cannot be renamed over"""
+    try:
+        return not stat.S_ISREG(os.stat(path).st_mode)
+    except OSError:
+        return False
+
+def lock_file(fd: int) -> bool:
+    """Take an exclusive lock on an open file without waiting; False if another writer holds it"""
+    try:
+        import fcntl
+    except ImportError:
+        fcntl = None
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            import msvcrt
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+def preallocate(fd: int, size: int, keep_size: bool = False) -> bool:
+    """Reserve disk space for a file of the given size, if supported
+
+    With keep_size the file's length is left alone (Linux only), so that it
+    keeps saying how much has really been written.
+    """
+    if size <= 0:
+        return False
+    if keep_size:
+        return _preallocate_keep_size(fd, size)
+    if not hasattr(os, 'posix_fallocate'):
+        return False
+    try:
+        os.posix_fallocate(fd, 0, size)
+        return True
+    except OSError:
+        # Not supported by this filesystem (e.g. tmpfs on older kernels)
+        return False
+
+def _preallocate_keep_size(fd: int, size: int) -> bool:
+    libc = load_libc()
+    fallocate = getattr(libc, 'fallocate64', None) or getattr(libc, 'fallocate', None) if libc else None
+    if fallocate is None:
+        return False
+    import ctypes
+    fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+    # Fails with EOPNOTSUPP on filesystems without it; the write just goes unreserved
+    return fallocate(fd, FALLOC_FL_KEEP_SIZE, 0, size) == 0
+
+def advise(fd: int, advice_name: str, offset: int = 0, length: int = 0) -> None:
+    """Apply a posix_fadvise hint such as 'SEQUENTIAL' or 'DONTNEED', if supported"""
+    advice = getattr(os, f'POSIX_FADV_{advice_name}', None)
+    if advice is None or not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        os.posix_fadvise(fd, offset, length, advice)
+    except OSError:
+        pass
+
+class FileWriter:
+    """Positional writer that preallocates the target file once its size is known
+
+    With keep_size the preallocation does not extend the file, so after a
+    crash its length is still the amount written (for sequential writes).
+    With lock, the file is locked before it is truncated, and OSError(EBUSY)
+    is raised if another writer already holds it.
+    """
+
+    def __init__(self, path: str, size: Optional[int] = None, truncate: bool = True,
+                 keep_size: bool = False, lock: bool = False):
+        flags = os.O_WRONLY | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+        if truncate and not lock:
+            flags |= os.O_TRUNC
+        self.path = path
+        self.fd = os.open(path, flags, 0o644)
+        if lock:
+            if not lock_file(self.fd):
+                os.close(self.fd)
+                self.fd = None
+                raise OSError(errno.EBUSY, "Another transfer is writing this file", path)
+            if truncate:
+                os.ftruncate(self.fd, 0)
+        self.offset = 0
+        self.size = None
+        self.keep_size = keep_size
+        # Set once the file turns out to be a pipe, which only takes sequential writes
+        self.stream = False
+        advise(self.fd, 'SEQUENTIAL')
+        if size is not None:
+            self.preallocate(size)
+
+    def preallocate(self, size: int) -> None:
+        """Preallocate the file to its final size"""
+        if preallocate(self.fd, size, self.keep_size) and not self.keep_size:
+            # Only a file that was extended needs trimming on close
+            self.size = size
+
+    def seek(self, offset: int) -> None:
+        """Move the write position (used when resuming a transfer)"""
+        self.offset = offset
+
+    def write(self, data) -> int:
+        """Write a chunk at the current position without an intermediate copy"""
+        written = self.pwrite(data, self.offset)
+        self.offset += written
+        return written
+
+    def pwrite(self, data, offset: int) -> int:
+        """Write a chunk at an explicit offset, leaving the current position alone"""
+        view = memoryview(data)
+        total = 0
+        while total < len(view):
+            if self.stream:
+                n = os.write(self.fd, view[total:])
+            elif hasattr(os, 'pwrite'):
+                try:
+                    n = os.pwrite(self.fd, view[total:], offset + total)
+                except OSError as e:
+                    if e.errno != errno.ESPIPE:
+                        raise
+                    self.stream = True
+                    continue
+            else:
+                os.lseek(self.fd, offset + total, os.SEEK_SET)
+                n = os.write(self.fd, view[total:])
+            total += n
+        return total
+
+    def sync(self) -> None:
+        """Flush written data to disk, e.g. before recording how much of it is safe"""
+        try:
+            getattr(os, 'fdatasync', os.fsync)(self.fd)
+        except OSError as e:
+            # Devices and pipes have nothing to flush
+            if e.errno != errno.EINVAL:
+                raise
+
+    def close(self) -> None:
+        """Close the file, trimming any preallocated tail that was never written"""
+        if self.fd is None:
+            return
+        try:
+            if self.size is not None and self.offset < self.size:
+                os.ftruncate(self.fd, self.offset)
+            # Written pages are not needed in the page cache once on disk
+            advise(self.fd, 'DONTNEED')
+        finally:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+class FileReader:
+    """Sequential reader that serves file contents as memoryviews without copying"""
+
+    def __init__(self, path: str, buffer: Optional[bytearray] = None):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.fd = self.file.fileno()
+        self.size = os.fstat(self.fd).st_size
+        self.buffer = buffer
+        self.map = None
+        advise(self.fd, 'SEQUENTIAL')
+        if self.size > 0:
+            try:
+                self.map = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                # Special files cannot be mapped; fall back to readinto()
+                self.map = None
+
+    def chunks(self, offset: int = 0, chunk_size: int = CHUNK_SIZE) -> Iterator[memoryview]:
+        """Yield the file contents from offset onwards as memoryviews"""
+        if self.map is not None:
+            view = memoryview(self.map)
+            try:
+                for start in range(offset, self.size, chunk_size):
+                    yield view[start:start + chunk_size]
+            finally:
+                view.release()
+            return
+
+        if self.buffer is None or len(self.buffer) < chunk_size:
+            self.buffer = bytearray(chunk_size)
+        view = memoryview(self.buffer)[:chunk_size]
+        self.file.seek(offset)
+        while True:
+            n = self.file.readinto(view)
+            if not n:
+                break
+            yield view[:n]
+
+    def close(self) -> None:
+        """Release the mapping and close the file"""
+        if self.map is not None:
+            try:
+                self.map.close()
+            except BufferError:
+                # A caller still holds a chunk; the mapping is freed with it
+                pass
+            self.map = None
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
\ No newline at end of file
@@ -4,81 +4,820 @@ Handles all FTP client operations with asyncio support
 """
 
 import os
+import ssl
+import time
+import errno
+import hashlib
+import socket
+import struct
 import ftplib
+import functools
+import threading
 from ftplib import FTP
 import asyncio
-from typing import Tuple, List, Optional
+from typing import Callable, Tuple, List, Optional
+from delta import DeltaEncoder, Signature, block_size_for
+from file_io import CHUNK_SIZE, FileReader, FileWriter, is_special_file, part_path
+from metrics import DISABLED, MetricsRegistry
+from tracing import NULL_TRACER
+
+# How much data goes into each checkpoint reported to a download or upload's checkpoint callback
+CHECKPOINT_BYTES = 64 * 1024 * 1024
+
+def _instrumented(operation: str):
+    """Time a client operation and trace it when metrics or tracing are enabled"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not self.metrics.enabled and not self.tracer.enabled:
+                return method(self, *args, **kwargs)
+            start = time.perf_counter()
+            try:
+                with self.tracer.span(operation, args=" ".join(str(arg) for arg in args[:2])):
+                    return method(self, *args, **kwargs)
+            finally:
+                self._operation_seconds.observe(time.perf_counter() - start, operation=operation)
+        return wrapper
+    return decorator
+
+# Socket errors that mean the control connection itself is gone
+_LOST_ERRNOS = {errno.EBADF, errno.ENOTCONN, errno.ENETDOWN, errno.ENETUNREACH, errno.EHOSTUNREACH}
+
+def _connection_lost(e: BaseException) -> bool:
+    """Whether an exception means the server connection died rather than a command failing"""
+    if isinstance(e, ftplib.error_temp):
+        # 421: the server is closing the control connection
+        return str(e).startswith('421')
+    if isinstance(e, (EOFError, ConnectionError, TimeoutError, ssl.SSLEOFError, ssl.SSLZeroReturnError)):
+        return True
+    return isinstance(e, OSError) and e.errno in _LOST_ERRNOS
+
+def _check_reply(reply: str) -> str:
+    """Raise the ftplib error matching a failed reply, as ftplib itself would"""
+    if reply[:1] == '4':
+        raise ftplib.error_temp(reply)
+    if reply[:1] == '5':
+        raise ftplib.error_perm(reply)
+    if reply[:1] not in ('1', '2', '3'):
+        raise ftplib.error_proto(reply)
+    return reply
+
+def _parse_hash(reply: str) -> str:
+    """The hex digest from a HASH reply, e.g. 213 SHA-256 0-49 <digest> name"""
+    fields = _check_reply(reply).split(None, 4)
+    if len(fields) < 4 or fields[1].upper() != 'SHA-256':
+        raise ftplib.error_proto(reply)
+    return fields[3].lower()
+
+class _Checkpoints:
+    """Hashes transferred data in fixed-size segments and reports each finished one
+
+    callback(start, end, sha256) is called once a segment is complete (and,
+    with sync, once it is on disk), and by flush() for a final partial one.
+    """
+
+    def __init__(self, callback: Callable[[int, int, str], None], start: int, interval: int,
+                 sync: Optional[Callable[[], None]] = None):
+        self.callback = callback
+        self.interval = interval
+        self.sync = sync
+        self.start = self.position = start
+        self.digest = hashlib.sha256()
+
+    def update(self, data) -> None:
+        view = memoryview(data)
+        while len(view):
+            take = min(len(view), self.start + self.interval - self.position)
+            self.digest.update(view[:take])
+            self.position += take
+            view = view[take:]
+            if self.position - self.start >= self.interval:
+                self.flush()
+
+    def flush(self) -> None:
+        if self.position == self.start:
+            return
+        if self.sync is not None:
+            self.sync()
+        self.callback(self.start, self.position, self.digest.hexdigest())
+        self.start = self.position
+        self.digest = hashlib.sha256()
+
+def _session(retry: bool = True, **retry_kwargs):
+    """Serialise use of the control connection and reconnect when it has died
+
+    If the operation failed because the connection was lost, the client
+    reconnects and, when retry is set, runs it once more with retry_kwargs
+    (e.g. resume=True so a transfer continues where it stopped).
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self._lock:
+                self._lost = None
+                result = method(self, *args, **kwargs)
+                if not result[0] and self._lost is not None and self.auto_reconnect:
+                    if not self._reconnect():
+                        message = "Connection to server lost; reconnecting failed"
+                        result = False, [message] if isinstance(result[1], list) else message
+                    elif retry:
+                        kwargs.update(retry_kwargs)
+                        result = method(self, *args, **kwargs)
+                self._last_activity = time.monotonic()
+                return result
+        return wrapper
+    return decorator
+
+class _TLSFTP(ftplib.FTP_TLS):
+    """FTP_TLS whose data connections resume the control connection's TLS session"""
+
+    def __init__(self, context: ssl.SSLContext, handshakes):
+        super().__init__(context=context)
+        self.handshakes = handshakes
+
+    def secure_data(self, conn: socket.socket) -> socket.socket:
+        """Start TLS on a data connection when PROT P is in effect"""
+        if not self._prot_p:
+            return conn
+        # Handshake flights and close_notify are small writes; don't let Nagle delay them
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = self.context.wrap_socket(conn, server_hostname=self.host, session=self.sock.session)
+        self.handshakes.inc(channel="data", resumed=str(conn.session_reused).lower())
+        return conn
+
+    def ntransfercmd(self, cmd, rest=None):
+        # Skip FTP_TLS.ntransfercmd, which always performs a full handshake
+        conn, size = ftplib.FTP.ntransfercmd(self, cmd, rest)
+        return self.secure_data(conn), size
 
 class FTPClient:
-    def __init__(self):
+    def __init__(self, metrics: Optional[MetricsRegistry] = None, tracer=None,
+                 tls: Optional[ssl.SSLContext] = None, keepalive: Optional[float] = 60.0,
+                 auto_reconnect: bool = True, reconnect_attempts: int = 5):
         self.ftp = None
         self.connected = False
         self.host = None
         self.port = None
+        self.username = None
+        self.tls = tls
+        self.cwd = None
+        self.keepalive = keepalive
+        self.auto_reconnect = auto_reconnect
+        self.reconnect_attempts = reconnect_attempts
+        self._credentials = None
+        self._buffer = bytearray(CHUNK_SIZE)
+        self.checkpoint_bytes = CHECKPOINT_BYTES
+        self._lock = threading.RLock()
+        self._lost = None
+        self._last_activity = time.monotonic()
+        self._keepalive_stop = None
+        
+        self.metrics = metrics or DISABLED
+        self.tracer = tracer or NULL_TRACER
+        self._operation_seconds = self.metrics.histogram(
+            "termshare_client_operation_seconds", "Duration of client operations")
+        self._transfer_seconds = self.metrics.histogram(
+            "termshare_client_transfer_seconds", "Duration of file transfers")
+        self._bytes_sent = self.metrics.counter(
+            "termshare_client_bytes_sent_total", "File bytes uploaded")
+        self._bytes_received = self.metrics.counter(
+            "termshare_client_bytes_received_total", "File bytes downloaded")
+        self._signature_bytes = self.metrics.counter(
+            "termshare_client_delta_signature_bytes_total", "Block signature bytes fetched for delta uploads")
+        self._errors = self.metrics.counter(
+            "termshare_client_errors_total", "Failed client operations by exception type")
+        self._tls_handshakes = self.metrics.counter(
+            "termshare_client_tls_handshakes_total", "TLS handshakes by channel and session resumption")
+        self._reconnects = self.metrics.counter(
+            "termshare_client_reconnects_total", "Reconnects after a lost control connection by outcome")
         
+    def _failed(self, e: Exception) -> None:
+        """Count a failed operation and note whether the connection was lost"""
+        self._errors.inc(type=type(e).__name__)
+        if _connection_lost(e):
+            self._lost = e
+    
+    def _open(self, host: str, port: int, username: str, password: str) -> None:
+        """Open and log in a control connection, using explicit FTPS when tls is set"""
+        if self.tls is not None:
+            ftp = _TLSFTP(self.tls, self._tls_handshakes)
+        else:
+            ftp = FTP()
+        try:
+            ftp.connect(host, port)
+            self._tune_control(ftp.sock)
+            if self.tls is not None:
+                with self.tracer.span("tls_handshake"):
+                    ftp.auth()
+                self._tls_handshakes.inc(channel="control", resumed="false")
+            ftp.login(username, password)
+            if self.tls is not None:
+                ftp.prot_p()
+        except Exception:
+            ftp.close()
+            raise
+        self.ftp = ftp
+    
+    def _tune_control(self, sock: socket.socket) -> None:
+        """Enable TCP keepalive so NAT state survives long transfers and dead peers are noticed"""
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        idle = max(1, int(self.keepalive or 60))
+        for name, value in (('TCP_KEEPIDLE', idle), ('TCP_KEEPINTVL', 10), ('TCP_KEEPCNT', 3)):
+            if hasattr(socket, name):
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), value)
+    
+    @_instrumented("connect")
     def connect(self, host: str, port: int, username: str, password: str) -> Tuple[bool, str]:
-        """Connect to FTP server"""
-        try:
-            self.ftp = FTP()
-            self.ftp.connect(host, port)
-            self.ftp.login(username, password)
-            self.connected = True
-            self.host = host
-            self.port = port
-            return True, "Connected successfully"
-        except Exception as e:
-            return False, f"Connection failed: {str(e)}"
+        """Connect to FTP server, using explicit FTPS (AUTH TLS, PROT P) when tls is set"""
+        with self._lock:
+            try:
+                self._open(host, port, username, password)
+                self.connected = True
+                self.host = host
+                self.port = port
+                self.username = username
+                self.cwd = None
+                self._credentials = (username, password)
+                self._last_activity = time.monotonic()
+                self._start_keepalive()
+                return True, "Connected successfully"
+            except Exception as e:
+                self._errors.inc(type=type(e).__name__)
+                return False, f"Connection failed: {str(e)}"
+    
+    def _reconnect(self) -> bool:
+        """Replace a dead control connection, logging in again and restoring the working directory"""
+        try:
+            self.ftp.close()
+        except Exception:
+            pass
+        for attempt in range(self.reconnect_attempts):
+            if attempt:
+                time.sleep(min(0.5 * 2 ** (attempt - 1), 10.0))
+            try:
+                with self.tracer.span("reconnect", attempt=attempt + 1):
+                    self._open(self.host, self.port, *self._credentials)
+                    if self.cwd:
+                        self.ftp.cwd(self.cwd)
+                self._reconnects.inc(outcome="success")
+                return True
+            except Exception as e:
+                self._errors.inc(type=type(e).__name__)
+        self._reconnects.inc(outcome="failure")
+        # Report the truth instead of failing every later call
+        self.connected = False
+        self._stop_keepalive()
+        return False
+    
+    def _start_keepalive(self) -> None:
+        """Start the NOOP timer for this connection"""
+        self._stop_keepalive()
+        if not self.keepalive:
+            return
+        stop = self._keepalive_stop = threading.Event()
+        threading.Thread(target=self._keepalive_loop, args=(stop,), daemon=True).start()
+    
+    def _stop_keepalive(self) -> None:
+        if self._keepalive_stop is not None:
+            self._keepalive_stop.set()
+            self._keepalive_stop = None
+    
+    def _keepalive_loop(self, stop: threading.Event) -> None:
+        """Send NOOP whenever the control connection has been idle for keepalive seconds"""
+        while True:
+            remaining = self._last_activity + self.keepalive - time.monotonic()
+            if stop.wait(max(remaining, 0.05)):
+                return
+            if self._last_activity + self.keepalive > time.monotonic():
+                continue
+            # A busy connection needs no keepalive; TCP keepalive covers long transfers
+            if not self._lock.acquire(blocking=False):
+                self._last_activity = time.monotonic()
+                continue
+            try:
+                if stop.is_set() or not self.connected:
+                    return
+                try:
+                    self.ftp.voidcmd('NOOP')
+                except Exception as e:
+                    self._errors.inc(type=type(e).__name__)
+                    if _connection_lost(e) and self.auto_reconnect:
+                        self._reconnect()
+                self._last_activity = time.monotonic()
+            finally:
+                self._lock.release()
     
     def disconnect(self) -> Tuple[bool, str]:
         """Disconnect from FTP server"""
-        if self.connected:
-            try:
-                self.ftp.quit()
-            except:
+        with self._lock:
+            self._stop_keepalive()
+            if self.connected:
                 try:
-                    self.ftp.close()
+                    self.ftp.quit()
                 except:
-                    pass
-            self.connected = False
-            return True, "Disconnected"
-        return False, "Not connected"
+                    try:
+                        self.ftp.close()
+                    except:
+                        pass
+                self.connected = False
+                return True, "Disconnected"
+            return False, "Not connected"
     
+    @_instrumented("list")
+    @_session()
     def list_files(self) -> Tuple[bool, List[str]]:
         """List files in directory"""
         if not self.connected:
             return False, ["Not connected to server"]
         
         try:
-            files = []
-            self.ftp.retrlines('LIST', files.append)
+            with self.tracer.span("control"):
+                self.ftp.voidcmd('TYPE A')
+            with self.tracer.span("data_setup"):
+                conn = self.ftp.transfercmd('LIST')
+            files = self._read_listing(conn)
+            with self.tracer.span("completion"):
+                self.ftp.voidresp()
             return True, files
         except Exception as e:
+            self._failed(e)
             return False, [f"Failed to list files: {str(e)}"]
     
-    def download_file(self, remote_path: str, local_path: str) -> Tuple[bool, str]:
-        """Download a file"""
+    @_instrumented("listing")
+    @_session()
+    def get_listing(self) -> Tuple[bool, object]:
+        """Get the current directory and its listing, pipelining PWD ahead of LIST"""
+        if not self.connected:
+            return False, "Not connected to server"
+        
+        try:
+            passive = 'PASV' if self.ftp.af == socket.AF_INET else 'EPSV'
+            with self.tracer.span("control"):
+                replies = self._pipeline(['PWD', 'TYPE A', passive])
+            for success, reply in replies:
+                _check_reply(reply)
+            current_dir = self.cwd = ftplib.parse257(replies[0][1])
+            with self.tracer.span("data_setup"):
+                conn = self._connect_passive(replies[2][1])
+                try:
+                    reply = self.ftp.sendcmd('LIST')
+                    if reply[0] != '1':
+                        raise ftplib.error_reply(reply)
+                    conn = self._secure_data(conn)
+                except Exception:
+                    conn.close()
+                    raise
+            files = self._read_listing(conn)
+            with self.tracer.span("completion"):
+                self.ftp.voidresp()
+            return True, (current_dir, files)
+        except Exception as e:
+            self._failed(e)
+            return False, f"Failed to list files: {str(e)}"
+    
+    @_instrumented("batch")
+    @_session(retry=False)
+    def run_batch(self, commands: List[str], window: int = 512) -> Tuple[bool, object]:
+        """Pipeline independent control commands such as MKD, SIZE, MDTM, DELE or RNFR/RNTO
+        
+        Returns one (success, reply) pair per command, in order, so each
+        failure is reported separately.
+        """
+        if window < 1:
+            return False, "Batch window must be at least 1"
+        if not self.connected:
+            return False, "Not connected to server"
+        
+        try:
+            return True, self._pipeline(commands, window)
+        except Exception as e:
+            self._failed(e)
+            return False, f"Batch failed: {str(e)}"
+    
+    def _pipeline(self, commands: List[str], window: int = 512) -> List[Tuple[bool, str]]:
+        """Send commands without waiting for each reply, keeping at most window in flight"""
+        for command in commands:
+            if '\r' in command or '\n' in command:
+                raise ValueError("an illegal newline character should not be contained")
+        results = []
+        sent = 0
+        while len(results) < len(commands):
+            # Top up in bursts so each send carries many commands
+            if sent < len(commands) and sent - len(results) <= window // 2:
+                end = min(len(commands), len(results) + window)
+                payload = "".join(command + "\r\n" for command in commands[sent:end])
+                self.ftp.sock.sendall(payload.encode(self.ftp.encoding))
+                sent = end
+            reply = self.ftp.getmultiline()
+            results.append((reply[:1] in ('1', '2', '3'), reply))
+        return results
+    
+    def _connect_passive(self, reply: str) -> socket.socket:
+        """Open a data connection from a PASV or EPSV reply"""
+        peer = self.ftp.sock.getpeername()
+        if reply.startswith('227'):
+            host, port = ftplib.parse227(reply)
+            if not self.ftp.trust_server_pasv_ipv4_address:
+                host = peer[0]
+        else:
+            host, port = ftplib.parse229(reply, peer)
+        return socket.create_connection((host, port), self.ftp.timeout,
+                                        source_address=self.ftp.source_address)
+    
+    def _secure_data(self, conn: socket.socket) -> socket.socket:
+        """Start TLS on a data connection opened outside transfercmd()"""
+        if isinstance(self.ftp, _TLSFTP):
+            return self.ftp.secure_data(conn)
+        return conn
+    
+    def _close_data(self, conn: socket.socket, abort: bool = False) -> None:
+        """Close a data connection, first exchanging TLS close_notify unless aborting
+
+        An aborted connection is reset (SO_LINGER 0) rather than closed with a
+        FIN, so the server sees an error instead of a clean end of data and
+        keeps the upload staged for resuming instead of committing it. The
+        server still answers the aborted transfer; that reply is read and
+        dropped so the next command on this session gets its own reply.
+        """
+        if abort:
+            try:
+                conn.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+            except OSError:
+                pass
+            conn.close()
+            try:
+                self.ftp.getresp()
+            except ftplib.all_errors:
+                pass
+            return
+        if isinstance(conn, ssl.SSLSocket):
+            try:
+                conn.unwrap()
+            except (OSError, ValueError):
+                # The payload is complete; a peer that skips close_notify is harmless here
+                pass
+        conn.close()
+    
+    def _read_listing(self, conn) -> List[str]:
+        """Read LIST output lines from a data connection"""
+        files = []
+        aborted = True
+        with self.tracer.span("transfer") as span:
+            try:
+                with conn.makefile('r', encoding=self.ftp.encoding) as fp:
+                    for line in fp:
+                        files.append(line.rstrip('\r\n'))
+                aborted = False
+            finally:
+                self._close_data(conn, aborted)
+            span.set("entries", len(files))
+        return files
+    
+    @_instrumented("download")
+    @_session(resume=True)
+    def download_file(self, remote_path: str, local_path: str, resume: bool = False,
+                      checkpoint: Optional[Callable[[int, int, str], None]] = None) -> Tuple[bool, str]:
+        """Download a file; with resume, continue an earlier interrupted download
+
+        Data goes to a hidden part file next to local_path, renamed over it
+        once complete, so local_path never holds a partial download. The
+        part file is locked while in use, so two downloads to the same file
+        cannot share it, and preallocated without growing it, so its length
+        is how much has been received and resume can trust it. A device or
+        pipe such as os.devnull is written directly. checkpoint(start,
+        end, sha256) is called for every checkpoint_bytes received, once
+        they are on disk, and for the remainder when the transfer stops.
+        """
         if not self.connected:
             return False, "Not connected to server"
         
         try:
-            with open(local_path, 'wb') as f:
-                self.ftp.retrbinary(f'RETR {remote_path}', f.write)
+            with self.tracer.span("control"):
+                self.ftp.voidcmd('TYPE I')
+                size = self._remote_size(remote_path)
+            special = is_special_file(local_path)
+            part = local_path if special else part_path(local_path)
+            offset = 0
+            if resume and not special and size is not None and os.path.isfile(part):
+                offset = os.path.getsize(part)
+                if offset > size:
+                    offset = 0
+            with self.tracer.span("disk_io", phase="open"):
+                writer = FileWriter(part, truncate=offset == 0 and not special, keep_size=True,
+                                    lock=not special)
+                if size is not None and not special:
+                    writer.preallocate(size)
+                writer.seek(offset)
+            checkpoints = _Checkpoints(checkpoint, offset, self.checkpoint_bytes, writer.sync) if checkpoint else None
+            try:
+                start = time.perf_counter()
+                with self.tracer.span("data_setup"):
+                    conn = self.ftp.transfercmd(f'RETR {remote_path}', rest=offset or None)
+                with self.tracer.span("transfer") as span:
+                    aborted = True
+                    try:
+                        received = self._receive_into(conn, writer, span, checkpoints)
+                        aborted = False
+                    finally:
+                        self._close_data(conn, aborted)
+                with self.tracer.span("completion"):
+                    self.ftp.voidresp()
+                self._bytes_received.inc(received)
+                self._transfer_seconds.observe(time.perf_counter() - start, direction="download")
+                if size is not None and writer.offset != size:
+                    # e.g. a TLS stream cut off without close_notify; keep the part for resume
+                    raise ftplib.error_temp(f"426 Transfer incomplete: got {writer.offset} of {size} bytes")
+                if not special and os.name != 'nt':
+                    # Rename while the part is still locked, so no other download can reopen it meanwhile
+                    os.replace(part, local_path)
+            finally:
+                with self.tracer.span("disk_io", phase="close"):
+                    try:
+                        if checkpoints is not None:
+                            checkpoints.flush()
+                    finally:
+                        # Always release the part file's lock
+                        writer.close()
+            if not special and os.name == 'nt':
+                # Windows cannot rename a file that is still open
+                os.replace(part, local_path)
             return True, f"Downloaded {remote_path} to {local_path}"
         except Exception as e:
+            self._failed(e)
             return False, f"Download failed: {str(e)}"
     
-    def upload_file(self, local_path: str, remote_path: str) -> Tuple[bool, str]:
-        """Upload a file"""
+    @_instrumented("upload")
+    @_session(resume=True)
+    def upload_file(self, local_path: str, remote_path: str, resume: bool = False,
+                    checkpoint: Optional[Callable[[int, int, str], None]] = None) -> Tuple[bool, str]:
+        """Upload a file; with resume, continue from the end of an existing partial remote file
+
+        checkpoint(start, end, sha256) is called for every checkpoint_bytes
+        sent, and for the remainder when the transfer stops.
+        """
         if not self.connected:
             return False, "Not connected to server"
         
         try:
-            with open(local_path, 'rb') as f:
-                self.ftp.storbinary(f'STOR {remote_path}', f)
+            with self.tracer.span("disk_io", phase="open"):
+                reader = FileReader(local_path, self._buffer)
+            with reader:
+                with self.tracer.span("control"):
+                    self.ftp.voidcmd('TYPE I')
+                    offset = self._upload_offset(remote_path) if resume else None
+                if offset is None or offset > reader.size:
+                    offset = 0
+                start = time.perf_counter()
+                with self.tracer.span("data_setup"):
+                    conn = self.ftp.transfercmd(f'STOR {remote_path}', rest=offset or None)
+                checkpoints = _Checkpoints(checkpoint, offset, self.checkpoint_bytes) if checkpoint else None
+                with self.tracer.span("transfer") as span:
+                    aborted = True
+                    try:
+                        self._send_from(conn, reader, span, offset, checkpoints)
+                        aborted = False
+                    finally:
+                        self._close_data(conn, aborted)
+                        if checkpoints is not None:
+                            checkpoints.flush()
+                with self.tracer.span("completion"):
+                    self.ftp.voidresp()
+                self._bytes_sent.inc(reader.size - offset)
+                self._transfer_seconds.observe(time.perf_counter() - start, direction="upload")
             return True, f"Uploaded {local_path} to {remote_path}"
         except Exception as e:
+            self._failed(e)
             return False, f"Upload failed: {str(e)}"
     
+    @_instrumented("upload_delta")
+    @_session()
+    def upload_delta(self, local_path: str, remote_path: str,
+                     block_size: Optional[int] = None) -> Tuple[bool, str]:
+        """Upload a changed file by sending only what differs from the server's copy
+
+        The server sends the rolling and strong checksums of each block of
+        its copy (SITE SIGN); blocks found anywhere in the local file are sent
+        as references and everything else as literal data (SITE DELTA). The
+        server rebuilds the file and replaces it atomically if the result
+        matches the local file's SHA-256. Falls back to upload_file when the
+        server has no copy, does not support deltas or its copy changed in
+        between.
+        """
+        if not self.connected:
+            return False, "Not connected to server"
+        
+        try:
+            size = os.path.getsize(local_path)
+            block_size = block_size or block_size_for(size)
+            start = time.perf_counter()
+            with self.tracer.span("control"):
+                self.ftp.voidcmd('TYPE I')
+            try:
+                with self.tracer.span("data_setup"):
+                    conn = self.ftp.transfercmd(f'SITE SIGN {block_size} {remote_path}')
+            except ftplib.error_perm:
+                # Nothing to compare against
+                return self.upload_file(local_path, remote_path)
+            with self.tracer.span("transfer", phase="sign") as span:
+                aborted = True
+                try:
+                    with conn.makefile('rb') as fp:
+                        data = fp.read()
+                    aborted = False
+                finally:
+                    self._close_data(conn, aborted)
+                span.set("bytes", len(data))
+            self.ftp.voidresp()
+            encoder = DeltaEncoder(Signature(data))
+            with open(local_path, 'rb') as f:
+                with self.tracer.span("data_setup"):
+                    conn = self.ftp.transfercmd(f'SITE DELTA {block_size} {remote_path}')
+                with self.tracer.span("transfer", phase="delta") as span:
+                    sent = 0
+                    aborted = True
+                    try:
+                        for chunk in encoder.encode(f):
+                            conn.sendall(chunk)
+                            sent += len(chunk)
+                        aborted = False
+                    finally:
+                        self._close_data(conn, aborted)
+                    span.set("bytes", sent)
+            try:
+                with self.tracer.span("completion"):
+                    self.ftp.voidresp()
+            except ftplib.error_perm:
+                # The server's copy changed since it was signed
+                return self.upload_file(local_path, remote_path)
+            self._signature_bytes.inc(len(data))
+            self._bytes_sent.inc(sent)
+            self._transfer_seconds.observe(time.perf_counter() - start, direction="upload")
+            return True, (f"Uploaded {local_path} to {remote_path} "
+                          f"({encoder.literal_bytes} of {size} bytes changed, {sent} bytes sent)")
+        except Exception as e:
+            self._failed(e)
+            return False, f"Upload failed: {str(e)}"
+    
+    @_instrumented("download_range")
+    @_session(retry=False)
+    def download_range(self, remote_path: str, writer: FileWriter, start: int, end: int,
+                       claim: Optional[Callable[[int, int], int]] = None) -> Tuple[bool, object]:
+        """Download bytes start..end-1 of a file into writer at the same offsets (RANG + RETR)
+
+        claim(offset, length), if given, is called for each chunk before it
+        is written and returns how much of it to keep; keeping less stops
+        the transfer there, e.g. because another connection has taken over
+        the rest of the range. Returns (True, (bytes kept, their SHA-256)).
+        """
+        if not self.connected:
+            return False, "Not connected to server"
+        
+        try:
+            with self.tracer.span("control"):
+                for success, reply in self._pipeline(['TYPE I', f'RANG {start} {end - 1}']):
+                    _check_reply(reply)
+            start_time = time.perf_counter()
+            with self.tracer.span("data_setup"):
+                conn = self.ftp.transfercmd(f'RETR {remote_path}')
+            digest = hashlib.sha256()
+            view = memoryview(self._buffer)
+            position = start
+            with self.tracer.span("transfer") as span:
+                aborted = True
+                try:
+                    while position < end:
+                        n = conn.recv_into(view)
+                        if not n:
+                            break
+                        kept = claim(position, n) if claim is not None else min(n, end - position)
+                        writer.pwrite(view[:kept], position)
+                        digest.update(view[:kept])
+                        position += kept
+                        if kept < n:
+                            break
+                    # Stopping early leaves the server mid-send; reset the connection
+                    aborted = position < end
+                finally:
+                    self._close_data(conn, aborted)
+                span.set("bytes", position - start)
+            if not aborted:
+                with self.tracer.span("completion"):
+                    self.ftp.voidresp()
+            self._bytes_received.inc(position - start)
+            self._transfer_seconds.observe(time.perf_counter() - start_time, direction="download")
+            return True, (position - start, digest.hexdigest())
+        except Exception as e:
+            self._failed(e)
+            return False, f"Range download failed: {str(e)}"
+    
+    @_instrumented("hash")
+    @_session()
+    def get_hash(self, remote_path: str, start: Optional[int] = None,
+                 end: Optional[int] = None) -> Tuple[bool, str]:
+        """SHA-256 of a remote file, or of its bytes start..end-1, computed by the server (HASH)"""
+        if not self.connected:
+            return False, "Not connected to server"
+        
+        try:
+            commands = [f'HASH {remote_path}']
+            if start is not None:
+                commands.insert(0, f'RANG {start} {end - 1}')
+            replies = self._pipeline(commands)
+            for success, reply in replies[:-1]:
+                _check_reply(reply)
+            return True, _parse_hash(replies[-1][1])
+        except Exception as e:
+            self._failed(e)
+            return False, f"Failed to hash {remote_path}: {str(e)}"
+    
+    @_instrumented("file_info")
+    @_session()
+    def get_file_info(self, remote_path: str) -> Tuple[bool, object]:
+        """Size and SHA-256 of a remote file in one round trip; returns (True, (size, digest))"""
+        if not self.connected:
+            return False, "Not connected to server"
+        
+        try:
+            replies = self._pipeline(['TYPE I', f'SIZE {remote_path}', f'HASH {remote_path}'])
+            for success, reply in replies[:-1]:
+                _check_reply(reply)
+            size = int(replies[1][1].split()[1])
+            return True, (size, _parse_hash(replies[2][1]))
+        except Exception as e:
+            self._failed(e)
+            return False, f"Failed to check {remote_path}: {str(e)}"
+    
+    def _remote_size(self, remote_path: str) -> Optional[int]:
+        """Return the remote file size, or None if the server does not report it"""
+        try:
+            return self.ftp.size(remote_path)
+        except ftplib.all_errors:
+            return None
+    
+    def _upload_offset(self, remote_path: str) -> Optional[int]:
+        """Where to resume an upload: the server's staged partial upload, else the remote size"""
+        try:
+            return int(self.ftp.sendcmd(f'SITE PARTSIZE {remote_path}').split()[1])
+        except ftplib.error_perm as e:
+            if str(e).startswith('550'):
+                # Nothing staged; the remote file, if any, is a finished upload
+                return 0
+        except (ftplib.error_reply, IndexError, ValueError):
+            pass
+        # Servers without upload staging write in place
+        return self._remote_size(remote_path)
+    
+    def _receive_into(self, conn, writer: FileWriter, span=None, checkpoints: Optional[_Checkpoints] = None) -> int:
+        """Receive a data connection into a file through the reusable buffer"""
+        view = memoryview(self._buffer)
+        total = 0
+        network = disk = 0.0
+        while True:
+            t0 = time.perf_counter()
+            n = conn.recv_into(view)
+            t1 = time.perf_counter()
+            network += t1 - t0
+            if not n:
+                break
+            writer.write(view[:n])
+            if checkpoints is not None:
+                checkpoints.update(view[:n])
+            disk += time.perf_counter() - t1
+            total += n
+        if span is not None:
+            span.set("bytes", total)
+            span.set("network_seconds", round(network, 6))
+            span.set("disk_seconds", round(disk, 6))
+        return total
+    
+    def _send_from(self, conn, reader: FileReader, span=None, offset: int = 0,
+                   checkpoints: Optional[_Checkpoints] = None) -> int:
+        """Send a file over a data connection from the reader's chunks"""
+        total = 0
+        network = disk = 0.0
+        chunks = reader.chunks(offset)
+        while True:
+            t0 = time.perf_counter()
+            # With mmap, page faults are taken inside sendall() instead
+            chunk = next(chunks, None)
+            t1 = time.perf_counter()
+            disk += t1 - t0
+            if chunk is None:
+                break
+            conn.sendall(chunk)
+            network += time.perf_counter() - t1
+            total += len(chunk)
+            if checkpoints is not None:
+                checkpoints.update(chunk)
+        chunk = None
+        if span is not None:
+            span.set("bytes", total)
+            span.set("network_seconds", round(network, 6))
+            span.set("disk_seconds", round(disk, 6))
+        return total
+    
+    @_instrumented("mkdir")
+    @_session()
     def create_directory(self, dir_name: str) -> Tuple[bool, str]:
         """Create a directory"""
         if not self.connected:
@@ -88,27 +827,38 @@ class FTPClient:
             self.ftp.mkd(dir_name)
             return True, f"Created directory {dir_name}"
         except Exception as e:
+            self._failed(e)
             return False, f"Failed to create directory: {str(e)}"
     
+    @_instrumented("cwd")
+    @_session()
     def change_directory(self, dir_name: str) -> Tuple[bool, str]:
         """Change directory"""
         if not self.connected:
             return False, "Not connected to server"
         
         try:
-            self.ftp.cwd(dir_name)
+            # PWD rides along so the directory can be restored after a reconnect
+            replies = self._pipeline([f'CWD {dir_name}', 'PWD'])
+            _check_reply(replies[0][1])
+            self.cwd = ftplib.parse257(_check_reply(replies[1][1]))
             return True, f"Changed to directory {dir_name}"
         except Exception as e:
+            self._failed(e)
             return False, f"Failed to change directory: {str(e)}"
     
+    @_instrumented("pwd")
+    @_session()
     def get_current_directory(self) -> Tuple[bool, str]:
         """Get current directory"""
         if not self.connected:
             return False, "Not connected to server"
         
         try:
-            return True, self.ftp.pwd()
+            self.cwd = self.ftp.pwd()
+            return True, self.cwd
         except Exception as e:
+            self._failed(e)
             return False, f"Failed to get current directory: {str(e)}"
     
     async def async_connect(self, host: str, port: int, username: str, password: str) -> Tuple[bool, str]:
@@ -125,16 +875,25 @@ class FTPClient:
         """Asynchronously list files in directory"""
         return await asyncio.get_event_loop().run_in_executor(None, self.list_files)
     
-    async def async_download_file(self, remote_path: str, local_path: str) -> Tuple[bool, str]:
+    async def async_download_file(self, remote_path: str, local_path: str, resume: bool = False,
+                                  checkpoint: Optional[Callable[[int, int, str], None]] = None) -> Tuple[bool, str]:
         """Asynchronously download a file"""
         return await asyncio.get_event_loop().run_in_executor(
-            None, self.download_file, remote_path, local_path
+            None, self.download_file, remote_path, local_path, resume, checkpoint
         )
     
-    async def async_upload_file(self, local_path: str, remote_path: str) -> Tuple[bool, str]:
+    async def async_upload_file(self, local_path: str, remote_path: str, resume: bool = False,
+                                checkpoint: Optional[Callable[[int, int, str], None]] = None) -> Tuple[bool, str]:
         """Asynchronously upload a file"""
         return await asyncio.get_event_loop().run_in_executor(
-            None, self.upload_file, local_path, remote_path
+            None, self.upload_file, local_path, remote_path, resume, checkpoint
+        )
+    
+    async def async_upload_delta(self, local_path: str, remote_path: str,
+                                 block_size: Optional[int] = None) -> Tuple[bool, str]:
+        """Asynchronously upload only what changed in a file"""
+        return await asyncio.get_event_loop().run_in_executor(
+            None, self.upload_delta, local_path, remote_path, block_size
         )
     
     async def async_create_directory(self, dir_name: str) -> Tuple[bool, str]:
@@ -153,4 +912,27 @@ class FTPClient:
         """Asynchronously get current directory"""
         return await asyncio.get_event_loop().run_in_executor(
             None, self.get_current_directory
+        )
+    
+    async def async_get_listing(self) -> Tuple[bool, object]:
+        """Asynchronously get the current directory and its listing"""
+        return await asyncio.get_event_loop().run_in_executor(None, self.get_listing)
+    
+    async def async_run_batch(self, commands: List[str], window: int = 512) -> Tuple[bool, object]:
+        """Asynchronously pipeline a batch of control commands"""
+        return await asyncio.get_event_loop().run_in_executor(
+            None, self.run_batch, commands, window
+        )
+    
+    async def async_get_hash(self, remote_path: str, start: Optional[int] = None,
+                             end: Optional[int] = None) -> Tuple[bool, str]:
+        """Asynchronously get the SHA-256 of a remote file or byte range"""
+        return await asyncio.get_event_loop().run_in_executor(
+            None, self.get_hash, remote_path, start, end
+        )
+    
+    async def async_get_file_info(self, remote_path: str) -> Tuple[bool, object]:
+        """Asynchronously get the size and SHA-256 of a remote file"""
+        return await asyncio.get_event_loop().run_in_executor(
+            None, self.get_file_info, remote_path
         )
\ No newline at end of file
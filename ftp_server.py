@@ -3,33 +3,1038 @@ FTP Server module for TermShare
 Handles FTP server operations with asyncio support
 """
 
+import os
+import ssl
+import hmac
+import hashlib
+import time
 import socket
+import posixpath
 import threading
 import asyncio
-from typing import Tuple, List
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Tuple, List, Optional
+from delta import MAX_BLOCK_SIZE, MIN_BLOCK_SIZE, apply_delta, signature
+from file_io import CHUNK_SIZE
+from metrics import DISABLED, MetricsRegistry
+from tracing import NULL_TRACER
+from vfs import CachedFS, FileStat, FileSystem, LocalFS, open_filesystem
+
+# Shared when no root is given, rather than whatever directory TermShare was started from
+DEFAULT_SHARE = os.path.join(os.path.expanduser("~"), "TermShare")
+
+# Login names treated as anonymous unless configured as real users
+ANONYMOUS_USERS = {"anonymous", "ftp"}
+
+# What anonymous users may do: nothing, download, or also upload new files
+ANONYMOUS_ACCESS = ("off", "read", "upload")
+
+# Whole-file digests remembered for HASH
+HASH_CACHE_SIZE = 256
+
+def listen_socket(host: str, port: int, backlog: int = 5) -> socket.socket:
+    """Bind a listening TCP socket (socket.create_server needs Python 3.8)"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        if os.name == "posix":
+            # Allow a restart while old connections are still in TIME_WAIT
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+        sock.listen(backlog)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+def tls_context(certfile: str, keyfile: Optional[str] = None) -> ssl.SSLContext:
+    """Build a server-side TLS context from a PEM certificate chain and key"""
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.load_cert_chain(certfile, keyfile)
+    return context
+
+class DataPortPool:
+    """Passive-mode data ports, either from a fixed range or ephemeral"""
+
+    def __init__(self, port_range: Optional[Tuple[int, int]] = None, metrics: MetricsRegistry = DISABLED):
+        self.port_range = port_range
+        self.in_use = set()
+        self.lock = threading.Lock()
+        self.in_use_gauge = metrics.gauge(
+            "termshare_server_data_ports_in_use", "Passive data ports currently bound")
+        capacity = metrics.gauge(
+            "termshare_server_data_ports_capacity", "Size of the passive port range (0 if ephemeral)")
+        capacity.set(port_range[1] - port_range[0] + 1 if port_range else 0)
+
+    def acquire(self, host: str) -> socket.socket:
+        """Bind and return a listening socket for one data connection"""
+        if self.port_range is None:
+            sock = listen_socket(host, 0, backlog=1)
+            with self.lock:
+                self.in_use.add(sock.getsockname()[1])
+                self.in_use_gauge.set(len(self.in_use))
+            return sock
+
+        with self.lock:
+            for port in range(self.port_range[0], self.port_range[1] + 1):
+                if port in self.in_use:
+                    continue
+                try:
+                    sock = listen_socket(host, port, backlog=1)
+                except OSError:
+                    continue
+                self.in_use.add(port)
+                self.in_use_gauge.set(len(self.in_use))
+                return sock
+        raise OSError("No free passive data ports")
+
+    def release(self, sock: socket.socket) -> None:
+        """Close a listening socket and return its port to the pool"""
+        try:
+            port = sock.getsockname()[1]
+        except OSError:
+            port = None
+        sock.close()
+        with self.lock:
+            self.in_use.discard(port)
+            self.in_use_gauge.set(len(self.in_use))
+
+class PathLocks:
+    """Per-path locks so that concurrent uploads to the same file take turns"""
+
+    def __init__(self, metrics: MetricsRegistry = DISABLED):
+        # path -> [lock, number of sessions holding or waiting for it]
+        self.locks = {}
+        self.lock = threading.Lock()
+        self.wait_seconds = metrics.histogram(
+            "termshare_server_write_lock_wait_seconds", "Time uploads waited for another upload to the same file")
+
+    @contextmanager
+    def hold(self, path: str):
+        with self.lock:
+            entry = self.locks.setdefault(path, [threading.Lock(), 0])
+            entry[1] += 1
+        start = time.perf_counter()
+        entry[0].acquire()
+        self.wait_seconds.observe(time.perf_counter() - start)
+        try:
+            yield
+        finally:
+            entry[0].release()
+            with self.lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self.locks[path]
+
+class FileHashes:
+    """Whole-file SHA-256 digests, reused until the file's size or mtime changes"""
+
+    def __init__(self, max_entries: int = HASH_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, path: str, st: FileStat) -> Optional[str]:
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None or entry[:2] != (st.size, st.mtime):
+                return None
+            self.entries.move_to_end(path)
+            return entry[2]
+
+    def put(self, path: str, st: FileStat, digest: str) -> None:
+        with self.lock:
+            self.entries[path] = (st.size, st.mtime, digest)
+            self.entries.move_to_end(path)
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+class FTPSession:
+    """State and command handlers for one client control connection"""
+
+    # Commands allowed before login
+    PUBLIC_COMMANDS = {"USER", "PASS", "QUIT", "FEAT", "SYST", "NOOP", "AUTH", "PBSZ", "PROT"}
+
+    # Commands whose argument must not be recorded in traces
+    SECRET_COMMANDS = {"PASS", "ACCT"}
+
+    # Commands that change the shared tree
+    WRITE_COMMANDS = {"STOR", "APPE", "DELE", "MKD", "RMD", "RNFR", "RNTO"}
+
+    # Longest accepted command line
+    MAX_LINE = 8192
+
+    def __init__(self, server, client_socket: socket.socket, address):
+        self.server = server
+        self.sock = client_socket
+        self.address = address
+        self.inbuf = bytearray()
+        self.outbuf = []
+        self.cwd = "/"
+        self.username = None
+        self.logged_in = False
+        # "read", "upload" (new files only) or "write", set at login
+        self.access = None
+        self.passive_socket = None
+        self.rest_offset = 0
+        # (start, end) set by RANG for the next RETR or HASH; end is exclusive
+        self.byte_range = None
+        self.rename_from = None
+        self.protect_data = False
+        self.buffer = bytearray(CHUNK_SIZE)
+
+    def reply(self, code: int, text: str) -> None:
+        """Queue a single-line reply; see flush()"""
+        self.outbuf.append(f"{code} {text}\r\n".encode('utf-8', 'replace'))
+
+    def flush(self) -> None:
+        """Send all queued replies in one write"""
+        if self.outbuf:
+            data = b"".join(self.outbuf)
+            self.outbuf = []
+            self.sock.sendall(data)
+
+    def read_line(self) -> Optional[bytes]:
+        """Return the next command line, or None when the client has gone
+
+        Replies are only flushed when no further pipelined command is
+        already buffered, so a batch of commands is answered in one write.
+        """
+        while True:
+            index = self.inbuf.find(b"\n")
+            if index >= 0:
+                line = bytes(self.inbuf[:index + 1])
+                del self.inbuf[:index + 1]
+                return line
+            if len(self.inbuf) > self.MAX_LINE:
+                self.inbuf.clear()
+                self.reply(500, "Command line too long")
+            self.flush()
+            data = self.sock.recv(65536)
+            if not data:
+                return None
+            self.inbuf += data
+
+    def run(self) -> None:
+        """Read and dispatch commands until the client quits"""
+        self.reply(220, "Welcome to TermShare FTP Server")
+        while self.server.running:
+            line = self.read_line()
+            if line is None:
+                break
+            line = line.decode('utf-8', 'replace').rstrip("\r\n")
+            verb, _, arg = line.partition(" ")
+            verb = verb.upper()
+            if not self.dispatch(verb, arg):
+                break
+        self.flush()
+
+    def dispatch(self, verb: str, arg: str) -> bool:
+        """Run one command; returns False when the session should end"""
+        handler = getattr(self, f"cmd_{verb.lower()}", None)
+        if handler is None:
+            self.reply(502, f"Command {verb} not implemented")
+            return True
+        if not self.logged_in and verb not in self.PUBLIC_COMMANDS:
+            self.reply(530, "Please login with USER and PASS")
+            return True
+        if verb in self.WRITE_COMMANDS and not self.may_write(verb, arg):
+            self.reply(550, "Permission denied")
+            return True
+        start = time.perf_counter()
+        profiler = self.server.profiler
+        traced_arg = "***" if verb in self.SECRET_COMMANDS else arg
+        try:
+            with self.server.tracer.span(f"FTP {verb}", command=verb, arg=traced_arg, client=self.address[0]):
+                result = profiler.call(handler, arg) if profiler else handler(arg)
+            return result is not False
+        except OSError as e:
+            self.server.errors.inc(type=type(e).__name__)
+            self.reply(550, f"{verb} failed: {e.strerror or e}")
+            return True
+        except ValueError as e:
+            # e.g. a NUL byte in a path
+            self.server.errors.inc(type=type(e).__name__)
+            self.reply(550, f"{verb} failed: {e}")
+            return True
+        except Exception as e:
+            # A bug in one command must not end the session
+            self.server.errors.inc(type=type(e).__name__)
+            self.reply(451, f"{verb} failed: local error in processing")
+            return True
+        finally:
+            self.server.command_seconds.observe(time.perf_counter() - start, command=verb)
+
+    # Path handling
+
+    def virtual_path(self, arg: str) -> str:
+        """Resolve a client-supplied path against the working directory"""
+        return posixpath.normpath(posixpath.join(self.cwd, arg or "."))
+
+    def may_write(self, verb: str, arg: str) -> bool:
+        """Whether the logged-in user may run a command that changes the tree"""
+        if self.access == "write":
+            return True
+        if self.access == "upload" and verb in ("STOR", "MKD"):
+            # Anonymous uploads may add files but never replace anything
+            return self.lookup(self.virtual_path(arg)) is None
+        return False
+
+    def lookup(self, path: str) -> Optional[FileStat]:
+        """Stat a virtual path, returning None if it does not exist"""
+        try:
+            return self.server.fs.stat(path)
+        except (OSError, ValueError):
+            return None
+
+    # Data connections
+
+    def open_data_connection(self, upload: bool = False) -> Optional[socket.socket]:
+        """Accept the client's connection on the pending passive socket
+
+        For uploads over TLS, a stream that ends without close_notify raises
+        ssl.SSLEOFError instead of reading as a clean end of file, so that a
+        truncated upload is not committed.
+        """
+        if self.passive_socket is None:
+            self.reply(425, "Use PASV or EPSV first")
+            return None
+        if self.server.tls_required and not self.protect_data:
+            self.reply(521, "Data connections must be protected; use PROT P")
+            return None
+        self.reply(150, "Opening data connection")
+        self.flush()
+        listener, self.passive_socket = self.passive_socket, None
+        try:
+            with self.server.tracer.span("data_setup") as span:
+                listener.settimeout(self.server.data_timeout)
+                conn, _ = listener.accept()
+                if self.protect_data:
+                    # Handshake flights and close_notify are small writes; don't let Nagle delay them
+                    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    conn.settimeout(self.server.data_timeout)
+                    conn = self.server.tls.wrap_socket(conn, server_side=True, suppress_ragged_eofs=not upload)
+                    # Clients that reuse the control session skip the full handshake
+                    span.set("tls_resumed", conn.session_reused)
+                    self.server.tls_handshakes.inc(channel="data", resumed=str(conn.session_reused).lower())
+                conn.settimeout(None)
+            return conn
+        except OSError as e:
+            self.server.errors.inc(type=type(e).__name__)
+            self.reply(425, "Can't open data connection")
+            return None
+        finally:
+            self.server.data_ports.release(listener)
+
+    def close_data_connection(self, conn: socket.socket, abort: bool = False) -> None:
+        """Close a data connection, first exchanging TLS close_notify unless aborting"""
+        if not abort and isinstance(conn, ssl.SSLSocket):
+            try:
+                conn.settimeout(self.server.data_timeout)
+                conn.unwrap()
+            except (OSError, ValueError):
+                pass
+        conn.close()
+
+    def start_passive(self) -> int:
+        """Bind a passive listener for the next transfer and return its port"""
+        if self.passive_socket is not None:
+            self.server.data_ports.release(self.passive_socket)
+        self.passive_socket = self.server.data_ports.acquire(self.sock.getsockname()[0])
+        return self.passive_socket.getsockname()[1]
+
+    # Access control and session commands
+
+    @property
+    def secure(self) -> bool:
+        return isinstance(self.sock, ssl.SSLSocket)
+
+    def cmd_auth(self, arg):
+        if arg.upper() not in ("TLS", "TLS-C", "SSL"):
+            self.reply(504, f"AUTH {arg} not supported")
+            return
+        if self.server.tls is None:
+            self.reply(534, "TLS not configured on this server")
+            return
+        if self.secure:
+            self.reply(503, "Already using TLS")
+            return
+        self.reply(234, "AUTH TLS successful")
+        self.flush()
+        # Anything sent in plaintext after AUTH could be injected; drop it
+        self.inbuf.clear()
+        plain = self.sock
+        try:
+            # The handshake runs on this session's thread, never the accept loop
+            with self.server.tracer.span("tls_handshake"):
+                plain.settimeout(self.server.data_timeout)
+                self.sock = self.server.tls.wrap_socket(plain, server_side=True)
+                self.sock.settimeout(None)
+        except (OSError, ValueError) as e:
+            self.server.errors.inc(type=type(e).__name__)
+            return False
+        finally:
+            self.server.replace_client(plain, self.sock)
+        self.server.tls_handshakes.inc(channel="control", resumed=str(self.sock.session_reused).lower())
+
+    def cmd_pbsz(self, arg):
+        if not self.secure:
+            self.reply(503, "Use AUTH TLS first")
+            return
+        self.reply(200, "PBSZ=0")
+
+    def cmd_prot(self, arg):
+        if not self.secure:
+            self.reply(503, "Use AUTH TLS first")
+        elif arg.upper() == "P":
+            self.protect_data = True
+            self.reply(200, "Protection level set to P")
+        elif arg.upper() == "C":
+            if self.server.tls_required:
+                self.reply(534, "Data connections must be protected")
+                return
+            self.protect_data = False
+            self.reply(200, "Protection level set to C")
+        else:
+            self.reply(504, f"PROT {arg} not supported")
+
+    def cmd_user(self, arg):
+        if self.server.tls_required and not self.secure:
+            self.reply(530, "Use AUTH TLS before logging in")
+            return
+        self.username = arg
+        self.logged_in = False
+        self.access = None
+        self.reply(331, "Password required")
+
+    def cmd_pass(self, arg):
+        if self.username is None:
+            self.reply(503, "Login with USER first")
+            return
+        access = self.server.authenticate(self.username, arg)
+        if access is None:
+            self.username = None
+            self.server.errors.inc(type="LoginFailed")
+            self.reply(530, "Login incorrect")
+            return
+        self.logged_in = True
+        self.access = access
+        self.reply(230, "Login successful" if access == "write" else f"Login successful ({access} only)")
+
+    def cmd_quit(self, arg):
+        self.reply(221, "Goodbye")
+        return False
+
+    def cmd_noop(self, arg):
+        self.reply(200, "NOOP ok")
+
+    def cmd_syst(self, arg):
+        self.reply(215, "UNIX Type: L8")
+
+    def cmd_feat(self, arg):
+        features = ["EPSV", "HASH SHA-256*", "MDTM", "MLST type*;size*;modify*;", "PASV",
+                    "RANG STREAM", "REST STREAM", "SIZE", "UTF8"]
+        if self.server.tls is not None:
+            features += ["AUTH TLS", "PBSZ", "PROT"]
+        lines = ["211-Features:"] + [f" {feature}" for feature in features] + ["211 End"]
+        self.outbuf.append(("\r\n".join(lines) + "\r\n").encode())
+
+    def cmd_opts(self, arg):
+        self.reply(200, "Always in UTF8 mode")
+
+    def cmd_type(self, arg):
+        if arg.upper() in ("A", "A N", "I", "L 8"):
+            self.reply(200, f"Type set to {arg.upper()}")
+        else:
+            self.reply(504, f"Type {arg} not supported")
+
+    def cmd_mode(self, arg):
+        if arg.upper() == "S":
+            self.reply(200, "Mode set to S")
+        else:
+            self.reply(504, "Only stream mode is supported")
+
+    def cmd_stru(self, arg):
+        if arg.upper() == "F":
+            self.reply(200, "Structure set to F")
+        else:
+            self.reply(504, "Only file structure is supported")
+
+    def cmd_pasv(self, arg):
+        port = self.start_passive()
+        host = self.sock.getsockname()[0].replace(".", ",")
+        self.reply(227, f"Entering Passive Mode ({host},{port >> 8},{port & 0xff})")
+
+    def cmd_epsv(self, arg):
+        port = self.start_passive()
+        self.reply(229, f"Entering Extended Passive Mode (|||{port}|)")
+
+    def cmd_rest(self, arg):
+        try:
+            self.rest_offset = int(arg)
+        except ValueError:
+            self.reply(501, "Invalid restart offset")
+            return
+        self.byte_range = None
+        self.reply(350, f"Restarting at {self.rest_offset}")
+
+    def cmd_rang(self, arg):
+        """Limit the next RETR or HASH to bytes start..end inclusive; RANG 1 0 clears it"""
+        try:
+            start, end = (int(value) for value in arg.split())
+        except ValueError:
+            self.reply(501, "Usage: RANG start end")
+            return
+        if (start, end) == (1, 0):
+            self.byte_range = None
+            self.reply(350, "Restarting at 0. End byte range at EOF")
+            return
+        if start < 0 or end < start:
+            self.reply(501, "Invalid byte range")
+            return
+        self.rest_offset = 0
+        self.byte_range = (start, end + 1)
+        self.reply(350, f"Restarting at {start}. End byte range at {end}")
+
+    def cmd_site(self, arg):
+        command, _, rest = arg.strip().partition(" ")
+        handler = getattr(self, f"site_{command.lower()}", None)
+        if handler is None:
+            self.reply(504, f"SITE {command} not supported")
+            return
+        handler(rest.strip())
+
+    def site_partsize(self, arg):
+        """Size of an interrupted upload, where REST + STOR will continue it"""
+        size = self.server.fs.staged_size(self.virtual_path(arg))
+        if size is None:
+            self.reply(550, f"{arg}: No partial upload")
+            return
+        self.reply(213, str(size))
+
+    def _block_size_arg(self, arg: str, usage: str) -> Tuple[Optional[int], str]:
+        """Split "block_size path" for SITE SIGN and SITE DELTA, replying 501 if it is invalid"""
+        value, _, name = arg.partition(" ")
+        try:
+            block_size = int(value)
+        except ValueError:
+            self.reply(501, f"Usage: {usage}")
+            return None, name
+        if not MIN_BLOCK_SIZE <= block_size <= MAX_BLOCK_SIZE:
+            self.reply(501, f"Block size must be between {MIN_BLOCK_SIZE} and {MAX_BLOCK_SIZE}")
+            return None, name
+        return block_size, name
+
+    def site_sign(self, arg):
+        """Send the block signatures of a file, so the client can send a delta against it"""
+        block_size, name = self._block_size_arg(arg, "SITE SIGN block_size path")
+        if block_size is None:
+            return
+        path = self.virtual_path(name)
+        st = self.lookup(path)
+        if st is None or st.is_dir:
+            self.reply(550, f"{name}: No such file")
+            return
+        with self.server.fs.open_read(path) as f:
+            conn = self.open_data_connection()
+            if conn is None:
+                return
+            start = time.perf_counter()
+            sent = 0
+            aborted = True
+            try:
+                with self.server.tracer.span("transfer", phase="sign") as span:
+                    for chunk in signature(f, st.size, block_size):
+                        conn.sendall(chunk)
+                        sent += len(chunk)
+                    span.set("bytes", sent)
+                aborted = False
+            except OSError as e:
+                self.server.errors.inc(type=type(e).__name__)
+                self.reply(426, "Connection closed; transfer aborted")
+                return
+            finally:
+                self.close_data_connection(conn, aborted)
+        self.server.bytes_sent.inc(sent)
+        self.server.transfer_seconds.observe(time.perf_counter() - start, direction="signature")
+        self.reply(226, "Signature complete")
+
+    def site_delta(self, arg):
+        """Rebuild a file from a delta against its current contents, replacing it atomically"""
+        block_size, name = self._block_size_arg(arg, "SITE DELTA block_size path")
+        if block_size is None:
+            return
+        # Replaces an existing file, so it needs the same access as overwriting it with STOR
+        if not self.may_write("STOR", name):
+            self.reply(550, "Permission denied")
+            return
+        path = self.virtual_path(name)
+        try:
+            with self.server.write_locks.hold(path):
+                self._receive_delta(path, name, block_size)
+        finally:
+            self.server.fs.invalidate(path)
+
+    def _receive_delta(self, path: str, name: str, block_size: int) -> None:
+        fs = self.server.fs
+        st = self.lookup(path)
+        if st is None or st.is_dir:
+            self.reply(550, f"{name}: No such file")
+            return
+        with fs.open_staged(path) as writer:
+            conn = self.open_data_connection(upload=True)
+            if conn is None:
+                return
+            start = time.perf_counter()
+            received = 0
+            aborted = True
+            try:
+                with self.server.tracer.span("transfer", phase="delta") as span:
+                    with fs.open_read(path) as basis, conn.makefile('rb') as stream:
+                        received, intact = apply_delta(stream.read, basis, st.size, block_size,
+                                                       writer, self.buffer)
+                    span.set("bytes", received)
+                aborted = False
+            except (OSError, ValueError) as e:
+                # A partial rebuild is no use for resuming a plain upload
+                writer.discard()
+                self.server.errors.inc(type=type(e).__name__)
+                if isinstance(e, OSError):
+                    self.reply(426, "Connection closed; transfer aborted")
+                else:
+                    self.reply(550, f"SITE DELTA failed: {e}")
+                return
+            finally:
+                self.close_data_connection(conn, aborted)
+                self.server.bytes_received.inc(received)
+            if not intact:
+                writer.discard()
+                self.reply(550, f"{name}: Rebuilt file does not match; the file changed since it was signed")
+                return
+            with self.server.tracer.span("disk_io", phase="commit"):
+                if not self.commit_staged(writer, path):
+                    return
+        self.server.transfer_seconds.observe(time.perf_counter() - start, direction="delta")
+        self.reply(226, "Transfer complete")
+
+    # Directory commands
+
+    def cmd_pwd(self, arg):
+        self.reply(257, '"{}" is the current directory'.format(self.cwd.replace('"', '""')))
+
+    cmd_xpwd = cmd_pwd
+
+    def cmd_cwd(self, arg):
+        st = self.lookup(self.virtual_path(arg))
+        if st is None or not st.is_dir:
+            self.reply(550, f"{arg}: No such directory")
+            return
+        self.cwd = self.virtual_path(arg)
+        self.reply(250, f"Directory changed to {self.cwd}")
+
+    def cmd_cdup(self, arg):
+        self.cmd_cwd("..")
+
+    def cmd_mkd(self, arg):
+        self.server.fs.mkdir(self.virtual_path(arg))
+        self.reply(257, '"{}" created'.format(self.virtual_path(arg).replace('"', '""')))
+
+    def cmd_rmd(self, arg):
+        self.server.fs.rmdir(self.virtual_path(arg))
+        self.reply(250, f"Removed directory {arg}")
+
+    def cmd_dele(self, arg):
+        self.server.fs.remove(self.virtual_path(arg))
+        self.reply(250, f"Deleted {arg}")
+
+    def cmd_rnfr(self, arg):
+        path = self.virtual_path(arg)
+        if self.lookup(path) is None:
+            self.reply(550, f"{arg}: No such file or directory")
+            return
+        self.rename_from = path
+        self.reply(350, "Ready for RNTO")
+
+    def cmd_rnto(self, arg):
+        if self.rename_from is None:
+            self.reply(503, "Use RNFR first")
+            return
+        source, self.rename_from = self.rename_from, None
+        self.server.fs.rename(source, self.virtual_path(arg))
+        self.reply(250, "Rename successful")
+
+    def cmd_size(self, arg):
+        st = self.lookup(self.virtual_path(arg))
+        if st is None or st.is_dir:
+            self.reply(550, f"{arg}: No such file")
+            return
+        self.reply(213, str(st.size))
+
+    def cmd_mdtm(self, arg):
+        st = self.lookup(self.virtual_path(arg))
+        if st is None or st.is_dir:
+            self.reply(550, f"{arg}: No such file")
+            return
+        self.reply(213, time.strftime("%Y%m%d%H%M%S", time.gmtime(st.mtime)))
+
+    @staticmethod
+    def encode_lines(lines: List[str]) -> bytes:
+        """Join lines into a CRLF-terminated listing payload"""
+        return "".join(line + "\r\n" for line in lines).encode('utf-8', 'replace')
+
+    @staticmethod
+    def format_listing(items: List[FileStat]) -> List[str]:
+        """Render entries as UNIX-style LIST lines"""
+        lines = []
+        six_months_ago = time.time() - 180 * 24 * 3600
+        for st in items:
+            perms = "drwxr-xr-x" if st.is_dir else "-rw-r--r--"
+            if st.mtime > six_months_ago:
+                modified = time.strftime("%b %d %H:%M", time.localtime(st.mtime))
+            else:
+                modified = time.strftime("%b %d  %Y", time.localtime(st.mtime))
+            lines.append(f"{perms} 1 owner group {st.size:>12} {modified} {st.name}")
+        return lines
+
+    @staticmethod
+    def format_facts(st: FileStat) -> str:
+        """Render the MLSD/MLST facts for one entry"""
+        kind = "dir" if st.is_dir else "file"
+        modified = time.strftime("%Y%m%d%H%M%S", time.gmtime(st.mtime))
+        return f"type={kind};size={st.size};modify={modified};"
+
+    def build_listing(self, path: str) -> bytes:
+        return self.encode_lines(self.format_listing(self.server.fs.listdir(path)))
+
+    def build_mlsd(self, path: str) -> bytes:
+        return self.encode_lines([f"{self.format_facts(st)} {st.name}" for st in self.server.fs.listdir(path)])
+
+    def build_nlst(self, path: str) -> bytes:
+        return self.encode_lines([st.name for st in self.server.fs.listdir(path)])
+
+    def send_payload(self, payload: bytes) -> None:
+        """Send a listing payload over a new data connection"""
+        conn = self.open_data_connection()
+        if conn is None:
+            return
+        start = time.perf_counter()
+        aborted = True
+        try:
+            with self.server.tracer.span("transfer", bytes=len(payload)):
+                conn.sendall(payload)
+            aborted = False
+        finally:
+            self.close_data_connection(conn, aborted)
+        self.server.bytes_sent.inc(len(payload))
+        self.server.transfer_seconds.observe(time.perf_counter() - start, direction="listing")
+        self.reply(226, "Transfer complete")
+
+    def cmd_list(self, arg):
+        # Ignore ls-style flags such as "-la"
+        if arg.startswith("-"):
+            arg = ""
+        path = self.virtual_path(arg)
+        st = self.lookup(path)
+        if st is None:
+            self.reply(550, f"{arg}: No such file or directory")
+            return
+        with self.server.tracer.span("disk_io", phase="scandir"):
+            if st.is_dir:
+                # Hot directories are served from the cache's rendered copy
+                payload = self.server.fs.render(path, "LIST", self.build_listing)
+            else:
+                payload = self.encode_lines(self.format_listing([st]))
+        self.send_payload(payload)
+
+    def cmd_nlst(self, arg):
+        if arg.startswith("-"):
+            arg = ""
+        path = self.virtual_path(arg)
+        st = self.lookup(path)
+        if st is None or not st.is_dir:
+            self.reply(550, f"{arg}: No such directory")
+            return
+        with self.server.tracer.span("disk_io", phase="scandir"):
+            payload = self.server.fs.render(path, "NLST", self.build_nlst)
+        self.send_payload(payload)
+
+    def cmd_mlsd(self, arg):
+        path = self.virtual_path(arg)
+        st = self.lookup(path)
+        if st is None or not st.is_dir:
+            self.reply(501, f"{arg}: No such directory")
+            return
+        with self.server.tracer.span("disk_io", phase="scandir"):
+            payload = self.server.fs.render(path, "MLSD", self.build_mlsd)
+        self.send_payload(payload)
+
+    def cmd_mlst(self, arg):
+        path = self.virtual_path(arg)
+        st = self.lookup(path)
+        if st is None:
+            self.reply(550, f"{arg}: No such file or directory")
+            return
+        self.outbuf.append(f"250-Listing {path}\r\n {self.format_facts(st)} {path}\r\n250 End\r\n"
+                           .encode('utf-8', 'replace'))
+
+    # File transfer commands
+
+    def cmd_retr(self, arg):
+        offset, self.rest_offset = self.rest_offset, 0
+        byte_range, self.byte_range = self.byte_range, None
+        path = self.virtual_path(arg)
+        st = self.lookup(path)
+        if st is None or st.is_dir:
+            self.reply(550, f"{arg}: No such file")
+            return
+        count = None
+        if byte_range is not None:
+            offset, end = byte_range
+            if offset > st.size:
+                self.reply(554, "Byte range starts past the end of the file")
+                return
+            count = min(end, st.size) - offset
+        with self.server.fs.open_read(path) as f:
+            conn = self.open_data_connection()
+            if conn is None:
+                return
+            start = time.perf_counter()
+            aborted = True
+            try:
+                # sendfile() moves disk and network bytes in one kernel call;
+                # TLS connections and backends without a real file fall back to plain sends
+                with self.server.tracer.span("transfer", method="sendfile") as span:
+                    sent = conn.sendfile(f, offset, count)
+                    span.set("bytes", sent)
+                aborted = False
+            except OSError as e:
+                self.server.errors.inc(type=type(e).__name__)
+                self.reply(426, "Connection closed; transfer aborted")
+                return
+            finally:
+                self.close_data_connection(conn, aborted)
+        self.server.bytes_sent.inc(sent)
+        self.server.transfer_seconds.observe(time.perf_counter() - start, direction="download")
+        self.reply(226, "Transfer complete")
+
+    def cmd_hash(self, arg):
+        """SHA-256 of a file, or of the byte range set by RANG"""
+        byte_range, self.byte_range = self.byte_range, None
+        path = self.virtual_path(arg)
+        st = self.lookup(path)
+        if st is None or st.is_dir:
+            self.reply(550, f"{arg}: No such file")
+            return
+        start, end = byte_range or (0, st.size)
+        if start > st.size:
+            self.reply(554, "Byte range starts past the end of the file")
+            return
+        end = min(end, st.size)
+        whole = (start, end) == (0, st.size)
+        digest = self.server.hashes.get(path, st) if whole else None
+        if digest is None:
+            with self.server.tracer.span("disk_io", phase="hash", bytes=end - start):
+                digest = self.file_hash(path, start, end)
+            if whole:
+                self.server.hashes.put(path, st, digest)
+        self.reply(213, f"SHA-256 {start}-{max(start, end - 1)} {digest} {arg}")
+
+    def file_hash(self, path: str, start: int, end: int) -> str:
+        """Hash bytes start..end-1 of a file through the session buffer"""
+        digest = hashlib.sha256()
+        view = memoryview(self.buffer)
+        with self.server.fs.open_read(path) as f:
+            f.seek(start)
+            remaining = end - start
+            while remaining:
+                n = f.readinto(view[:min(len(view), remaining)])
+                if not n:
+                    raise ValueError("file changed while it was being hashed")
+                digest.update(view[:n])
+                remaining -= n
+        return digest.hexdigest()
+
+    def commit_staged(self, writer, path: str) -> bool:
+        """Commit a staged upload; with upload-only access refuse to replace a file created meanwhile"""
+        try:
+            writer.commit(replace=self.access == "write")
+        except FileExistsError:
+            writer.discard()
+            self.reply(550, f"{posixpath.basename(path)}: File already exists")
+            return False
+        return True
+
+    def receive_file(self, path: str, offset: int, staged: bool = True) -> None:
+        """Receive a data connection into a file starting at offset
+
+        Staged uploads become visible only once complete, replacing the file
+        atomically; otherwise (APPE) data is written in place. Uploads to the
+        same path are serialised.
+        """
+        try:
+            with self.server.write_locks.hold(path):
+                self._receive_file(path, offset, staged)
+        finally:
+            # The final size is only known now
+            self.server.fs.invalidate(path)
+
+    def _receive_file(self, path: str, offset: int, staged: bool) -> None:
+        fs = self.server.fs
+        writer = fs.open_staged(path, offset) if staged else fs.open_write(path, truncate=False)
+        with writer:
+            writer.seek(offset)
+            conn = self.open_data_connection(upload=True)
+            if conn is None:
+                return
+            view = memoryview(self.buffer)
+            start = time.perf_counter()
+            received = 0
+            network = disk = 0.0
+            span = self.server.tracer.span("transfer")
+            aborted = True
+            try:
+                with span:
+                    while True:
+                        t0 = time.perf_counter()
+                        n = conn.recv_into(view)
+                        t1 = time.perf_counter()
+                        network += t1 - t0
+                        if not n:
+                            break
+                        writer.write(view[:n])
+                        disk += time.perf_counter() - t1
+                        received += n
+                    span.set("bytes", received)
+                    span.set("network_seconds", round(network, 6))
+                    span.set("disk_seconds", round(disk, 6))
+                aborted = False
+            except OSError as e:
+                self.server.errors.inc(type=type(e).__name__)
+                self.reply(426, "Connection closed; transfer aborted")
+                return
+            finally:
+                self.close_data_connection(conn, aborted)
+                self.server.bytes_received.inc(received)
+            if staged:
+                with self.server.tracer.span("disk_io", phase="commit"):
+                    if not self.commit_staged(writer, path):
+                        return
+        self.server.transfer_seconds.observe(time.perf_counter() - start, direction="upload")
+        self.reply(226, "Transfer complete")
+
+    def cmd_stor(self, arg):
+        offset, self.rest_offset = self.rest_offset, 0
+        if self.byte_range is not None:
+            self.byte_range = None
+            self.reply(504, "RANG is only supported for RETR and HASH")
+            return
+        self.receive_file(self.virtual_path(arg), offset)
+
+    def cmd_appe(self, arg):
+        self.rest_offset = 0
+        if self.byte_range is not None:
+            self.byte_range = None
+            self.reply(504, "RANG is only supported for RETR and HASH")
+            return
+        path = self.virtual_path(arg)
+        st = self.lookup(path)
+        offset = st.size if st is not None and not st.is_dir else 0
+        self.receive_file(path, offset, staged=False)
+
+    def close(self) -> None:
+        """Release any resources held by the session"""
+        if self.passive_socket is not None:
+            self.server.data_ports.release(self.passive_socket)
+            self.passive_socket = None
 
 class FTPServer:
-    def __init__(self):
+    def __init__(self, root: Optional[str] = None, passive_ports: Optional[Tuple[int, int]] = None,
+                 metrics: Optional[MetricsRegistry] = None, tracer=None, profiler=None,
+                 fs: Optional[FileSystem] = None, cache: bool = True,
+                 tls: Optional[ssl.SSLContext] = None, tls_required: bool = False,
+                 fsync: str = "never", users: Optional[Dict[str, str]] = None,
+                 anonymous: str = "read"):
+        if anonymous not in ANONYMOUS_ACCESS:
+            raise ValueError(f"Unknown anonymous access: {anonymous}")
         self.running = False
         self.host = "0.0.0.0"
         self.port = None
         self.server_socket = None
         self.clients = []
         self.thread = None
+        self.data_timeout = 30
+        self.tls = tls
+        self.tls_required = tls_required and tls is not None
+        # Named users (name -> password) get full access; see authenticate()
+        self.users = dict(users or {})
+        self.anonymous = anonymous
         
+        self.tracer = tracer or NULL_TRACER
+        self.profiler = profiler
+        self.metrics = metrics or DISABLED
+        self.data_ports = DataPortPool(passive_ports, self.metrics)
+        # root may be a directory or a tar/zip archive; fs overrides both.
+        # fsync is when uploads are flushed to disk: never, always or group
+        self.default_share = fs is None and root is None
+        if fs is not None:
+            backend = fs
+        elif root is None:
+            # Created by start_server(), so that merely building a server has no side effects
+            backend = LocalFS(DEFAULT_SHARE, fsync)
+        else:
+            backend = open_filesystem(root, fsync)
+        self.fs = CachedFS(backend, metrics=self.metrics) if cache else backend
+        self.write_locks = PathLocks(self.metrics)
+        self.hashes = FileHashes()
+        self.active_sessions = self.metrics.gauge(
+            "termshare_server_active_sessions", "Connected control sessions")
+        self.sessions_total = self.metrics.counter(
+            "termshare_server_sessions_total", "Control sessions accepted")
+        self.command_seconds = self.metrics.histogram(
+            "termshare_server_command_seconds", "Time spent handling each FTP command")
+        self.transfer_seconds = self.metrics.histogram(
+            "termshare_server_transfer_seconds", "Duration of data connection transfers")
+        self.bytes_sent = self.metrics.counter(
+            "termshare_server_bytes_sent_total", "Bytes sent over data connections")
+        self.bytes_received = self.metrics.counter(
+            "termshare_server_bytes_received_total", "Bytes received over data connections")
+        self.errors = self.metrics.counter(
+            "termshare_server_errors_total", "Failed commands and transfers by exception type")
+        self.tls_handshakes = self.metrics.counter(
+            "termshare_server_tls_handshakes_total", "TLS handshakes by channel and session resumption")
+        
+    def authenticate(self, username: str, password: str) -> Optional[str]:
+        """Return the access level for a login, or None if it is refused"""
+        expected = self.users.get(username)
+        if expected is not None:
+            return "write" if hmac.compare_digest(expected.encode(), password.encode()) else None
+        if username.lower() in ANONYMOUS_USERS and self.anonymous != "off":
+            return self.anonymous
+        return None
+    
     def start_server(self, port_range: Tuple[int, int] = (2121, 2140)) -> Tuple[bool, str]:
         """Start a synchronous FTP server"""
         if self.running:
             return False, "Server is already running"
         
+        if self.default_share:
+            try:
+                os.makedirs(DEFAULT_SHARE, exist_ok=True)
+            except OSError as e:
+                return False, f"Cannot create share directory {DEFAULT_SHARE}: {e.strerror or e}"
+        
         # Find an available port in the range
         for port in range(port_range[0], port_range[1] + 1):
             try:
                 self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                # Allow a restart while old sessions are still in TIME_WAIT
+                self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
                 self.server_socket.bind((self.host, port))
-                self.port = port
+                self.port = self.server_socket.getsockname()[1]
                 break
             except:
+                self.server_socket.close()
                 if port == port_range[1]:
                     return False, "No available ports in the specified range"
                 continue
@@ -49,11 +1054,25 @@ class FTPServer:
         
         self.running = False
         if self.server_socket:
+            # close() alone leaves a thread blocked in accept() holding the port open
+            try:
+                self.server_socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
             self.server_socket.close()
+        if self.thread is not None:
+            self.thread.join(timeout=1)
         
-        for client in self.clients:
+        for client in list(self.clients):
+            try:
+                client.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
             client.close()
         
+        # Stop the cache's change watcher and any group-commit thread
+        self.fs.close()
+        
         return True, "Server stopped"
     
     def _accept_clients(self):
@@ -61,6 +1080,8 @@ class FTPServer:
         while self.running:
             try:
                 client_socket, address = self.server_socket.accept()
+                # Replies are small and sent back to back; don't let Nagle hold them
+                client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
                 self.clients.append(client_socket)
                 client_thread = threading.Thread(target=self._handle_client, args=(client_socket, address))
                 client_thread.daemon = True
@@ -68,22 +1089,29 @@ class FTPServer:
             except:
                 break
     
+    def replace_client(self, old: socket.socket, new: socket.socket) -> None:
+        """Track a client socket that was wrapped in TLS"""
+        try:
+            self.clients[self.clients.index(old)] = new
+        except ValueError:
+            pass
+    
     def _handle_client(self, client_socket, address):
         """Handle client connection"""
+        session = FTPSession(self, client_socket, address)
+        self.sessions_total.inc()
+        self.active_sessions.inc()
         try:
-            client_socket.send(b"220 Welcome to TermShare FTP Server\r\n")
-            while self.running:
-                data = client_socket.recv(1024)
-                if not data:
-                    break
-                # Echo back the received data
-                client_socket.send(data)
+            session.run()
         except:
             pass
         finally:
-            client_socket.close()
-            if client_socket in self.clients:
-                self.clients.remove(client_socket)
+            self.active_sessions.dec()
+            session.close()
+            # session.sock is the TLS socket once AUTH TLS has succeeded
+            session.sock.close()
+            if session.sock in self.clients:
+                self.clients.remove(session.sock)
     
     async def async_start_server(self, port_range: Tuple[int, int] = (2121, 2140)) -> Tuple[bool, str]:
         """Asynchronously start server"""
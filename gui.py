@@ -9,9 +9,12 @@ import asyncio
 import threading
 import random
 import os
+import sqlite3
 from datetime import datetime
 from ftp_client import FTPClient
-from ftp_server import FTPServer
+from ftp_server import DEFAULT_SHARE, FTPServer
+from discovery import PeerDiscovery, send_to_peers
+from journal import TransferJournal, async_run_job, remote_path_for, run_job
 
 class TermShareApp:
     def __init__(self, root):
@@ -37,6 +40,27 @@ class TermShareApp:
         
         # Log startup message
         self.log_message("TermShare started. Ready to connect.")
+        
+        # Find other instances on the network; updates arrive on the discovery thread
+        self.peers = {}
+        self.discovery = PeerDiscovery(
+            self.display_name, on_change=lambda peers: self.root.after(0, self._peers_changed, peers))
+        success, message = self.discovery.start()
+        self.log_message(message)
+        
+        # Transfers are journalled so that ones cut short by a crash resume on reconnecting
+        self.running_jobs = set()
+        try:
+            self.journal = TransferJournal()
+        except (OSError, sqlite3.Error) as e:
+            self.journal = None
+            self.log_message(f"Transfer journal unavailable; interrupted transfers will not resume: {e}")
+        else:
+            unfinished = self.journal.unfinished()
+            if unfinished:
+                servers = ", ".join(sorted({f"{job.host}:{job.port}" for job in unfinished}))
+                self.log_message(f"{len(unfinished)} unfinished transfer(s) will resume on connecting to {servers}")
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
     
     def setup_ui(self):
         # Create main frames
@@ -47,7 +71,7 @@ class TermShareApp:
         self.root.columnconfigure(0, weight=1)
         self.root.rowconfigure(0, weight=1)
         main_frame.columnconfigure(1, weight=1)
-        main_frame.rowconfigure(4, weight=1)
+        main_frame.rowconfigure(5, weight=1)
         
         # Connection frame
         conn_frame = ttk.LabelFrame(main_frame, text="Connection Settings", padding="5")
@@ -84,6 +108,11 @@ class TermShareApp:
         self.async_check = ttk.Checkbutton(conn_frame, text="Use Async", variable=self.async_var)
         self.async_check.grid(row=2, column=2, sticky=tk.W, pady=2, padx=(10, 0))
         
+        # Anonymous visitors may only download unless uploads are allowed here
+        self.uploads_var = tk.BooleanVar(value=False)
+        self.uploads_check = ttk.Checkbutton(conn_frame, text="Accept uploads from peers", variable=self.uploads_var)
+        self.uploads_check.grid(row=3, column=2, columnspan=2, sticky=tk.W, pady=2, padx=(10, 0))
+        
         # Buttons frame
         button_frame = ttk.Frame(conn_frame)
         button_frame.grid(row=2, column=3, sticky=(tk.W, tk.E), pady=2)
@@ -113,9 +142,31 @@ class TermShareApp:
         self.mkdir_btn = ttk.Button(file_frame, text="Create Directory", command=self.create_directory, state=tk.DISABLED)
         self.mkdir_btn.grid(row=0, column=3, padx=(0, 5))
         
+        # Peers frame
+        peer_frame = ttk.LabelFrame(main_frame, text="Peers on this Network", padding="5")
+        peer_frame.grid(row=2, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(0, 10))
+        peer_frame.columnconfigure(0, weight=1)
+        
+        self.peer_tree = ttk.Treeview(peer_frame, columns=("name", "address"), show="headings",
+                                      height=4, selectmode="extended")
+        self.peer_tree.heading("name", text="Display Name")
+        self.peer_tree.heading("address", text="Address")
+        self.peer_tree.column("name", width=200)
+        self.peer_tree.column("address", width=200)
+        self.peer_tree.grid(row=0, column=0, rowspan=2, sticky=(tk.W, tk.E))
+        
+        # Bind double-click to connect to the peer
+        self.peer_tree.bind("<Double-1>", lambda event: self.connect_to_peer())
+        
+        self.peer_connect_btn = ttk.Button(peer_frame, text="Connect to Peer", command=self.connect_to_peer)
+        self.peer_connect_btn.grid(row=0, column=1, sticky=(tk.W, tk.E), padx=(5, 0))
+        
+        self.send_peers_btn = ttk.Button(peer_frame, text="Send to Selected Peers", command=self.send_to_peers)
+        self.send_peers_btn.grid(row=1, column=1, sticky=(tk.W, tk.E), padx=(5, 0), pady=(5, 0))
+        
         # File list frame
         list_frame = ttk.LabelFrame(main_frame, text="Remote Files", padding="5")
-        list_frame.grid(row=2, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(0, 10))
+        list_frame.grid(row=3, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(0, 10))
         list_frame.columnconfigure(0, weight=1)
         list_frame.rowconfigure(0, weight=1)
         
@@ -153,7 +204,7 @@ class TermShareApp:
         
         # Log frame
         log_frame = ttk.LabelFrame(main_frame, text="Activity Log", padding="5")
-        log_frame.grid(row=3, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(0, 10))
+        log_frame.grid(row=4, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(0, 10))
         log_frame.columnconfigure(0, weight=1)
         log_frame.rowconfigure(0, weight=1)
         
@@ -164,7 +215,7 @@ class TermShareApp:
         self.status_var = tk.StringVar()
         self.status_var.set("Ready")
         status_bar = ttk.Label(main_frame, textvariable=self.status_var, relief=tk.SUNKEN, anchor=tk.W)
-        status_bar.grid(row=4, column=0, columnspan=2, sticky=(tk.W, tk.E))
+        status_bar.grid(row=5, column=0, columnspan=2, sticky=(tk.W, tk.E))
     
     def log_message(self, message):
         """Add a message to the log with timestamp"""
@@ -183,6 +234,7 @@ class TermShareApp:
     def connect_ftp(self):
         """Connect to FTP server"""
         self.display_name = self.name_entry.get()
+        self.discovery.name = self.display_name
         self.host_address = self.host_entry.get()
         
         try:
@@ -246,11 +298,52 @@ class TermShareApp:
             
             # Refresh file list
             self.refresh_file_list()
+            self._resume_transfers()
         else:
             self.log_message(message)
             self.set_status("Connection failed")
             messagebox.showerror("Connection Error", message)
     
+    def _resume_transfers(self):
+        """Resume journalled transfers to or from the server just connected to"""
+        if self.journal is None:
+            return
+        jobs = [job for job in self.journal.unfinished(self.ftp_client.host, self.ftp_client.port,
+                                                       self.ftp_client.username)
+                if job.tls == (self.ftp_client.tls is not None) and job.id not in self.running_jobs]
+        if not jobs:
+            return
+        self.running_jobs.update(job.id for job in jobs)
+        self.log_message(f"Resuming {len(jobs)} unfinished transfer(s)...")
+        threading.Thread(target=self._resume_thread, args=(jobs,), daemon=True).start()
+    
+    def _resume_thread(self, jobs):
+        """Thread running resumed transfers one after another"""
+        for job in jobs:
+            success, message = run_job(self.ftp_client, self.journal, job)
+            self.running_jobs.discard(job.id)
+            self.root.after(0, self.log_message, message)
+        self.root.after(0, self.refresh_file_list)
+    
+    def _journal_job(self, direction, remote_path, local_path):
+        """Record a transfer about to start, or None if it cannot be journalled"""
+        if self.journal is None:
+            return None
+        try:
+            job = self.journal.add(direction, self.ftp_client.host, self.ftp_client.port,
+                                   self.ftp_client.username, self.ftp_client.tls is not None,
+                                   remote_path_for(self.ftp_client, remote_path), local_path)
+        except sqlite3.Error as e:
+            self.log_message(f"Cannot journal transfer; it will not resume if interrupted: {e}")
+            return None
+        self.running_jobs.add(job.id)
+        return job
+    
+    def _job_done(self, job):
+        """Forget that a journalled transfer is in progress"""
+        if job is not None:
+            self.running_jobs.discard(job.id)
+    
     def disconnect_ftp(self):
         """Disconnect from FTP server"""
         self.log_message("Disconnecting...")
@@ -309,6 +402,7 @@ class TermShareApp:
         """Start or stop the FTP server"""
         if not self.ftp_server.running:
             # Start server
+            self.ftp_server.anonymous = "upload" if self.uploads_var.get() else "read"
             if self.use_async:
                 threading.Thread(target=self._async_start_server, daemon=True).start()
             else:
@@ -359,6 +453,13 @@ class TermShareApp:
             if self.ftp_server.running:
                 self.set_status(f"Server running on port {self.ftp_server.port}")
                 self.server_btn.config(text="Stop Server")
+                self.uploads_check.config(state=tk.DISABLED)
+                access = "downloads and new uploads" if self.ftp_server.anonymous == "upload" else "downloads only"
+                self.log_message(f"Sharing {DEFAULT_SHARE} ({access})")
+                
+                # Let peers on the network find the server
+                self.display_name = self.name_entry.get()
+                self.discovery.announce(self.ftp_server.port, name=self.display_name)
                 
                 # Update port field with the assigned port
                 self.port_entry.delete(0, tk.END)
@@ -366,6 +467,8 @@ class TermShareApp:
             else:
                 self.set_status("Server stopped")
                 self.server_btn.config(text="Start Server")
+                self.uploads_check.config(state=tk.NORMAL)
+                self.discovery.announce(None)
         else:
             self.log_message(message)
             messagebox.showerror("Server Error", message)
@@ -375,34 +478,40 @@ class TermShareApp:
         if not self.ftp_client.connected:
             return
         
-        # Get current directory
+        # Current directory and file list come back from one pipelined request
         if self.use_async:
-            threading.Thread(target=self._async_get_current_dir, daemon=True).start()
+            threading.Thread(target=self._async_get_listing, daemon=True).start()
         else:
-            success, current_dir = self.ftp_client.get_current_directory()
-            self._current_dir_complete(success, current_dir)
-        
-        # Get file list
-        if self.use_async:
-            threading.Thread(target=self._async_list_files, daemon=True).start()
-        else:
-            success, files = self.ftp_client.list_files()
-            self._file_list_complete(success, files)
+            success, result = self.ftp_client.get_listing()
+            self._listing_complete(success, result)
     
-    def _async_get_current_dir(self):
-        """Asynchronously get current directory"""
+    def _async_get_listing(self):
+        """Asynchronously get current directory and file list"""
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         
         try:
-            success, current_dir = loop.run_until_complete(
-                self.ftp_client.async_get_current_directory()
+            success, result = loop.run_until_complete(
+                self.ftp_client.async_get_listing()
             )
         finally:
             loop.close()
         
         # Schedule UI update on the main thread
-        self.root.after(0, self._current_dir_complete, success, current_dir)
+        self.root.after(0, self._listing_complete, success, result)
+    
+    def _listing_complete(self, success, result):
+        """Handle combined current directory and file list result"""
+        if not success:
+            self.log_message(result)  # result is the error message in this case
+            if not self.ftp_client.connected:
+                # The client gave up reconnecting; show the disconnected state
+                self._disconnection_complete(True, "Disconnected")
+            return
+        
+        current_dir, files = result
+        self._current_dir_complete(True, current_dir)
+        self._file_list_complete(True, files)
     
     def _current_dir_complete(self, success, current_dir):
         """Handle current directory result"""
@@ -411,21 +520,6 @@ class TermShareApp:
         else:
             self.log_message(current_dir)  # In this case, current_dir is the error message
     
-    def _async_list_files(self):
-        """Asynchronously list files"""
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        try:
-            success, files = loop.run_until_complete(
-                self.ftp_client.async_list_files()
-            )
-        finally:
-            loop.close()
-        
-        # Schedule UI update on the main thread
-        self.root.after(0, self._file_list_complete, success, files)
-    
     def _file_list_complete(self, success, files):
         """Handle file list result"""
         if not success:
@@ -509,29 +603,37 @@ class TermShareApp:
         self.set_status("Uploading file...")
         
         # Run upload in a separate thread
+        job = self._journal_job("upload", remote_filename, file_path)
         if self.use_async:
-            threading.Thread(target=self._async_upload, args=(file_path, remote_filename), daemon=True).start()
+            threading.Thread(target=self._async_upload, args=(file_path, remote_filename, job), daemon=True).start()
         else:
-            threading.Thread(target=self._sync_upload, args=(file_path, remote_filename), daemon=True).start()
+            threading.Thread(target=self._sync_upload, args=(file_path, remote_filename, job), daemon=True).start()
     
-    def _async_upload(self, local_path, remote_path):
+    def _async_upload(self, local_path, remote_path, job=None):
         """Asynchronously upload a file"""
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         
         try:
-            success, message = loop.run_until_complete(
-                self.ftp_client.async_upload_file(local_path, remote_path)
-            )
+            if job is not None:
+                operation = async_run_job(self.ftp_client, self.journal, job)
+            else:
+                operation = self.ftp_client.async_upload_file(local_path, remote_path)
+            success, message = loop.run_until_complete(operation)
         finally:
             loop.close()
+            self._job_done(job)
         
         # Schedule UI update on the main thread
         self.root.after(0, self._upload_complete, success, message)
     
-    def _sync_upload(self, local_path, remote_path):
+    def _sync_upload(self, local_path, remote_path, job=None):
         """Synchronously upload a file"""
-        success, message = self.ftp_client.upload_file(local_path, remote_path)
+        if job is not None:
+            success, message = run_job(self.ftp_client, self.journal, job)
+            self._job_done(job)
+        else:
+            success, message = self.ftp_client.upload_file(local_path, remote_path)
         
         # Schedule UI update on the main thread
         self.root.after(0, self._upload_complete, success, message)
@@ -580,29 +682,37 @@ class TermShareApp:
         self.set_status("Downloading file...")
         
         # Run download in a separate thread
+        job = self._journal_job("download", remote_filename, local_path)
         if self.use_async:
-            threading.Thread(target=self._async_download, args=(remote_filename, local_path), daemon=True).start()
+            threading.Thread(target=self._async_download, args=(remote_filename, local_path, job), daemon=True).start()
         else:
-            threading.Thread(target=self._sync_download, args=(remote_filename, local_path), daemon=True).start()
+            threading.Thread(target=self._sync_download, args=(remote_filename, local_path, job), daemon=True).start()
     
-    def _async_download(self, remote_path, local_path):
+    def _async_download(self, remote_path, local_path, job=None):
         """Asynchronously download a file"""
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         
         try:
-            success, message = loop.run_until_complete(
-                self.ftp_client.async_download_file(remote_path, local_path)
-            )
+            if job is not None:
+                operation = async_run_job(self.ftp_client, self.journal, job)
+            else:
+                operation = self.ftp_client.async_download_file(remote_path, local_path)
+            success, message = loop.run_until_complete(operation)
         finally:
             loop.close()
+            self._job_done(job)
         
         # Schedule UI update on the main thread
         self.root.after(0, self._download_complete, success, message)
     
-    def _sync_download(self, remote_path, local_path):
+    def _sync_download(self, remote_path, local_path, job=None):
         """Synchronously download a file"""
-        success, message = self.ftp_client.download_file(remote_path, local_path)
+        if job is not None:
+            success, message = run_job(self.ftp_client, self.journal, job)
+            self._job_done(job)
+        else:
+            success, message = self.ftp_client.download_file(remote_path, local_path)
         
         # Schedule UI update on the main thread
         self.root.after(0, self._download_complete, success, message)
@@ -654,4 +764,90 @@ class TermShareApp:
             self.refresh_file_list()
         else:
             self.log_message(message)
-            messagebox.showerror("Create Directory Error", message)
\ No newline at end of file
+            messagebox.showerror("Create Directory Error", message)
+    
+    def _peers_changed(self, peers):
+        """Show the current list of discovered peers, keeping the selection"""
+        selected = set(self.peer_tree.selection())
+        self.peers = {peer.instance: peer for peer in peers}
+        
+        for item in self.peer_tree.get_children():
+            self.peer_tree.delete(item)
+        
+        for peer in peers:
+            name = f"{peer.name} (TLS)" if peer.tls else peer.name
+            self.peer_tree.insert("", tk.END, iid=peer.instance, values=(name, f"{peer.host}:{peer.port}"))
+        
+        self.peer_tree.selection_set([item for item in selected if item in self.peers])
+    
+    def _selected_peers(self):
+        """Peers selected in the peer list"""
+        return [self.peers[item] for item in self.peer_tree.selection() if item in self.peers]
+    
+    def connect_to_peer(self):
+        """Connect to the selected peer's server"""
+        peers = self._selected_peers()
+        if not peers:
+            messagebox.showwarning("Connect", "Please select a peer to connect to")
+            return
+        
+        if self.ftp_client.connected:
+            messagebox.showwarning("Connect", "Please disconnect first")
+            return
+        
+        peer = peers[0]
+        self.host_entry.delete(0, tk.END)
+        self.host_entry.insert(0, peer.host)
+        self.port_entry.delete(0, tk.END)
+        self.port_entry.insert(0, str(peer.port))
+        self.connect_ftp()
+    
+    def send_to_peers(self):
+        """Upload a file to every selected peer at once"""
+        peers = self._selected_peers()
+        if not peers:
+            messagebox.showwarning("Send", "Please select one or more peers")
+            return
+        
+        file_path = filedialog.askopenfilename(title="Select file to send")
+        if not file_path:
+            return
+        
+        self.log_message(f"Sending {file_path} to {len(peers)} peer(s)...")
+        self.set_status("Sending file to peers...")
+        
+        # Uploads run in parallel; each result is logged as it arrives
+        threading.Thread(
+            target=self._send_to_peers_thread,
+            args=(peers, file_path),
+            daemon=True
+        ).start()
+    
+    def _send_to_peers_thread(self, peers, local_path):
+        """Thread for uploading a file to several peers"""
+        # Log in anonymously: the Connection Settings password belongs to one
+        # server and must not be handed to every peer on the network
+        results = send_to_peers(
+            peers, local_path,
+            on_result=lambda peer, success, message: self.root.after(0, self.log_message, message)
+        )
+        
+        # Schedule UI update on the main thread
+        self.root.after(0, self._send_to_peers_complete, results)
+    
+    def _send_to_peers_complete(self, results):
+        """Handle the results of sending a file to peers"""
+        failed = [message for peer, success, message in results if not success]
+        self.set_status(f"Sent to {len(results) - len(failed)} of {len(results)} peer(s)")
+        if failed:
+            messagebox.showerror("Send Error", "\n".join(failed))
+    
+    def on_close(self):
+        """Tell peers this instance is going away, then close the window"""
+        self.discovery.stop()
+        if self.ftp_server.running:
+            self.ftp_server.stop_server()
+        if self.journal is not None:
+            # Transfers still running are picked up from their last checkpoint next time
+            self.journal.close()
+        self.root.destroy()
\ No newline at end of file
@@ -0,0 +1,317 @@
+"""
+Journal module for TermShare
+Records transfers in SQLite so that unfinished ones resume after a crash or reboot
+"""
+
+import os
+import time
+import asyncio
+import hashlib
+import sqlite3
+import posixpath
+import threading
+from contextlib import contextmanager
+from typing import List, NamedTuple, Optional, Tuple
+from file_io import CHUNK_SIZE, part_path
+
+DEFAULT_JOURNAL = os.path.join(os.path.expanduser("~"), ".termshare", "journal.sqlite3")
+
+# Failed runs after which a job is abandoned instead of resumed again
+MAX_ATTEMPTS = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    direction TEXT NOT NULL,
+    host TEXT NOT NULL,
+    port INTEGER NOT NULL,
+    user TEXT NOT NULL,
+    tls INTEGER NOT NULL,
+    remote_path TEXT NOT NULL,
+    local_path TEXT NOT NULL,
+    size INTEGER,
+    fingerprint TEXT,
+    committed INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    message TEXT NOT NULL DEFAULT '',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+CREATE TABLE IF NOT EXISTS segments (
+    job INTEGER NOT NULL REFERENCES jobs (id) ON DELETE CASCADE,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    PRIMARY KEY (job, start)
+);
+"""
+
+class Job(NamedTuple):
+    """One recorded transfer
+
+    committed is how far the transfer is known to have got: for downloads,
+    bytes of the part file that were on disk when recorded. fingerprint
+    identifies the source as it was when the job started (size and MDTM of
+    the remote file, or size and mtime of the local one), so a source that
+    changed since is transferred again from the start. attempts counts the
+    runs that failed.
+    """
+    id: int
+    direction: str
+    host: str
+    port: int
+    user: str
+    tls: bool
+    remote_path: str
+    local_path: str
+    size: Optional[int]
+    fingerprint: Optional[str]
+    committed: int
+    status: str
+    message: str
+    attempts: int
+
+# Job fields in column order
+_COLUMNS = ", ".join(Job._fields)
+
+def _job(row) -> Job:
+    return Job(*row[:5], bool(row[5]), *row[6:])
+
+class TransferJournal:
+    """SQLite journal of transfers, in WAL mode so every checkpoint is a cheap append
+
+    Jobs are "queued" until started, then "running", and end "done",
+    "failed" or "cancelled". Queued, running and failed jobs are unfinished
+    and are picked up again by resume. A job that fails MAX_ATTEMPTS times,
+    or an upload whose local file is gone, is "abandoned" instead. Each job's segments are the SHA-256
+    of consecutive stretches of the data, used to check a partial download
+    before continuing it.
+    """
+
+    def __init__(self, path: str = DEFAULT_JOURNAL):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        # Shared by the GUI's transfer threads; self.lock serialises use
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        try:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            # Durable at each WAL checkpoint; a crash can only lose the latest
+            # records, leaving the journal behind the data, never ahead of it
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute("PRAGMA foreign_keys=ON")
+            self.db.executescript(SCHEMA)
+            columns = [row[1] for row in self.db.execute("PRAGMA table_info(jobs)")]
+            if "attempts" not in columns:
+                # Journal written before attempts were counted
+                self.db.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+        except sqlite3.Error:
+            self.db.close()
+            raise
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        with self.lock:
+            return self.db.execute(sql, params)
+
+    @contextmanager
+    def _transaction(self):
+        """Run several statements as one atomic append"""
+        with self.lock:
+            self.db.execute("BEGIN")
+            # Commits on success, rolls back on error
+            with self.db:
+                yield self.db
+
+    def add(self, direction: str, host: str, port: int, user: str, tls: bool,
+            remote_path: str, local_path: str) -> Job:
+        """Record a new transfer; remote_path should be absolute so it can be found again"""
+        now = time.time()
+        cursor = self._execute(
+            "INSERT INTO jobs (direction, host, port, user, tls, remote_path, local_path, status, created, updated)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, 'queued', ?, ?)",
+            (direction, host, port, user, int(tls), remote_path, os.path.abspath(local_path), now, now))
+        return self.get(cursor.lastrowid)
+
+    def get(self, job_id: int) -> Optional[Job]:
+        row = self._execute(f"SELECT {_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _job(row) if row else None
+
+    def unfinished(self, host: Optional[str] = None, port: Optional[int] = None,
+                   user: Optional[str] = None) -> List[Job]:
+        """Jobs not yet done, oldest first, optionally only those for one server and login"""
+        rows = self._execute(f"SELECT {_COLUMNS} FROM jobs WHERE status IN ('queued', 'running', 'failed') ORDER BY id").fetchall()
+        return [job for job in map(_job, rows)
+                if (host is None or job.host == host) and (port is None or job.port == port)
+                and (user is None or job.user == user)]
+
+    def segments(self, job_id: int) -> List[Tuple[int, int, str]]:
+        return self._execute("SELECT start, end, sha256 FROM segments WHERE job = ? ORDER BY start",
+                             (job_id,)).fetchall()
+
+    def begin(self, job_id: int, size: Optional[int], fingerprint: Optional[str]) -> None:
+        """Mark a job running, recording what its source looked like"""
+        self._execute("UPDATE jobs SET status = 'running', size = ?, fingerprint = ?, updated = ? WHERE id = ?",
+                      (size, fingerprint, time.time(), job_id))
+
+    def rewind(self, job_id: int, offset: int) -> None:
+        """Forget progress past offset, where the transfer is about to continue"""
+        with self._transaction() as db:
+            db.execute("DELETE FROM segments WHERE job = ? AND end > ?", (job_id, offset))
+            db.execute("UPDATE jobs SET committed = MIN(committed, ?), updated = ? WHERE id = ?",
+                       (offset, time.time(), job_id))
+
+    def checkpoint(self, job_id: int, start: int, end: int, sha256: str) -> None:
+        """Record that bytes start..end-1 have been transferred (and, for downloads, are on disk)"""
+        with self._transaction() as db:
+            # A resumed transfer rewrites anything recorded past its restart point
+            db.execute("DELETE FROM segments WHERE job = ? AND end > ?", (job_id, start))
+            db.execute("INSERT INTO segments (job, start, end, sha256) VALUES (?, ?, ?, ?)",
+                       (job_id, start, end, sha256))
+            db.execute("UPDATE jobs SET committed = ?, updated = ? WHERE id = ?", (end, time.time(), job_id))
+
+    def finish(self, job_id: int, success: bool, message: str, retry: bool = True) -> None:
+        """Mark a job done, or failed and left for resume unless retry is False or it failed too often"""
+        if success:
+            self._end(job_id, "done", message)
+            return
+        with self._transaction() as db:
+            row = db.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            attempts = (row[0] if row else 0) + 1
+            status = "failed" if retry and attempts < MAX_ATTEMPTS else "abandoned"
+            if status == "abandoned":
+                db.execute("DELETE FROM segments WHERE job = ?", (job_id,))
+            db.execute("UPDATE jobs SET status = ?, message = ?, attempts = ?, updated = ? WHERE id = ?",
+                       (status, message, attempts, time.time(), job_id))
+
+    def cancel(self, job_id: int) -> None:
+        """Stop resuming a job without it having finished"""
+        self._end(job_id, "cancelled", "Cancelled")
+
+    def _end(self, job_id: int, status: str, message: str) -> None:
+        with self._transaction() as db:
+            if status != "failed":
+                # Only needed to continue the transfer
+                db.execute("DELETE FROM segments WHERE job = ?", (job_id,))
+            db.execute("UPDATE jobs SET status = ?, message = ?, updated = ? WHERE id = ?",
+                       (status, message, time.time(), job_id))
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.close()
+
+def remote_path_for(client, path: str) -> str:
+    """Absolute form of a remote path, so a resumed job does not depend on the working directory"""
+    if path.startswith("/"):
+        return path
+    cwd = client.cwd
+    if cwd is None:
+        success, cwd = client.get_current_directory()
+        if not success:
+            cwd = "/"
+    return posixpath.join(cwd, path)
+
+def run_job(client, journal: TransferJournal, job: Job) -> Tuple[bool, str]:
+    """Run or resume a recorded transfer on a client connected to the job's server"""
+    checkpoint = lambda start, end, sha256: journal.checkpoint(job.id, start, end, sha256)
+    retry = True
+    try:
+        if job.direction == "download":
+            resume = _prepare_download(client, journal, job)
+            if resume is None:
+                success, message = True, f"Downloaded {job.remote_path} to {job.local_path}"
+            else:
+                success, message = client.download_file(job.remote_path, job.local_path, resume=resume,
+                                                        checkpoint=checkpoint)
+        else:
+            resume = _prepare_upload(journal, job)
+            success, message = client.upload_file(job.local_path, job.remote_path, resume=resume,
+                                                  checkpoint=checkpoint)
+    except FileNotFoundError as e:
+        # The file to upload is gone; there is nothing left to resume
+        success, message, retry = False, f"{job.local_path}: {e.strerror or e}", False
+    except OSError as e:
+        success, message = False, f"{job.local_path}: {e.strerror or e}"
+    except (ValueError, IndexError) as e:
+        success, message = False, f"{job.remote_path}: {e}"
+    journal.finish(job.id, success, message, retry)
+    return success, message
+
+async def async_run_job(client, journal: TransferJournal, job: Job) -> Tuple[bool, str]:
+    """Asynchronously run or resume a recorded transfer"""
+    return await asyncio.get_event_loop().run_in_executor(None, run_job, client, journal, job)
+
+def _remote_fingerprint(client, path: str) -> Tuple[Optional[int], Optional[str]]:
+    """Size and modification time of a remote file, in one round trip"""
+    success, replies = client.run_batch(['TYPE I', f'SIZE {path}', f'MDTM {path}'])
+    if not success or not replies[1][0]:
+        return None, None
+    try:
+        size = int(replies[1][1].split()[1])
+        modified = replies[2][1].split()[1] if replies[2][0] else ""
+    except (ValueError, IndexError):
+        # A reply this client does not understand; treat the file as unknown
+        return None, None
+    return size, f"{size}:{modified}"
+
+def _prepare_download(client, journal: TransferJournal, job: Job) -> Optional[bool]:
+    """Decide whether a download can continue; None if it had already finished"""
+    size, fingerprint = _remote_fingerprint(client, job.remote_path)
+    if job.committed and fingerprint is not None and fingerprint == job.fingerprint:
+        segments = journal.segments(job.id)
+        part = part_path(job.local_path)
+        if not os.path.exists(part) and segments and segments[-1][1] == size \
+                and _verified_length(job.local_path, segments) == size:
+            # Crashed between renaming the part file into place and recording it
+            return None
+        verified = _verified_length(part, segments)
+        if verified:
+            # Whatever follows the last intact segment is received again
+            os.truncate(part, verified)
+        journal.rewind(job.id, verified)
+        resume = verified > 0
+    else:
+        journal.rewind(job.id, 0)
+        resume = False
+    journal.begin(job.id, size, fingerprint)
+    return resume
+
+def _prepare_upload(journal: TransferJournal, job: Job) -> bool:
+    """Decide whether an upload can continue from what the server has staged"""
+    st = os.stat(job.local_path)
+    fingerprint = f"{st.st_size}:{st.st_mtime_ns}"
+    # The server's staged part says how far the upload got; an edited source
+    # file has to be sent again in full
+    resume = fingerprint == job.fingerprint
+    if not resume:
+        journal.rewind(job.id, 0)
+    journal.begin(job.id, st.st_size, fingerprint)
+    return resume
+
+def _verified_length(path: str, segments: List[Tuple[int, int, str]]) -> int:
+    """Length of the prefix of a file that matches the recorded segments"""
+    verified = 0
+    try:
+        with open(path, 'rb') as f:
+            buffer = bytearray(CHUNK_SIZE)
+            view = memoryview(buffer)
+            for start, end, sha256 in segments:
+                if start != verified:
+                    break
+                digest = hashlib.sha256()
+                remaining = end - start
+                while remaining:
+                    n = f.readinto(view[:min(len(view), remaining)])
+                    if not n:
+                        break
+                    digest.update(view[:n])
+                    remaining -= n
+                if remaining or digest.hexdigest() != sha256:
+                    break
+                verified = end
+    except OSError:
+        pass
+    return verified
@@ -4,11 +4,18 @@ TermShare - Terminal FTP Application
 Main entry point for the application
 """
 
-import tkinter as tk
-from gui import TermShareApp
+import sys
 
 def main():
     """Main function to run the application"""
+    if len(sys.argv) > 1:
+        # Subcommands run headless; Tkinter is never imported
+        from cli import main as cli_main
+        sys.exit(cli_main(sys.argv[1:]))
+
+    import tkinter as tk
+    from gui import TermShareApp
+
     root = tk.Tk()
     app = TermShareApp(root)
     root.mainloop()
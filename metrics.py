@@ -0,0 +1,227 @@
+"""
+Metrics module for TermShare
+Counters, gauges and histograms with a Prometheus-style text endpoint
+"""
+
+import json
+import bisect
+import threading
+from typing import Dict, Sequence, Tuple
+
+# Latency buckets in seconds, from sub-millisecond commands to long transfers
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+def _label_key(labels: Dict[str, str]) -> Tuple:
+    """Turn a label dict into a hashable, ordered key"""
+    return tuple(sorted(labels.items()))
+
+def _escape(value) -> str:
+    """Escape a label value: backslash, double quote and newline"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(key: Tuple, extra: Tuple = ()) -> str:
+    """Render a label key in Prometheus exposition format"""
+    pairs = key + extra
+    if not pairs:
+        return ""
+    body = ",".join('{}="{}"'.format(name, _escape(value)) for name, value in pairs)
+    return "{" + body + "}"
+
+class Counter:
+    """Monotonically increasing value, optionally split by labels"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def snapshot(self) -> Dict:
+        with self.lock:
+            return {_format_labels(key): value for key, value in self.values.items()}
+
+    def render(self):
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                yield f"{self.name}{_format_labels(key)} {value}"
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        with self.lock:
+            self.values[_label_key(labels)] = value
+
+class Histogram:
+    """Distribution of observed values in cumulative buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                # Per-bucket counts plus the +Inf bucket, then sum
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def snapshot(self) -> Dict:
+        result = {}
+        with self.lock:
+            for key, (counts, total) in self.series.items():
+                count = sum(counts)
+                result[_format_labels(key)] = {
+                    "count": count,
+                    "sum": total,
+                    "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], counts)),
+                }
+        return result
+
+    def render(self):
+        with self.lock:
+            for key, (counts, total) in sorted(self.series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    yield f"{self.name}_bucket{_format_labels(key, (('le', le),))} {cumulative}"
+                yield f"{self.name}_sum{_format_labels(key)} {total}"
+                yield f"{self.name}_count{_format_labels(key)} {cumulative}"
+
+class _NullMetric:
+    """Stand-in used when metrics are disabled; every update is a no-op"""
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        pass
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        pass
+
+    def set(self, value: float, **labels) -> None:
+        pass
+
+    def observe(self, value: float, **labels) -> None:
+        pass
+
+_NULL_METRIC = _NullMetric()
+
+class MetricsRegistry:
+    """Collection of named metrics; a disabled registry hands out no-op metrics"""
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get(self, cls, name: str, help_text: str, *args):
+        if not self.enabled:
+            return _NULL_METRIC
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help_text, *args)
+            return metric
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self._get(Counter, name, help_text)
+
+    def gauge(self, name: str, help_text: str) -> Gauge:
+        return self._get(Gauge, name, help_text)
+
+    def histogram(self, name: str, help_text: str, buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help_text, buckets)
+
+    def snapshot(self) -> Dict:
+        """Return all current values as plain data"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {metric.name: {"type": metric.kind, "values": metric.snapshot()} for metric in metrics}
+
+    def render(self) -> str:
+        """Render all metrics in Prometheus text exposition format"""
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+# Shared registry for components created without one
+DISABLED = MetricsRegistry(enabled=False)
+
+class MetricsServer:
+    """Local HTTP endpoint serving /metrics (text) and /metrics.json (snapshot)"""
+
+    def __init__(self, registry: MetricsRegistry, port: int = 9121, host: str = "127.0.0.1"):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.httpd = None
+        self.thread = None
+
+    def start(self) -> Tuple[bool, str]:
+        """Start serving in a background thread"""
+        # Imported here: every client imports this module, few serve metrics
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body = registry.render().encode()
+                    content_type = "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body = json.dumps(registry.snapshot()).encode()
+                    content_type = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self.httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        except OSError as e:
+            return False, f"Metrics endpoint failed: {str(e)}"
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return True, f"Metrics available at http://{self.host}:{self.port}/metrics"
+
+    def stop(self) -> None:
+        """Stop serving"""
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
\ No newline at end of file
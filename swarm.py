@@ -0,0 +1,230 @@
+"""
+Swarm module for TermShare
+Downloads one file from several servers at once, verifying every piece
+"""
+
+import os
+import ssl
+import hashlib
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, NamedTuple, Optional, Sequence, Tuple
+from file_io import CHUNK_SIZE, FileWriter, part_path
+
+# Bytes handed to a source at a time
+RANGE_SIZE = 8 * 1024 * 1024
+
+# An idle source only takes over half of a busy source's range if that half is at least this big
+MIN_STEAL = 1024 * 1024
+
+# Ranges a source may fail to deliver intact before it is dropped
+MAX_FAILURES = 2
+
+class Source(NamedTuple):
+    """A server holding a copy of the file"""
+    host: str
+    port: int = 2121
+    tls: bool = False
+
+class _Range:
+    """Bytes start..end-1 fetched by one source; position is how far it has got"""
+
+    __slots__ = ("start", "end", "position")
+
+    def __init__(self, start: int, end: int):
+        self.start = start
+        self.end = end
+        self.position = start
+
+class _Scheduler:
+    """Hands out byte ranges to sources as they become free
+
+    Ranges are taken from a queue in file order. Once the queue is empty, a
+    free source takes the second half of whatever is left of the largest
+    range still in flight, so a slow source never holds up the end of the
+    download. A range that fails verification goes back on the queue.
+    """
+
+    def __init__(self, size: int, range_size: int, on_progress: Optional[Callable[[int, int], None]]):
+        self.size = size
+        self.pending = deque((start, min(start + range_size, size)) for start in range(0, size, range_size))
+        self.active = set()
+        self.done = 0
+        self.on_progress = on_progress
+        self.condition = threading.Condition()
+
+    def next_range(self) -> Optional[_Range]:
+        """The next range to fetch, or None once nothing is left to do"""
+        with self.condition:
+            while True:
+                if self.pending:
+                    work = _Range(*self.pending.popleft())
+                    break
+                busiest = max(self.active, key=lambda work: work.end - work.position, default=None)
+                if busiest is None:
+                    return None
+                remaining = busiest.end - busiest.position
+                if remaining >= 2 * MIN_STEAL:
+                    middle = busiest.position + remaining // 2
+                    work = _Range(middle, busiest.end)
+                    busiest.end = middle
+                    break
+                # Nothing worth splitting; wait in case a range in flight fails
+                self.condition.wait()
+            self.active.add(work)
+            return work
+
+    def claim(self, work: _Range, offset: int, length: int) -> int:
+        """How much of a chunk received at offset still belongs to work"""
+        with self.condition:
+            kept = max(0, min(length, work.end - offset))
+            work.position = offset + kept
+            return kept
+
+    def finish(self, work: _Range, verified: bool) -> None:
+        """Retire a range, putting it back on the queue unless it arrived intact"""
+        with self.condition:
+            self.active.discard(work)
+            if verified:
+                self.done += work.end - work.start
+            else:
+                self.pending.append((work.start, work.end))
+            self.condition.notify_all()
+            done = self.done
+        if verified and self.on_progress is not None:
+            self.on_progress(done, self.size)
+
+    def complete(self) -> bool:
+        with self.condition:
+            return self.done == self.size
+
+class _Swarm:
+    """One multi-source download; see swarm_download()"""
+
+    def __init__(self, remote_path: str, writer: FileWriter, scheduler: _Scheduler):
+        self.remote_path = remote_path
+        self.writer = writer
+        self.scheduler = scheduler
+        self.lock = threading.Lock()
+        self.received = Counter()
+        self.errors = []
+
+    def work(self, name: str, client) -> None:
+        """Fetch and verify ranges through one source until none are left"""
+        failures = 0
+        while True:
+            work = self.scheduler.next_range()
+            if work is None:
+                return
+            start = work.start
+            success, result = client.download_range(
+                self.remote_path, self.writer, start, work.end,
+                claim=lambda offset, length, work=work: self.scheduler.claim(work, offset, length))
+            if success:
+                # work.end may have moved while in flight; all of what is left must have arrived
+                kept, digest = result
+                end = start + kept
+                success = end == work.end and client.get_hash(self.remote_path, start, end) == (True, digest)
+                if not success:
+                    result = f"bytes {start}-{work.end - 1} arrived short or corrupted"
+            self.scheduler.finish(work, success)
+            if success:
+                with self.lock:
+                    self.received[name] += kept
+                continue
+            failures += 1
+            if failures >= MAX_FAILURES:
+                with self.lock:
+                    self.errors.append(f"{name}: {result}")
+                return
+
+def _probe(source, remote_path: str, user: str, password: str, tls_context, metrics, tracer):
+    """Connect to a source and fetch the file's size and hash there"""
+    from ftp_client import FTPClient
+    tls = None
+    if source.tls:
+        tls = tls_context or ssl.create_default_context()
+    client = FTPClient(metrics=metrics, tracer=tracer, tls=tls, auto_reconnect=False)
+    success, message = client.connect(source.host, source.port, user, password)
+    if not success:
+        return client, False, message
+    success, info = client.get_file_info(remote_path)
+    return client, success, info
+
+def swarm_download(sources: Sequence, remote_path: str, local_path: str,
+                   user: str = "anonymous", password: str = "", tls_context=None,
+                   sha256: Optional[str] = None, range_size: int = RANGE_SIZE,
+                   on_progress: Optional[Callable[[int, int], None]] = None,
+                   metrics=None, tracer=None) -> Tuple[bool, str]:
+    """Download one file from several servers holding the same copy
+
+    sources are Source tuples or discovered peers (anything with host, port
+    and tls). Every source is asked for the file's size and SHA-256 (SIZE,
+    HASH); those that disagree with the majority, or with sha256 if given,
+    are left out. Byte ranges are then fetched from all remaining sources at
+    once, each checked against the HASH of that range on the source that
+    sent it, and written in place. The whole file is checked once more
+    before it replaces local_path. on_progress(done, total) is called as
+    ranges are verified.
+    """
+    if not sources:
+        return False, "No sources to download from"
+    names = [f"{source.host}:{source.port}" for source in sources]
+
+    with ThreadPoolExecutor(max_workers=len(sources)) as pool:
+        probes = list(pool.map(lambda source: _probe(source, remote_path, user, password,
+                                                     tls_context, metrics, tracer), sources))
+    try:
+        infos = Counter(info for client, success, info in probes if success)
+        if sha256 is not None:
+            expected = next((info for info in infos if info[1] == sha256.lower()), None)
+        else:
+            expected = infos.most_common(1)[0][0] if infos else None
+        if expected is None:
+            problems = [f"{name}: {info if not success else 'different copy'}"
+                        for name, (client, success, info) in zip(names, probes)]
+            return False, "No source has the requested copy of the file (" + "; ".join(problems) + ")"
+        size, digest = expected
+        usable = [(name, client) for name, (client, success, info) in zip(names, probes)
+                  if success and info == expected]
+
+        part = part_path(local_path)
+        scheduler = _Scheduler(size, range_size, on_progress)
+        with FileWriter(part, size, lock=True) as writer:
+            # Ranges land out of order; make the file its full length up front
+            os.ftruncate(writer.fd, size)
+            swarm = _Swarm(remote_path, writer, scheduler)
+            threads = [threading.Thread(target=swarm.work, args=(name, client), daemon=True)
+                       for name, client in usable]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            writer.seek(size)
+        if not scheduler.complete():
+            os.remove(part)
+            return False, "Download failed; every source stopped responding (" + "; ".join(swarm.errors) + ")"
+        if _file_hash(part) != digest:
+            os.remove(part)
+            return False, "Download failed: the assembled file does not match the sources' hash"
+        os.replace(part, local_path)
+    finally:
+        for client, success, info in probes:
+            client.disconnect()
+
+    shares = ", ".join(f"{name} {100 * swarm.received[name] // max(size, 1)}%" for name, client in usable)
+    return True, f"Downloaded {remote_path} to {local_path} from {len(usable)} source(s) ({shares})"
+
+def _file_hash(path: str) -> str:
+    """SHA-256 of a local file"""
+    digest = hashlib.sha256()
+    buffer = bytearray(CHUNK_SIZE)
+    view = memoryview(buffer)
+    with open(path, 'rb') as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            digest.update(view[:n])
+    return digest.hexdigest()
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the top of the repository rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ftp_client import FTPClient
+from ftp_server import FTPServer
+
+USER, PASSWORD = "alice", "secret"
+
+@pytest.fixture
+def share(tmp_path):
+    path = tmp_path / "share"
+    path.mkdir()
+    return path
+
+@pytest.fixture
+def server(share):
+    """A server on a free port sharing share, with one named user"""
+    server = FTPServer(root=str(share), users={USER: PASSWORD})
+    success, message = server.start_server((0, 0))
+    assert success, message
+    yield server
+    server.stop_server()
+
+@pytest.fixture
+def client(server):
+    client = FTPClient(auto_reconnect=False, keepalive=None)
+    success, message = client.connect("127.0.0.1", server.port, USER, PASSWORD)
+    assert success, message
+    yield client
+    client.disconnect()
@@ -0,0 +1,76 @@
+import ftplib
+
+import pytest
+
+from conftest import PASSWORD, USER
+from ftp_server import FTPServer
+
+def _login(server, user, password):
+    ftp = ftplib.FTP()
+    ftp.connect("127.0.0.1", server.port)
+    ftp.login(user, password)
+    return ftp
+
+@pytest.mark.parametrize("user,password", [(USER, "wrong"), ("mallory", PASSWORD)])
+def test_bad_credentials_are_refused(server, user, password):
+    with pytest.raises(ftplib.error_perm, match="530"):
+        _login(server, user, password)
+
+def test_anonymous_is_read_only_by_default(server, share):
+    (share / "readme.txt").write_bytes(b"hi")
+    ftp = _login(server, "anonymous", "guest@")
+    try:
+        assert ftp.size("readme.txt") == 2
+        for command in ("MKD new", "DELE readme.txt", "RNFR readme.txt"):
+            with pytest.raises(ftplib.error_perm, match="550"):
+                ftp.sendcmd(command)
+    finally:
+        ftp.close()
+    assert (share / "readme.txt").exists()
+
+def test_anonymous_upload_cannot_overwrite(share):
+    server = FTPServer(root=str(share), anonymous="upload")
+    assert server.start_server((0, 0))[0]
+    (share / "old.txt").write_bytes(b"keep")
+    ftp = _login(server, "anonymous", "")
+    try:
+        ftp.sendcmd("MKD drop")
+        with pytest.raises(ftplib.error_perm, match="550"):
+            ftp.sendcmd("MKD drop")
+        with pytest.raises(ftplib.error_perm, match="550"):
+            ftp.sendcmd("DELE old.txt")
+    finally:
+        ftp.close()
+        server.stop_server()
+    assert (share / "drop").is_dir() and (share / "old.txt").read_bytes() == b"keep"
+
+def test_anonymous_upload_cannot_replace_file_created_during_transfer(share):
+    server = FTPServer(root=str(share), anonymous="upload")
+    assert server.start_server((0, 0))[0]
+    ftp = _login(server, "anonymous", "")
+    try:
+        conn = ftp.transfercmd("STOR race.txt")
+        conn.sendall(b"anonymous")
+        # Someone else creates the file before the upload completes
+        (share / "race.txt").write_bytes(b"owner")
+        conn.close()
+        with pytest.raises(ftplib.error_perm, match="550"):
+            ftp.voidresp()
+    finally:
+        ftp.close()
+        server.stop_server()
+    assert (share / "race.txt").read_bytes() == b"owner"
+    assert [path.name for path in share.iterdir()] == ["race.txt"]
+
+def test_anonymous_off(share):
+    server = FTPServer(root=str(share), anonymous="off")
+    assert server.start_server((0, 0))[0]
+    try:
+        with pytest.raises(ftplib.error_perm, match="530"):
+            _login(server, "anonymous", "")
+    finally:
+        server.stop_server()
+
+def test_unknown_anonymous_mode():
+    with pytest.raises(ValueError):
+        FTPServer(root=".", anonymous="write")
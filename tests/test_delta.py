@@ -0,0 +1,137 @@
+import io
+import os
+import sys
+import random
+import importlib
+
+import pytest
+
+from conftest import PASSWORD, USER
+import delta
+from delta import DeltaEncoder, Signature, apply_delta, signature, weak_checksum
+from ftp_client import FTPClient
+from ftp_server import FTPServer
+from metrics import MetricsRegistry
+
+BLOCK = 1024
+
+@pytest.fixture(params=["python", "numpy"])
+def backend(request, monkeypatch):
+    """Run with NumPy when it is installed and with the pure-Python fallback"""
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(delta, "np", None)
+    return request.param
+
+def _edit(data: bytes) -> bytes:
+    """data with a few bytes changed, a stretch inserted and a stretch removed"""
+    rng = random.Random(1)
+    edited = bytearray(data)
+    edited[5000:5010] = os.urandom(10)
+    edited[40000:40000] = os.urandom(777)
+    del edited[90000:93000]
+    edited[rng.randrange(len(edited))] ^= 0xff
+    return bytes(edited) + os.urandom(300)
+
+def _roundtrip(old: bytes, new: bytes, block_size: int = BLOCK):
+    sig = Signature(b"".join(signature(io.BytesIO(old), len(old), block_size)))
+    encoder = DeltaEncoder(sig)
+    stream = io.BytesIO(b"".join(encoder.encode(io.BytesIO(new))))
+    out = io.BytesIO()
+    received, intact = apply_delta(stream.read, io.BytesIO(old), len(old), block_size, out, bytearray(4096))
+    assert intact
+    assert out.getvalue() == new
+    return encoder
+
+def test_works_when_numpy_cannot_be_imported(monkeypatch):
+    monkeypatch.setitem(sys.modules, "numpy", None)
+    try:
+        assert importlib.reload(delta).np is None
+        old = os.urandom(50 * BLOCK)
+        encoder = _roundtrip(old, _edit(old))
+        assert encoder.matched_bytes > 40 * BLOCK
+    finally:
+        monkeypatch.undo()
+        importlib.reload(delta)
+
+def test_rolling_checksum_matches_direct(backend):
+    data = os.urandom(5 * BLOCK)
+    sig = Signature(b"".join(signature(io.BytesIO(data[:BLOCK]), BLOCK, BLOCK)))
+    sig.blocks = {weak_checksum(data[offset:offset + BLOCK]): [0] for offset in range(4 * BLOCK + 1)}
+    sig.build_filter()
+    offsets = [offset for offset, weak in sig.scan(data, 0)]
+    assert offsets == list(range(4 * BLOCK + 1))
+
+def test_edited_file_sends_only_changes(backend):
+    old = os.urandom(200 * BLOCK + 123)
+    new = _edit(old)
+    encoder = _roundtrip(old, new)
+    assert encoder.literal_bytes < 10 * BLOCK
+    assert encoder.matched_bytes + encoder.literal_bytes == len(new)
+
+@pytest.mark.parametrize("old, new", [
+    (b"", b"fresh"),
+    (b"gone", b""),
+    (b"short", b"short"),
+    (b"x" * (3 * BLOCK), b"x" * (3 * BLOCK + 1)),
+])
+def test_edge_cases(backend, old, new):
+    _roundtrip(old, new)
+
+def test_changed_basis_is_detected():
+    old = os.urandom(20 * BLOCK)
+    sig = Signature(b"".join(signature(io.BytesIO(old), len(old), BLOCK)))
+    stream = io.BytesIO(b"".join(DeltaEncoder(sig).encode(io.BytesIO(old))))
+    changed = bytes(BLOCK) + old[BLOCK:]
+    out = io.BytesIO()
+    assert not apply_delta(stream.read, io.BytesIO(changed), len(changed), BLOCK, out, bytearray(4096))[1]
+
+def test_upload_delta_replaces_remote_copy(client, share, tmp_path, backend):
+    old = os.urandom(300 * BLOCK)
+    (share / "disk.img").write_bytes(old)
+    local = tmp_path / "disk.img"
+    new = _edit(old)
+    local.write_bytes(new)
+    success, message = client.upload_delta(str(local), "disk.img", block_size=BLOCK)
+    assert success, message
+    assert "bytes changed" in message
+    assert (share / "disk.img").read_bytes() == new
+    assert not [name for name in os.listdir(share) if name.endswith(".termshare-part")]
+
+def test_signature_is_not_counted_as_downloaded(server, share, tmp_path):
+    old = os.urandom(100 * BLOCK)
+    (share / "disk.img").write_bytes(old)
+    local = tmp_path / "disk.img"
+    local.write_bytes(_edit(old))
+    metrics = MetricsRegistry()
+    client = FTPClient(auto_reconnect=False, keepalive=None, metrics=metrics)
+    try:
+        assert client.connect("127.0.0.1", server.port, USER, PASSWORD)[0]
+        assert client.upload_delta(str(local), "disk.img", block_size=BLOCK)[0]
+    finally:
+        client.disconnect()
+    snapshot = metrics.snapshot()
+    assert snapshot["termshare_client_bytes_received_total"]["values"] == {}
+    assert snapshot["termshare_client_delta_signature_bytes_total"]["values"][""] > 0
+
+def test_upload_delta_without_remote_copy_uploads_in_full(client, share, tmp_path):
+    local = tmp_path / "new.bin"
+    local.write_bytes(os.urandom(50000))
+    assert client.upload_delta(str(local), "new.bin")[0]
+    assert (share / "new.bin").read_bytes() == local.read_bytes()
+
+def test_delta_needs_write_access(share, tmp_path):
+    (share / "disk.img").write_bytes(os.urandom(10 * BLOCK))
+    server = FTPServer(root=str(share), anonymous="upload")
+    assert server.start_server((0, 0))[0]
+    client = FTPClient(auto_reconnect=False, keepalive=None)
+    try:
+        assert client.connect("127.0.0.1", server.port, "anonymous", "")[0]
+        local = tmp_path / "disk.img"
+        local.write_bytes(os.urandom(10 * BLOCK))
+        assert not client.upload_delta(str(local), "disk.img", block_size=BLOCK)[0]
+        assert (share / "disk.img").read_bytes() != local.read_bytes()
+    finally:
+        client.disconnect()
+        server.stop_server()
@@ -0,0 +1,87 @@
+import json
+import socket
+import time
+
+import pytest
+
+from discovery import PeerDiscovery, send_to_peers
+from ftp_server import FTPServer
+
+INTERVAL = 0.1
+
+def _wait_for(condition, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+@pytest.fixture
+def discovery_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+@pytest.fixture
+def instances(discovery_port):
+    """Two instances that can only hear each other on loopback"""
+    created = []
+    for name in ("alpha", "beta"):
+        instance = PeerDiscovery(name, port=discovery_port, interface="127.0.0.1", interval=INTERVAL)
+        success, message = instance.start()
+        if not success:
+            pytest.skip(message)
+        created.append(instance)
+    yield created
+    for instance in created:
+        if instance.running:
+            instance.stop()
+
+def test_announcement_is_seen_and_withdrawn(instances):
+    alpha, beta = instances
+    alpha.announce(2121, tls=True)
+    assert _wait_for(lambda: len(beta.list_peers()) == 1)
+    peer = beta.list_peers()[0]
+    assert (peer.name, peer.host, peer.port, peer.tls) == ("alpha", "127.0.0.1", 2121, True)
+    assert alpha.list_peers() == []
+    alpha.announce(None)
+    assert _wait_for(lambda: beta.list_peers() == [])
+
+def test_silent_peer_expires(instances):
+    alpha, beta = instances
+    alpha.announce(2121)
+    assert _wait_for(lambda: len(beta.list_peers()) == 1)
+    # Stop without saying goodbye, as a crashed instance would
+    alpha.running = False
+    alpha.thread.join()
+    alpha.sock.close()
+    started = time.monotonic()
+    assert _wait_for(lambda: beta.list_peers() == [])
+    assert time.monotonic() - started >= 2 * INTERVAL
+
+def test_announced_host_is_ignored():
+    discovery = PeerDiscovery("gamma")
+    message = {"app": "termshare", "version": 1, "instance": "x", "type": "announce",
+               "name": "mallory", "port": 21, "host": "10.9.9.9"}
+    assert discovery._receive(json.dumps(message).encode(), "192.0.2.7")
+    assert [peer.host for peer in discovery.list_peers()] == ["192.0.2.7"]
+    assert not discovery._receive(b"not json", "192.0.2.7")
+
+def test_send_to_discovered_peer(instances, share, tmp_path):
+    alpha, beta = instances
+    server = FTPServer(root=str(share), anonymous="upload")
+    assert server.start_server((0, 0))[0]
+    try:
+        alpha.announce(server.port)
+        assert _wait_for(lambda: len(beta.list_peers()) == 1)
+        source = tmp_path / "notes.txt"
+        source.write_text("hello")
+        results = send_to_peers(beta.list_peers(), str(source))
+        assert [success for peer, success, message in results] == [True]
+        # Anonymous uploads may add files but not replace them
+        results = send_to_peers(beta.list_peers(), str(source))
+        assert [success for peer, success, message in results] == [False]
+    finally:
+        server.stop_server()
+    assert (share / "notes.txt").read_text() == "hello"
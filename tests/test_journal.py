@@ -0,0 +1,165 @@
+import os
+
+import pytest
+
+from conftest import PASSWORD, USER
+from file_io import part_path
+from ftp_client import FTPClient
+from journal import MAX_ATTEMPTS, TransferJournal, _remote_fingerprint, run_job
+
+SEGMENT = 64 * 1024
+
+class Crash(BaseException):
+    """Stands in for the process dying; nothing in the client catches it"""
+
+class CrashingJournal(TransferJournal):
+    """Journal that dies on a given checkpoint and remembers where checkpoints started"""
+
+    def __init__(self, path, crash_at=None):
+        super().__init__(path)
+        self.crash_at = crash_at
+        self.starts = []
+
+    def checkpoint(self, job_id, start, end, sha256):
+        if len(self.starts) == self.crash_at:
+            raise Crash()
+        self.starts.append(start)
+        super().checkpoint(job_id, start, end, sha256)
+
+def _client(server):
+    client = FTPClient(auto_reconnect=False, keepalive=None)
+    client.checkpoint_bytes = SEGMENT
+    assert client.connect("127.0.0.1", server.port, USER, PASSWORD)[0]
+    return client
+
+def _crash(server, path, direction, remote_path, local_path):
+    """Start a journalled transfer that dies after three checkpoints"""
+    journal = CrashingJournal(path, crash_at=3)
+    job = journal.add(direction, "127.0.0.1", server.port, USER, False, remote_path, local_path)
+    client = _client(server)
+    with pytest.raises(Crash):
+        run_job(client, journal, job)
+    client.disconnect()
+    journal.close()
+    return job
+
+def _resume(server, path):
+    """Reopen the journal as a restarted client would and finish its jobs"""
+    journal = CrashingJournal(path)
+    jobs = journal.unfinished("127.0.0.1", server.port, USER)
+    client = _client(server)
+    try:
+        results = [run_job(client, journal, job) for job in jobs]
+    finally:
+        client.disconnect()
+    assert all(success for success, message in results), results
+    assert journal.unfinished() == []
+    journal.close()
+    return journal.starts
+
+@pytest.fixture
+def journal_path(tmp_path):
+    return str(tmp_path / "journal.sqlite3")
+
+@pytest.fixture
+def data(share):
+    data = os.urandom(1 << 20)
+    (share / "big.bin").write_bytes(data)
+    return data
+
+def test_download_resumes_after_last_checkpoint(server, data, journal_path, tmp_path):
+    target = str(tmp_path / "big.bin")
+    job = _crash(server, journal_path, "download", "/big.bin", target)
+    journal = TransferJournal(journal_path)
+    assert journal.get(job.id).status == "running"
+    assert journal.get(job.id).committed == 3 * SEGMENT
+    journal.close()
+    starts = _resume(server, journal_path)
+    assert starts[0] == 3 * SEGMENT
+    assert open(target, "rb").read() == data
+    assert not os.path.exists(part_path(target))
+
+def test_corrupt_part_file_resumes_from_last_good_segment(server, data, journal_path, tmp_path):
+    target = str(tmp_path / "big.bin")
+    _crash(server, journal_path, "download", "/big.bin", target)
+    with open(part_path(target), "r+b") as fp:
+        fp.seek(SEGMENT + 10)
+        fp.write(b"garbage")
+    starts = _resume(server, journal_path)
+    assert starts[0] == SEGMENT
+    assert open(target, "rb").read() == data
+
+def test_changed_remote_file_downloads_again(server, share, data, journal_path, tmp_path):
+    target = str(tmp_path / "big.bin")
+    _crash(server, journal_path, "download", "/big.bin", target)
+    changed = os.urandom(300000)
+    (share / "big.bin").write_bytes(changed)
+    starts = _resume(server, journal_path)
+    assert starts[0] == 0
+    assert open(target, "rb").read() == changed
+
+def test_upload_resumes_unless_source_changed(server, share, journal_path, tmp_path, monkeypatch):
+    source = tmp_path / "up.bin"
+    data = os.urandom(1 << 20)
+    source.write_bytes(data)
+    _crash(server, journal_path, "upload", "/up.bin", str(source))
+    resumed = []
+    upload = FTPClient.upload_file
+    monkeypatch.setattr(FTPClient, "upload_file",
+                        lambda self, *args, **kwargs: resumed.append(kwargs["resume"]) or upload(self, *args, **kwargs))
+    _resume(server, journal_path)
+    assert resumed == [True]
+    assert (share / "up.bin").read_bytes() == data
+
+    _crash(server, journal_path, "upload", "/up.bin", str(source))
+    edited = os.urandom(200000)
+    source.write_bytes(edited)
+    resumed.clear()
+    _resume(server, journal_path)
+    assert resumed == [False]
+    assert (share / "up.bin").read_bytes() == edited
+
+def test_unfinished_only_lists_jobs_left_to_do(journal_path):
+    journal = TransferJournal(journal_path)
+    try:
+        done = journal.add("download", "a", 2121, "anonymous", False, "/x", "x")
+        cancelled = journal.add("download", "a", 2121, "anonymous", False, "/y", "y")
+        failed = journal.add("upload", "a", 2121, "anonymous", False, "/z", "z")
+        other = journal.add("download", "b", 2121, "anonymous", False, "/x", "x")
+        journal.finish(done.id, True, "ok")
+        journal.cancel(cancelled.id)
+        journal.finish(failed.id, False, "Upload failed")
+        assert [job.id for job in journal.unfinished()] == [failed.id, other.id]
+        assert [job.id for job in journal.unfinished("a", 2121, "anonymous")] == [failed.id]
+        assert journal.unfinished("a", 2121, "bob") == []
+    finally:
+        journal.close()
+
+def test_missing_source_is_abandoned(server, journal_path, tmp_path):
+    journal = TransferJournal(journal_path)
+    client = _client(server)
+    try:
+        upload = journal.add("upload", "127.0.0.1", server.port, USER, False, "/up.bin", str(tmp_path / "gone.bin"))
+        assert not run_job(client, journal, upload)[0]
+        assert journal.get(upload.id).status == "abandoned"
+
+        download = journal.add("download", "127.0.0.1", server.port, USER, False, "/gone.bin",
+                               str(tmp_path / "gone.bin"))
+        for attempt in range(MAX_ATTEMPTS):
+            assert journal.get(download.id).status in ("queued", "failed")
+            assert not run_job(client, journal, journal.get(download.id))[0]
+        assert journal.get(download.id).status == "abandoned"
+        assert journal.get(download.id).attempts == MAX_ATTEMPTS
+        assert journal.unfinished() == []
+    finally:
+        client.disconnect()
+        journal.close()
+
+class GarbledClient:
+    """Answers SIZE and MDTM with replies that do not parse"""
+
+    def run_batch(self, commands):
+        return True, [(True, "200 Type set"), (True, "213 lots"), (True, "213")]
+
+def test_unparsable_size_reply_means_unknown_file():
+    assert _remote_fingerprint(GarbledClient(), "/x") == (None, None)
@@ -0,0 +1,7 @@
+from metrics import MetricsRegistry
+
+def test_label_values_are_escaped():
+    registry = MetricsRegistry()
+    registry.counter("termshare_test_total", "Test counter").inc(path='a\\b "c"\nd')
+    lines = registry.render().splitlines()
+    assert 'termshare_test_total{path="a\\\\b \\"c\\"\\nd"} 1' in lines
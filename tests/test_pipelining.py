@@ -0,0 +1,43 @@
+import socket
+import asyncio
+
+import pytest
+
+from conftest import PASSWORD, USER
+
+def test_batch_replies_in_order(client, share):
+    commands = [f"MKD d{i}" for i in range(200)] + ["MKD d0", "RNFR d1", "RNTO e1", "SIZE missing"]
+    success, replies = client.run_batch(commands, window=64)
+    assert success
+    assert len(replies) == len(commands)
+    assert all(ok and reply.startswith("257") for ok, reply in replies[:200])
+    assert [ok for ok, reply in replies[200:]] == [False, True, True, False]
+    assert all((share / f"d{i}").is_dir() for i in range(2, 200))
+    assert (share / "e1").is_dir() and not (share / "d1").exists()
+
+@pytest.mark.parametrize("window", [1, 2, 3])
+def test_small_windows_complete(client, window):
+    success, replies = client.run_batch(["NOOP"] * 5, window=window)
+    assert success
+    assert [ok for ok, reply in replies] == [True] * 5
+
+@pytest.mark.parametrize("window", [0, -1])
+def test_empty_window_is_rejected(client, window):
+    assert client.run_batch(["NOOP"], window=window) == (False, "Batch window must be at least 1")
+    assert not asyncio.run(client.async_run_batch(["NOOP"], window=window))[0]
+    assert client.run_batch(["NOOP"])[0]
+
+def test_listing_after_pipelined_setup(client, share):
+    (share / "a.txt").write_bytes(b"abc")
+    success, (cwd, lines) = client.get_listing()
+    assert success
+    assert cwd == "/"
+    assert any(line.endswith(" a.txt") for line in lines)
+
+def test_server_answers_commands_sent_in_one_segment(server):
+    with socket.create_connection(("127.0.0.1", server.port)) as sock:
+        stream = sock.makefile("rb")
+        assert stream.readline().startswith(b"220")
+        sock.sendall(f"USER {USER}\r\nPASS {PASSWORD}\r\nPWD\r\nNOOP\r\nQUIT\r\n".encode())
+        codes = [stream.readline()[:3] for _ in range(5)]
+    assert codes == [b"331", b"230", b"257", b"200", b"221"]
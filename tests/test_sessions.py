@@ -0,0 +1,63 @@
+import os
+import socket
+import stat
+
+from conftest import PASSWORD, USER
+from file_io import FileWriter, part_path
+from ftp_client import FTPClient
+
+def test_download_resumes_from_part_file(client, share, tmp_path):
+    data = os.urandom(1 << 20)
+    (share / "big.bin").write_bytes(data)
+    target = tmp_path / "big.bin"
+    # What an interrupted download leaves behind
+    with open(part_path(str(target)), "wb") as fp:
+        fp.write(data[:300000])
+    assert client.download_file("big.bin", str(target), resume=True)[0]
+    assert target.read_bytes() == data
+    assert not os.path.exists(part_path(str(target)))
+
+def test_part_file_longer_than_remote_restarts(client, share, tmp_path):
+    (share / "small.bin").write_bytes(b"new")
+    target = tmp_path / "small.bin"
+    with open(part_path(str(target)), "wb") as fp:
+        fp.write(b"much longer stale data")
+    assert client.download_file("small.bin", str(target), resume=True)[0]
+    assert target.read_bytes() == b"new"
+
+def test_download_to_devnull_writes_in_place(client, share):
+    (share / "big.bin").write_bytes(os.urandom(300000))
+    assert client.download_file("big.bin", os.devnull)[0]
+    assert stat.S_ISCHR(os.stat(os.devnull).st_mode)
+    assert not os.path.exists(part_path(os.devnull))
+
+def test_second_download_cannot_share_part_file(client, share, tmp_path):
+    (share / "a.bin").write_bytes(b"remote")
+    target = tmp_path / "a.bin"
+    with FileWriter(part_path(str(target)), lock=True) as writer:
+        writer.write(b"in progress")
+        success, message = client.download_file("a.bin", str(target))
+        assert not success
+        assert "in progress" in message or "writing this file" in message
+        assert open(part_path(str(target)), "rb").read() == b"in progress"
+    assert not target.exists()
+
+def test_reconnects_after_dropped_control_connection(server, share):
+    (share / "a.txt").write_bytes(b"a")
+    client = FTPClient(keepalive=None)
+    assert client.connect("127.0.0.1", server.port, USER, PASSWORD)[0]
+    try:
+        assert client.change_directory("/")[0]
+        for sock in list(server.clients):
+            sock.shutdown(socket.SHUT_RDWR)
+        success, files = client.list_files()
+        assert success and any(line.endswith(" a.txt") for line in files)
+    finally:
+        client.disconnect()
+
+def test_stop_server_releases_port(server):
+    port = server.port
+    assert server.stop_server()[0]
+    with socket.socket() as sock:
+        assert sock.connect_ex(("127.0.0.1", port)) != 0
+    assert server.start_server((port, port))[0]
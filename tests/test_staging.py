@@ -0,0 +1,82 @@
+import os
+import threading
+
+import pytest
+
+from conftest import PASSWORD, USER
+from ftp_client import FTPClient
+from ftp_server import FTPServer
+
+PART = ".big.bin.termshare-part"
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "big.bin"
+    path.write_bytes(os.urandom(2 << 20))
+    return path
+
+def _fail_after(data):
+    """Stand-in for FTPClient._send_from that sends data and then fails"""
+    def send(conn, reader, span=None, offset=0, checkpoints=None):
+        conn.sendall(data)
+        raise OSError("read error")
+    return send
+
+def test_upload_appears_only_when_complete(client, share, source):
+    assert client.upload_file(str(source), "big.bin")[0]
+    assert (share / "big.bin").read_bytes() == source.read_bytes()
+    assert not (share / PART).exists()
+
+def test_failed_upload_stays_staged_and_resumes(client, share, source):
+    (share / "big.bin").write_bytes(b"previous version")
+    sender, client._send_from = client._send_from, _fail_after(source.read_bytes()[:300000])
+    assert not client.upload_file(str(source), "big.bin")[0]
+    client._send_from = sender
+    # The reset reaches the server before it can commit
+    assert (share / "big.bin").read_bytes() == b"previous version"
+    assert int(client.ftp.sendcmd("SITE PARTSIZE big.bin").split()[1]) == (share / PART).stat().st_size
+    assert client.upload_file(str(source), "big.bin", resume=True)[0]
+    assert (share / "big.bin").read_bytes() == source.read_bytes()
+    assert not (share / PART).exists()
+
+def test_staging_files_are_hidden(client, share):
+    (share / PART).write_bytes(b"partial")
+    success, (cwd, lines) = client.get_listing()
+    assert success and not any(PART in line for line in lines)
+    assert client.run_batch(["SITE PARTSIZE big.bin"])[1][0] == (True, "213 7")
+
+def test_appe_appends_in_place(client, share, tmp_path):
+    (share / "log.txt").write_bytes(b"one\n")
+    extra = tmp_path / "extra.txt"
+    extra.write_bytes(b"two\n")
+    with open(extra, "rb") as fp:
+        client.ftp.storbinary("APPE log.txt", fp)
+    assert (share / "log.txt").read_bytes() == b"one\ntwo\n"
+
+@pytest.mark.parametrize("fsync", ["always", "group"])
+def test_concurrent_uploads_commit_with_fsync(share, tmp_path, fsync):
+    server = FTPServer(root=str(share), users={USER: PASSWORD}, fsync=fsync)
+    assert server.start_server((0, 0))[0]
+    payloads = {f"f{i}.bin": os.urandom(50000 + i) for i in range(8)}
+    results = []
+
+    def upload(name):
+        path = tmp_path / name
+        path.write_bytes(payloads[name])
+        client = FTPClient(auto_reconnect=False, keepalive=None)
+        client.connect("127.0.0.1", server.port, USER, PASSWORD)
+        results.append(client.upload_file(str(path), name)[0])
+        client.disconnect()
+
+    try:
+        threads = [threading.Thread(target=upload, args=(name,)) for name in payloads]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        server.stop_server()
+    assert results == [True] * len(payloads)
+    for name, data in payloads.items():
+        assert (share / name).read_bytes() == data
+    assert not [p for p in share.iterdir() if p.name.endswith(".termshare-part")]
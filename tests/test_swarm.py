@@ -0,0 +1,116 @@
+import ftplib
+import hashlib
+import io
+import os
+import time
+
+import pytest
+
+from ftp_server import FTPServer
+from swarm import Source, _Scheduler, swarm_download
+from vfs import MemoryFS
+
+DATA = os.urandom(6 * 1024 * 1024)
+
+class _SlowFile(io.BytesIO):
+    def read(self, size=-1):
+        time.sleep(0.002)
+        return super().read(size)
+
+class SlowFS(MemoryFS):
+    """MemoryFS that serves file contents at a few MB/s"""
+
+    def open_read(self, path):
+        return _SlowFile(super().open_read(path).read())
+
+def _serve(fs, data=DATA):
+    with fs.open_write("/f.bin") as writer:
+        writer.write(data)
+    server = FTPServer(fs=fs)
+    assert server.start_server((0, 0))[0]
+    return server
+
+@pytest.fixture
+def servers():
+    started = []
+    yield lambda fs, data=DATA: started.append(_serve(fs, data)) or started[-1]
+    for server in started:
+        server.stop_server()
+
+def test_downloads_from_every_source(servers, tmp_path):
+    sources = [Source("127.0.0.1", servers(MemoryFS()).port) for _ in range(3)]
+    progress = []
+    success, message = swarm_download(sources, "f.bin", str(tmp_path / "f.bin"), range_size=1 << 20,
+                                      on_progress=lambda done, total: progress.append(done))
+    assert success, message
+    assert (tmp_path / "f.bin").read_bytes() == DATA
+    assert progress[-1] == len(DATA) and progress == sorted(progress)
+    assert not (tmp_path / ".f.bin.termshare-part").exists()
+
+def test_different_copy_is_left_out(servers, tmp_path):
+    good = [Source("127.0.0.1", servers(MemoryFS()).port) for _ in range(2)]
+    stale = Source("127.0.0.1", servers(MemoryFS(), DATA[:-1] + b"!").port)
+    success, message = swarm_download([stale] + good, "f.bin", str(tmp_path / "f.bin"))
+    assert success, message
+    assert "from 2 source(s)" in message and f":{stale.port}" not in message
+    assert (tmp_path / "f.bin").read_bytes() == DATA
+
+def test_expected_digest_selects_copy(servers, tmp_path):
+    sources = [Source("127.0.0.1", servers(MemoryFS()).port)]
+    success, message = swarm_download(sources, "f.bin", str(tmp_path / "f.bin"), sha256="00" * 32)
+    assert not success and "No source has the requested copy" in message
+    success, message = swarm_download(sources, "f.bin", str(tmp_path / "f.bin"),
+                                      sha256=hashlib.sha256(DATA).hexdigest().upper())
+    assert success, message
+
+def test_fast_source_steals_from_slow_one(servers, tmp_path):
+    fast = Source("127.0.0.1", servers(MemoryFS()).port)
+    slow = Source("127.0.0.1", servers(SlowFS()).port)
+    # One range each: the fast source can only finish early by taking over the slow one's
+    success, message = swarm_download([slow, fast], "f.bin", str(tmp_path / "f.bin"), range_size=len(DATA) // 2)
+    assert success, message
+    assert (tmp_path / "f.bin").read_bytes() == DATA
+    share = int(message.split(f":{fast.port} ")[1].split("%")[0])
+    assert share > 50
+
+def test_unreachable_sources(tmp_path):
+    success, message = swarm_download([Source("127.0.0.1", 1)], "f.bin", str(tmp_path / "f.bin"))
+    assert not success and "127.0.0.1:1" in message
+    assert swarm_download([], "f.bin", str(tmp_path / "f.bin"))[0] is False
+
+def test_scheduler_splits_largest_range_when_queue_is_empty():
+    scheduler = _Scheduler(8 << 20, 8 << 20, None)
+    first = scheduler.next_range()
+    assert (first.start, first.end) == (0, 8 << 20)
+    assert scheduler.claim(first, 0, 1 << 20) == 1 << 20
+    stolen = scheduler.next_range()
+    assert (stolen.start, stolen.end) == (9 << 19, 8 << 20)
+    assert first.end == stolen.start
+    # Data past the new end now belongs to the other range
+    assert scheduler.claim(first, 1 << 20, 4 << 20) == (9 << 19) - (1 << 20)
+    scheduler.finish(stolen, False)
+    assert list(scheduler.pending) == [(9 << 19, 8 << 20)]
+
+def test_server_rang_and_hash(servers):
+    server = servers(MemoryFS())
+    ftp = ftplib.FTP()
+    ftp.connect("127.0.0.1", server.port)
+    ftp.login()
+    try:
+        assert "HASH SHA-256*" in ftp.sendcmd("FEAT")
+        whole = ftp.sendcmd("HASH f.bin").split()
+        assert whole[1:4] == ["SHA-256", f"0-{len(DATA) - 1}", hashlib.sha256(DATA).hexdigest()]
+        assert ftp.sendcmd("RANG 10 19").startswith("350")
+        assert ftp.sendcmd("HASH f.bin").split()[3] == hashlib.sha256(DATA[10:20]).hexdigest()
+        ftp.sendcmd("TYPE I")
+        ftp.sendcmd("RANG 100 4195")
+        chunks = []
+        ftp.retrbinary("RETR f.bin", chunks.append)
+        assert b"".join(chunks) == DATA[100:4196]
+        with pytest.raises(ftplib.error_perm, match="501"):
+            ftp.sendcmd("RANG 5 1")
+        ftp.sendcmd(f"RANG {len(DATA) + 1} {len(DATA) + 2}")
+        with pytest.raises(ftplib.error_perm, match="554"):
+            ftp.sendcmd("HASH f.bin")
+    finally:
+        ftp.close()
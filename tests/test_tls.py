@@ -0,0 +1,91 @@
+import ftplib
+import os
+import shutil
+import ssl
+import subprocess
+
+import pytest
+
+from conftest import PASSWORD, USER
+from ftp_client import FTPClient
+from ftp_server import FTPServer, tls_context
+from metrics import MetricsRegistry
+
+pytestmark = pytest.mark.skipif(shutil.which("openssl") is None, reason="needs the openssl command")
+
+@pytest.fixture(scope="module")
+def certificates(tmp_path_factory):
+    """A throwaway CA and a server certificate it signed for 127.0.0.1"""
+    path = tmp_path_factory.mktemp("pki")
+    def openssl(*args):
+        subprocess.run(["openssl", *args], cwd=path, check=True, capture_output=True)
+    openssl("req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=Test CA",
+            "-keyout", "ca.key", "-out", "ca.pem")
+    openssl("req", "-newkey", "rsa:2048", "-nodes", "-subj", "/CN=127.0.0.1",
+            "-keyout", "server.key", "-out", "server.csr")
+    (path / "ext.cnf").write_text("subjectAltName=IP:127.0.0.1\nbasicConstraints=CA:FALSE\n")
+    openssl("x509", "-req", "-in", "server.csr", "-CA", "ca.pem", "-CAkey", "ca.key",
+            "-CAcreateserial", "-days", "1", "-extfile", "ext.cnf", "-out", "server.pem")
+    return path
+
+@pytest.fixture
+def tls_server(share, certificates):
+    server = FTPServer(root=str(share), users={USER: PASSWORD}, tls_required=True,
+                       tls=tls_context(str(certificates / "server.pem"), str(certificates / "server.key")))
+    assert server.start_server((0, 0))[0]
+    yield server
+    server.stop_server()
+
+@pytest.fixture
+def client_context(certificates):
+    return ssl.create_default_context(cafile=str(certificates / "ca.pem"))
+
+def test_round_trip_resumes_data_sessions(tls_server, client_context, tmp_path):
+    metrics = MetricsRegistry()
+    client = FTPClient(metrics=metrics, tls=client_context, auto_reconnect=False, keepalive=None)
+    assert client.connect("127.0.0.1", tls_server.port, USER, PASSWORD)[0]
+    try:
+        source = tmp_path / "up.bin"
+        source.write_bytes(os.urandom(300000))
+        assert client.upload_file(str(source), "up.bin")[0]
+        assert client.get_listing()[0]
+        assert client.download_file("up.bin", str(tmp_path / "down.bin"))[0]
+    finally:
+        client.disconnect()
+    assert (tmp_path / "down.bin").read_bytes() == source.read_bytes()
+    handshakes = metrics.snapshot()["termshare_client_tls_handshakes_total"]["values"]
+    # Upload, listing and download each resumed the control connection's session
+    assert handshakes == {'{channel="control",resumed="false"}': 1, '{channel="data",resumed="true"}': 3}
+
+def test_plain_login_is_refused(tls_server):
+    client = FTPClient(auto_reconnect=False, keepalive=None)
+    success, message = client.connect("127.0.0.1", tls_server.port, USER, PASSWORD)
+    assert not success and "530" in message
+
+def test_upload_cut_without_close_notify_is_staged(tls_server, client_context, share, tmp_path):
+    data = os.urandom(500000)
+    ftp = ftplib.FTP_TLS(context=client_context)
+    ftp.connect("127.0.0.1", tls_server.port)
+    ftp.login(USER, PASSWORD)
+    ftp.prot_p()
+    ftp.voidcmd("TYPE I")
+    conn = ftp.transfercmd("STOR up.bin")
+    conn.sendall(data[:200000])
+    # SSLSocket.close() drops the connection without sending close_notify
+    conn.close()
+    with pytest.raises(ftplib.error_temp, match="426"):
+        ftp.voidresp()
+    ftp.close()
+    assert not (share / "up.bin").exists()
+    assert 0 < (share / ".up.bin.termshare-part").stat().st_size <= 200000
+
+    source = tmp_path / "up.bin"
+    source.write_bytes(data)
+    client = FTPClient(tls=client_context, auto_reconnect=False, keepalive=None)
+    assert client.connect("127.0.0.1", tls_server.port, USER, PASSWORD)[0]
+    try:
+        assert client.upload_file(str(source), "up.bin", resume=True)[0]
+    finally:
+        client.disconnect()
+    assert (share / "up.bin").read_bytes() == data
+    assert not (share / ".up.bin.termshare-part").exists()
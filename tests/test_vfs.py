@@ -0,0 +1,130 @@
+import io
+import os
+import tarfile
+
+import pytest
+
+from conftest import PASSWORD, USER
+from ftp_client import FTPClient
+from ftp_server import FTPServer
+from metrics import MetricsRegistry
+from vfs import ArchiveFS, CachedFS, LocalFS, MemoryFS, open_filesystem
+
+def _counts(cache):
+    return cache.hits.snapshot().get("", 0), cache.misses.snapshot().get("", 0)
+
+@pytest.fixture
+def cache():
+    fs = MemoryFS()
+    fs.mkdir("/docs")
+    with fs.open_write("/docs/a.txt") as writer:
+        writer.write(b"hello")
+    return CachedFS(fs, metrics=MetricsRegistry())
+
+def test_listing_is_served_from_cache(cache):
+    assert [item.name for item in cache.listdir("/docs")] == ["a.txt"]
+    assert cache.stat("/docs/a.txt").size == 5
+    cache.listdir("/docs")
+    assert _counts(cache) == (2, 1)
+
+def test_changes_through_cache_invalidate(cache):
+    cache.listdir("/docs")
+    with cache.open_write("/docs/b.txt") as writer:
+        writer.write(b"!")
+    assert [item.name for item in cache.listdir("/docs")] == ["a.txt", "b.txt"]
+    cache.rename("/docs/a.txt", "/docs/c.txt")
+    assert [item.name for item in cache.listdir("/docs")] == ["b.txt", "c.txt"]
+    with pytest.raises(FileNotFoundError):
+        cache.stat("/docs/a.txt")
+
+def test_rendered_listing_is_rebuilt_after_change(cache):
+    builds = []
+    build = lambda path: builds.append(path) or str(len(cache.listdir(path))).encode()
+    assert cache.render("/docs", "LIST", build) == b"1"
+    assert cache.render("/docs", "LIST", build) == b"1"
+    cache.mkdir("/docs/sub")
+    assert cache.render("/docs", "LIST", build) == b"2"
+    assert builds == ["/docs", "/docs"]
+
+def test_max_directories_evicts_oldest(cache):
+    cache.max_directories = 1
+    cache.listdir("/docs")
+    cache.listdir("/")
+    assert list(cache.dirs) == ["/"]
+
+def test_server_on_memory_backend(tmp_path):
+    server = FTPServer(fs=MemoryFS(), users={USER: PASSWORD})
+    assert isinstance(server.fs, CachedFS)
+    assert server.start_server((0, 0))[0]
+    client = FTPClient(auto_reconnect=False, keepalive=None)
+    try:
+        assert client.connect("127.0.0.1", server.port, USER, PASSWORD)[0]
+        source = tmp_path / "up.bin"
+        source.write_bytes(b"x" * 100000)
+        assert client.upload_file(str(source), "up.bin")[0]
+        success, (cwd, lines) = client.get_listing()
+        assert success and any(line.endswith(" up.bin") for line in lines)
+        assert client.download_file("up.bin", str(tmp_path / "down.bin"))[0]
+        assert (tmp_path / "down.bin").read_bytes() == source.read_bytes()
+    finally:
+        client.disconnect()
+        server.stop_server()
+
+def test_open_filesystem_chooses_backend(tmp_path):
+    assert isinstance(open_filesystem(str(tmp_path)), LocalFS)
+    archive = tmp_path / "a.tar"
+    with tarfile.open(archive, "w") as tar:
+        info = tarfile.TarInfo("inside.txt")
+        info.size = 2
+        tar.addfile(info, io.BytesIO(b"hi"))
+    fs = open_filesystem(str(archive))
+    try:
+        assert isinstance(fs, ArchiveFS) and fs.readonly
+        assert fs.open_read("/inside.txt").read() == b"hi"
+    finally:
+        fs.close()
+    with pytest.raises(FileNotFoundError):
+        open_filesystem(str(tmp_path / "missing"))
+    (tmp_path / "notes.txt").write_text("plain file")
+    with pytest.raises(ValueError):
+        open_filesystem(str(tmp_path / "notes.txt"))
+
+@pytest.mark.parametrize("make_fs", [
+    lambda root: LocalFS(root), lambda root: LocalFS(root, "always"),
+    lambda root: LocalFS(root, "group"), lambda root: MemoryFS(),
+], ids=["never", "always", "group", "memory"])
+def test_commit_without_replace_keeps_file_created_meanwhile(tmp_path, make_fs):
+    fs = make_fs(str(tmp_path))
+    writer = fs.open_staged("/new.txt")
+    writer.write(b"upload")
+    with fs.open_write("/new.txt") as other:
+        other.write(b"first")
+    with pytest.raises(FileExistsError):
+        writer.commit(replace=False)
+    writer.discard()
+    with fs.open_read("/new.txt") as reader:
+        assert reader.read() == b"first"
+    assert fs.staged_size("/new.txt") is None
+    fs.close()
+
+def test_symlinks_cannot_leave_the_share(tmp_path):
+    share, outside = tmp_path / "share", tmp_path / "outside"
+    (share / "sub").mkdir(parents=True)
+    outside.mkdir()
+    (outside / "secret.txt").write_bytes(b"secret")
+    (share / "sub" / "a.txt").write_bytes(b"a")
+    os.symlink(outside, share / "out")
+    os.symlink(outside / "secret.txt", share / "secret.txt")
+    os.symlink(share / "sub", share / "inner")
+    fs = LocalFS(str(share))
+    for path in ("/out/secret.txt", "/secret.txt", "/out", "/sub/../../outside/secret.txt"):
+        with pytest.raises(PermissionError):
+            fs.open_read(path)
+    with pytest.raises(PermissionError):
+        fs.open_write("/out/new.txt")
+    assert not (outside / "new.txt").exists()
+    with fs.open_read("/inner/a.txt") as fp:
+        assert fp.read() == b"a"
+    assert [item.name for item in fs.listdir("/")] == ["inner", "sub"]
+    fs.remove("/inner")
+    assert (share / "sub" / "a.txt").exists()
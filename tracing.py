@@ -0,0 +1,328 @@
+"""
+Tracing module for TermShare
+Records timed spans to Chrome trace or OTLP-JSON files and samples cProfile
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import threading
+from typing import Dict, List, Optional
+
+# Spans are buffered and written in batches of this size
+FLUSH_EVERY = 256
+
+class Span:
+    """A timed section of work; use as a context manager"""
+
+    recording = True
+
+    def __init__(self, tracer, name: str, parent: Optional["Span"], attributes: Dict):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.thread_id = threading.get_ident()
+        self.start_ns = 0
+        self.end_ns = 0
+        self.cpu_start = 0.0
+
+    def set(self, key: str, value) -> None:
+        """Attach an attribute to the span"""
+        self.attributes[key] = value
+
+    def __enter__(self):
+        self.tracer._push(self)
+        self.cpu_start = time.thread_time()
+        self.start_ns = self.tracer._now_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ns = self.tracer._now_ns()
+        # CPU time close to wall time means the work was Python- or CPU-bound
+        self.attributes["cpu_seconds"] = round(time.thread_time() - self.cpu_start, 6)
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        self.tracer._pop(self)
+        return False
+
+class _NullSpan:
+    """Span stand-in used when tracing is disabled or a trace is not sampled"""
+
+    recording = False
+
+    def set(self, key: str, value) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class _UnsampledSpan(_NullSpan):
+    """Marks an unsampled root so that its children are skipped too"""
+
+    def __init__(self, tracer):
+        self.tracer = tracer
+
+    def __enter__(self):
+        self.tracer._push(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.tracer._pop(self)
+        return False
+
+class Tracer:
+    """Collects spans and writes them to a local trace file
+
+    format is "chrome" (a JSON array loadable in chrome://tracing or
+    Perfetto) or "otlp" (OTLP-JSON, one export request per line).
+    sample_rate is the fraction of root spans (commands) that are recorded.
+    """
+
+    enabled = True
+
+    def __init__(self, path: str, format: str = "chrome", sample_rate: float = 1.0,
+                 service_name: str = "termshare"):
+        if format not in ("chrome", "otlp"):
+            raise ValueError(f"Unknown trace format: {format}")
+        self.path = path
+        self.format = format
+        self.sample_rate = sample_rate
+        self.service_name = service_name
+        self.pending = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.pid = os.getpid()
+        self.wall_base = time.time_ns()
+        self.perf_base = time.perf_counter_ns()
+        self.first_event = True
+        self.file = open(path, 'w')
+        if format == "chrome":
+            self.file.write("[\n")
+
+    def _now_ns(self) -> int:
+        """Wall-clock nanoseconds with perf_counter resolution"""
+        return self.wall_base + time.perf_counter_ns() - self.perf_base
+
+    def _stack(self) -> List:
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def _push(self, span) -> None:
+        self._stack().append(span)
+
+    def _pop(self, span) -> None:
+        stack = self._stack()
+        if stack and stack[-1] is span:
+            stack.pop()
+        if isinstance(span, Span):
+            with self.lock:
+                self.pending.append(span)
+                if len(self.pending) >= FLUSH_EVERY:
+                    self._flush()
+
+    def span(self, name: str, **attributes):
+        """Start a span, nested under the current span of this thread"""
+        stack = self._stack()
+        parent = stack[-1] if stack else None
+        if parent is None:
+            if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+                return _UnsampledSpan(self)
+        elif not parent.recording:
+            return _NULL_SPAN
+        return Span(self, name, parent, attributes)
+
+    def _flush(self) -> None:
+        """Write buffered spans; the caller holds the lock"""
+        if not self.pending or self.file is None:
+            return
+        spans, self.pending = self.pending, []
+        if self.format == "chrome":
+            for span in spans:
+                event = {
+                    "name": span.name,
+                    "cat": self.service_name,
+                    "ph": "X",
+                    "ts": span.start_ns / 1000.0,
+                    "dur": (span.end_ns - span.start_ns) / 1000.0,
+                    "pid": self.pid,
+                    "tid": span.thread_id,
+                    "args": span.attributes,
+                }
+                self.file.write(("" if self.first_event else ",\n") + json.dumps(event, default=str))
+                self.first_event = False
+        else:
+            request = {"resourceSpans": [{
+                "resource": {"attributes": [_otlp_attribute("service.name", self.service_name)]},
+                "scopeSpans": [{
+                    "scope": {"name": "termshare"},
+                    "spans": [_otlp_span(span) for span in spans],
+                }],
+            }]}
+            self.file.write(json.dumps(request, default=str) + "\n")
+        self.file.flush()
+
+    def flush(self) -> None:
+        """Write any buffered spans to the trace file"""
+        with self.lock:
+            self._flush()
+
+    def close(self) -> None:
+        """Flush and close the trace file"""
+        with self.lock:
+            self._flush()
+            if self.file is not None:
+                if self.format == "chrome":
+                    self.file.write("\n]\n")
+                self.file.close()
+                self.file = None
+
+def _otlp_attribute(key: str, value) -> Dict:
+    """Encode one attribute as an OTLP KeyValue"""
+    if isinstance(value, bool):
+        encoded = {"boolValue": value}
+    elif isinstance(value, int):
+        encoded = {"intValue": str(value)}
+    elif isinstance(value, float):
+        encoded = {"doubleValue": value}
+    else:
+        encoded = {"stringValue": str(value)}
+    return {"key": key, "value": encoded}
+
+def _otlp_span(span: Span) -> Dict:
+    """Encode one span as an OTLP Span"""
+    encoded = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": 1,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": [_otlp_attribute(key, value) for key, value in span.attributes.items()],
+    }
+    if span.parent_id:
+        encoded["parentSpanId"] = span.parent_id
+    if "error" in span.attributes:
+        encoded["status"] = {"code": 2, "message": span.attributes["error"]}
+    return encoded
+
+class NullTracer:
+    """Tracer used when tracing is off; spans are shared no-op objects"""
+
+    enabled = False
+
+    def span(self, name: str, **attributes):
+        return _NULL_SPAN
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+# Shared tracer for components created without one
+NULL_TRACER = NullTracer()
+
+# From Python 3.12 cProfile is built on sys.monitoring, which is process-wide:
+# only one profiler can be enabled at a time, and it observes every thread
+_PROCESS_WIDE = sys.version_info >= (3, 12)
+
+class SamplingProfiler:
+    """Runs a sampled fraction of calls under cProfile and merges the results
+
+    Before Python 3.12 each thread gets its own cProfile.Profile because a
+    profiler only observes the thread that enabled it. From 3.12 a single
+    profiler is enabled while any sampled call is running, so it also records
+    whatever other threads do during that time.
+    """
+
+    def __init__(self, path: str, sample_rate: float = 0.01):
+        # Imported here so that tracing without profiling does not load them
+        import cProfile
+        self.new_profile = cProfile.Profile
+        self.path = path
+        self.sample_rate = sample_rate
+        self.local = threading.local()
+        self.profiles = []
+        self.lock = threading.Lock()
+        self.shared = None
+        self.active = 0
+
+    def _profile(self):
+        profile = getattr(self.local, "profile", None)
+        if profile is None:
+            profile = self.local.profile = self.new_profile()
+            with self.lock:
+                self.profiles.append(profile)
+        return profile
+
+    def call(self, func, *args):
+        """Call func(*args), profiling it if this call is sampled"""
+        if random.random() >= self.sample_rate:
+            return func(*args)
+        if _PROCESS_WIDE:
+            return self._call_shared(func, *args)
+        profile = self._profile()
+        profile.enable()
+        try:
+            return func(*args)
+        finally:
+            profile.disable()
+
+    def _enable_shared(self) -> bool:
+        """Enable the process-wide profiler; the caller holds the lock"""
+        if self.shared is None:
+            self.shared = self.new_profile()
+            self.profiles.append(self.shared)
+        try:
+            self.shared.enable()
+        except ValueError:
+            # Another tool (a debugger or coverage) holds the profiler slot
+            return False
+        return True
+
+    def _call_shared(self, func, *args):
+        """Call func(*args) with the process-wide profiler enabled"""
+        with self.lock:
+            profiled = self.active > 0 or self._enable_shared()
+            if profiled:
+                self.active += 1
+        try:
+            return func(*args)
+        finally:
+            if profiled:
+                with self.lock:
+                    self.active -= 1
+                    if self.active == 0:
+                        self.shared.disable()
+
+    def dump(self) -> bool:
+        """Merge all per-thread profiles into a pstats file"""
+        import pstats
+        with self.lock:
+            profiles = list(self.profiles)
+        stats = None
+        for profile in profiles:
+            try:
+                if stats is None:
+                    stats = pstats.Stats(profile)
+                else:
+                    stats.add(profile)
+            except TypeError:
+                # A profile that never sampled anything has no stats
+                continue
+        if stats is None:
+            return False
+        stats.dump_stats(self.path)
+        return True
\ No newline at end of file
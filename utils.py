@@ -26,7 +26,7 @@ def parse_ftp_listing(listing: List[str]) -> List[Tuple]:
         parts = line.split()
         if len(parts) >= 9:
             # Standard UNIX format
-            perms, _, _, size, mon, day, time_year, *name_parts = parts
+            perms, _, _, _, size, mon, day, time_year, *name_parts = parts
             name = " ".join(name_parts)
             file_type = "DIR" if perms.startswith("d") else "FILE"
             modified = f"{mon} {day} {time_year}"
@@ -0,0 +1,1062 @@
+"""
+Virtual filesystem module for TermShare
+Storage backends for the built-in server and a change-invalidated metadata cache
+"""
+
+import io
+import os
+import time
+import errno
+import select
+import struct
+import tarfile
+import zipfile
+import posixpath
+import threading
+import ctypes
+from collections import OrderedDict
+from typing import Callable, List, NamedTuple, Optional
+from file_io import CHUNK_SIZE, FileWriter, load_libc
+from metrics import DISABLED, MetricsRegistry
+
+# Paths handed to a FileSystem are absolute, normalised POSIX paths such as
+# "/docs/readme.md"; the server resolves them against the session's cwd.
+
+class FileStat(NamedTuple):
+    """Metadata for one file or directory"""
+    name: str
+    size: int
+    mtime: float
+    is_dir: bool
+
+def _error(code: int, path: str) -> OSError:
+    """Build an OSError (mapped to its subclass, e.g. FileNotFoundError) for path"""
+    return OSError(code, os.strerror(code), path)
+
+def _split(path: str):
+    """Split a virtual path into its parent directory and name"""
+    return posixpath.dirname(path) or "/", posixpath.basename(path)
+
+# Uploads are staged in a hidden file next to their target and renamed into place
+STAGING_SUFFIX = ".termshare-part"
+
+def staging_name(name: str) -> str:
+    return f".{name}{STAGING_SUFFIX}"
+
+def is_staging_name(name: str) -> bool:
+    return name.startswith(".") and name.endswith(STAGING_SUFFIX)
+
+# When committed uploads are fsync()ed: never, before each rename, or in batches
+FSYNC_POLICIES = ("never", "always", "group")
+
+def _fsync_directory(path: str) -> None:
+    """Make renames within a directory durable"""
+    try:
+        fd = os.open(path, os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0))
+    except OSError:
+        # Directories cannot be opened on every platform (e.g. Windows)
+        return
+    try:
+        os.fsync(fd)
+    except OSError as e:
+        # Some filesystems do not support fsync() on directories
+        if e.errno not in (errno.EINVAL, errno.EBADF, errno.ENOTSUP):
+            raise
+    finally:
+        os.close(fd)
+
+class FileSystem:
+    """Interface implemented by every storage backend"""
+
+    readonly = False
+
+    def stat(self, path: str) -> FileStat:
+        raise NotImplementedError
+
+    def listdir(self, path: str) -> List[FileStat]:
+        """Return the entries of a directory sorted by name"""
+        raise NotImplementedError
+
+    def open_read(self, path: str):
+        """Open a file for reading; returns a seekable binary file object"""
+        raise NotImplementedError
+
+    def open_write(self, path: str, truncate: bool = True):
+        """Open a file for writing in place; returns an object with seek/write/close"""
+        raise _error(errno.EROFS, path)
+
+    def open_staged(self, path: str, offset: int = 0):
+        """Open a writer whose data replaces path atomically when commit() is called
+
+        The writer starts at offset, keeping the first offset bytes of an
+        interrupted upload (or of the current file). Closing it without
+        commit() leaves the data staged for a later resume; discard() drops it.
+        commit(replace=False) only creates path, raising FileExistsError if
+        it exists by then.
+        """
+        raise _error(errno.EROFS, path)
+
+    def staged_size(self, path: str) -> Optional[int]:
+        """Size of the interrupted upload staged for path, if any"""
+        return None
+
+    def mkdir(self, path: str) -> None:
+        raise _error(errno.EROFS, path)
+
+    def rmdir(self, path: str) -> None:
+        raise _error(errno.EROFS, path)
+
+    def remove(self, path: str) -> None:
+        raise _error(errno.EROFS, path)
+
+    def rename(self, source: str, target: str) -> None:
+        raise _error(errno.EROFS, source)
+
+    def render(self, path: str, kind: str, build: Callable[[str], bytes]) -> bytes:
+        """Return build(path) for a directory; cached by CachedFS"""
+        return build(path)
+
+    def invalidate(self, path: str, tree: bool = False) -> None:
+        """Note that path changed; only meaningful for CachedFS"""
+
+    def watcher(self, callback: Callable[[str, bool], None]):
+        """Return a watcher reporting external changes, or None if there can be none"""
+        return None
+
+    def close(self) -> None:
+        pass
+
+class _StagedFile:
+    """Upload written to a hidden staging file and renamed over its target on commit"""
+
+    def __init__(self, fs: "LocalFS", path: str, offset: int):
+        self.fs = fs
+        self.target = fs.real_path(path)
+        self.part = fs.staging_path(path)
+        if os.path.isdir(self.target):
+            raise _error(errno.EISDIR, path)
+        if offset:
+            self._prepare_resume(path, offset)
+        self.writer = FileWriter(self.part, truncate=offset == 0)
+        if offset:
+            # Drop anything past the restart point
+            os.ftruncate(self.writer.fd, offset)
+            self.writer.seek(offset)
+
+    def _prepare_resume(self, path: str, offset: int) -> None:
+        """Make sure the staging file holds at least the first offset bytes"""
+        try:
+            if os.path.getsize(self.part) >= offset:
+                return
+        except OSError:
+            pass
+        # No interrupted upload to continue: REST + STOR rewrites the current file from offset
+        try:
+            size = os.path.getsize(self.target)
+        except OSError:
+            size = -1
+        if size < offset:
+            raise _error(errno.EINVAL, path)
+        with open(self.target, 'rb') as source, open(self.part, 'wb') as staged:
+            remaining = offset
+            while remaining:
+                chunk = source.read(min(CHUNK_SIZE, remaining))
+                staged.write(chunk)
+                remaining -= len(chunk)
+
+    def seek(self, offset: int) -> None:
+        self.writer.seek(offset)
+
+    def write(self, data) -> int:
+        return self.writer.write(data)
+
+    def commit(self, replace: bool = True) -> None:
+        """Make the upload durable per the fsync policy and move it into place
+
+        Without replace, FileExistsError is raised if the target exists by
+        then, even if it was created after the upload started.
+        """
+        policy = self.fs.fsync
+        if policy == "group":
+            # Blocks until the batch containing this file has been synced and renamed
+            self.fs.committer.commit(self.writer.fd, self.part, self.target, replace)
+            self.writer.close()
+            return
+        if policy == "always":
+            os.fsync(self.writer.fd)
+        self.writer.close()
+        if replace:
+            os.replace(self.part, self.target)
+        else:
+            _rename_noreplace(self.part, self.target)
+        if policy == "always":
+            _fsync_directory(os.path.dirname(self.target))
+
+    def discard(self) -> None:
+        """Close and remove the staging file instead of keeping it for a resume"""
+        self.writer.close()
+        try:
+            os.remove(self.part)
+        except FileNotFoundError:
+            pass
+
+    def close(self) -> None:
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+def _rename_noreplace(source: str, target: str) -> None:
+    """Rename source to target, raising FileExistsError if target exists at that moment"""
+    try:
+        os.link(source, target)
+    except FileExistsError:
+        raise
+    except OSError:
+        # No hard links on this filesystem: claim the name, then move over the claim
+        os.close(os.open(target, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644))
+        os.replace(source, target)
+        return
+    os.remove(source)
+
+class GroupCommitter:
+    """Commits staged uploads in batches to amortise the cost of durability
+
+    A batch costs one syncfs() per filesystem (one fsync() per file where
+    syncfs is unavailable) plus one fsync() per directory, however many
+    uploads it holds. An upload waits up to window seconds for others to
+    join its batch.
+    """
+
+    def __init__(self, window: float = 0.002, max_batch: int = 256):
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = []
+        self.cond = threading.Condition()
+        self.running = True
+        self.thread = None
+        libc = load_libc()
+        self.syncfs = getattr(libc, "syncfs", None) if libc else None
+
+    def commit(self, fd: int, part: str, target: str, replace: bool = True) -> None:
+        """Sync fd, rename part over target (or to it if new, without replace) and sync the directory; raises on failure"""
+        item = {"fd": fd, "part": part, "target": target, "replace": replace,
+                "done": threading.Event(), "error": None}
+        with self.cond:
+            if self.thread is None:
+                self.running = True
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+            self.queue.append(item)
+            self.cond.notify()
+        item["done"].wait()
+        if item["error"] is not None:
+            raise item["error"]
+
+    def _run(self) -> None:
+        while True:
+            with self.cond:
+                while not self.queue and self.running:
+                    self.cond.wait()
+                if not self.queue:
+                    # Closed; a later commit starts a new thread
+                    self.thread = None
+                    return
+            # Let concurrent uploads join the batch
+            time.sleep(self.window)
+            with self.cond:
+                batch, self.queue = self.queue[:self.max_batch], self.queue[self.max_batch:]
+            try:
+                self._commit(batch)
+            finally:
+                for item in batch:
+                    item["done"].set()
+
+    def _sync(self, items: List[dict]) -> None:
+        """Flush the data of files that share a filesystem"""
+        if self.syncfs is not None:
+            if self.syncfs(items[0]["fd"]) != 0:
+                code = ctypes.get_errno()
+                raise OSError(code, os.strerror(code))
+            return
+        for item in items:
+            os.fsync(item["fd"])
+
+    def _commit(self, batch: List[dict]) -> None:
+        by_device = {}
+        for item in batch:
+            try:
+                by_device.setdefault(os.fstat(item["fd"]).st_dev, []).append(item)
+            except OSError as e:
+                item["error"] = e
+        for items in by_device.values():
+            try:
+                self._sync(items)
+            except OSError as e:
+                for item in items:
+                    item["error"] = e
+        directories = {}
+        for item in batch:
+            if item["error"] is None:
+                try:
+                    if item["replace"]:
+                        os.replace(item["part"], item["target"])
+                    else:
+                        _rename_noreplace(item["part"], item["target"])
+                    directories.setdefault(os.path.dirname(item["target"]), []).append(item)
+                except OSError as e:
+                    item["error"] = e
+        for directory, items in directories.items():
+            try:
+                _fsync_directory(directory)
+            except OSError as e:
+                for item in items:
+                    item["error"] = e
+
+    def close(self) -> None:
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+
+class LocalFS(FileSystem):
+    """Serves a directory on local disk"""
+
+    def __init__(self, root: str, fsync: str = "never"):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        self.root = os.path.realpath(root)
+        self.fsync = fsync
+        self.committer = GroupCommitter() if fsync == "group" else None
+
+    def real_path(self, path: str) -> str:
+        """Map a virtual path onto the served directory
+
+        Symlinks are followed only while they stay inside it; one leading
+        outside raises PermissionError. The last component is not resolved,
+        so deleting or renaming a symlink acts on the link itself.
+        """
+        relative = path.lstrip("/")
+        if not relative:
+            return self.root
+        real = os.path.join(self.root, *relative.split("/"))
+        directory = os.path.realpath(os.path.dirname(real))
+        if not (self._inside(directory) and self._inside(os.path.realpath(real))):
+            raise _error(errno.EACCES, path)
+        return os.path.join(directory, os.path.basename(real))
+
+    def _inside(self, real: str) -> bool:
+        try:
+            return os.path.commonpath([self.root, real]) == self.root
+        except ValueError:
+            # On another drive
+            return False
+
+    def stat(self, path: str) -> FileStat:
+        st = os.stat(self.real_path(path))
+        return FileStat(posixpath.basename(path), st.st_size, st.st_mtime,
+                        (st.st_mode & 0o170000) == 0o040000)
+
+    def listdir(self, path: str) -> List[FileStat]:
+        entries = []
+        with os.scandir(self.real_path(path)) as it:
+            for entry in it:
+                if is_staging_name(entry.name):
+                    continue
+                if entry.is_symlink() and not self._inside(os.path.realpath(entry.path)):
+                    # Leads out of the share; real_path would refuse it anyway
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    # Removed while scanning, or a dangling symlink
+                    continue
+                entries.append(FileStat(entry.name, st.st_size, st.st_mtime,
+                                        (st.st_mode & 0o170000) == 0o040000))
+        entries.sort(key=lambda entry: entry.name)
+        return entries
+
+    def open_read(self, path: str):
+        # A real file object, so the server can use sendfile()
+        return open(self.real_path(path), 'rb')
+
+    def open_write(self, path: str, truncate: bool = True):
+        return FileWriter(self.real_path(path), truncate=truncate)
+
+    def staging_path(self, path: str) -> str:
+        """Real path of the staging file for an upload to path"""
+        directory, name = os.path.split(self.real_path(path))
+        return os.path.join(directory, staging_name(name))
+
+    def open_staged(self, path: str, offset: int = 0):
+        return _StagedFile(self, path, offset)
+
+    def staged_size(self, path: str) -> Optional[int]:
+        try:
+            return os.path.getsize(self.staging_path(path))
+        except OSError:
+            return None
+
+    def mkdir(self, path: str) -> None:
+        os.mkdir(self.real_path(path))
+
+    def rmdir(self, path: str) -> None:
+        os.rmdir(self.real_path(path))
+
+    def remove(self, path: str) -> None:
+        real = self.real_path(path)
+        if os.path.isdir(real) and not os.path.islink(real):
+            raise _error(errno.EISDIR, path)
+        os.remove(real)
+
+    def rename(self, source: str, target: str) -> None:
+        os.rename(self.real_path(source), self.real_path(target))
+
+    def watcher(self, callback: Callable[[str, bool], None]):
+        if InotifyWatcher.available():
+            return InotifyWatcher(self, callback)
+        return PollingWatcher(self, callback)
+
+    def close(self) -> None:
+        if self.committer is not None:
+            self.committer.close()
+
+class _MemoryWriter:
+    """Writer for MemoryFS; the file's contents are replaced on close, or on commit when staged"""
+
+    def __init__(self, fs: "MemoryFS", path: str, data: bytes, staged: bool = False):
+        self.fs = fs
+        self.path = path
+        self.data = bytearray(data)
+        self.staged = staged
+        self.offset = 0
+
+    def seek(self, offset: int) -> None:
+        self.offset = offset
+
+    def write(self, data) -> int:
+        n = len(data)
+        if self.offset > len(self.data):
+            self.data.extend(bytes(self.offset - len(self.data)))
+        self.data[self.offset:self.offset + n] = data
+        self.offset += n
+        return n
+
+    def _publish(self, replace: bool = True) -> None:
+        with self.fs.lock:
+            if self.staged:
+                parent = self.fs._check_parent(self.path)
+                if not replace and (self.path in self.fs.files or self.path in self.fs.dirs):
+                    raise _error(errno.EEXIST, self.path)
+                self.fs.children[parent].add(posixpath.basename(self.path))
+            elif self.path not in self.fs.files:
+                # Removed or renamed while being written
+                return
+            self.fs.files[self.path] = [bytes(self.data), time.time()]
+
+    def commit(self, replace: bool = True) -> None:
+        self._publish(replace)
+        self.data = None
+
+    def discard(self) -> None:
+        self.data = None
+
+    def close(self) -> None:
+        if self.data is None:
+            return
+        if not self.staged:
+            self._publish()
+        self.data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+class MemoryFS(FileSystem):
+    """Keeps a whole tree in memory; meant for tests and throwaway shares"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.dirs = {"/": time.time()}
+        self.children = {"/": set()}
+        self.files = {}
+
+    def _stat(self, path: str) -> FileStat:
+        """Stat an existing path; the caller holds the lock"""
+        if path in self.dirs:
+            return FileStat(posixpath.basename(path), 0, self.dirs[path], True)
+        data, mtime = self.files[path]
+        return FileStat(posixpath.basename(path), len(data), mtime, False)
+
+    def stat(self, path: str) -> FileStat:
+        with self.lock:
+            if path in self.dirs or path in self.files:
+                return self._stat(path)
+        raise _error(errno.ENOENT, path)
+
+    def listdir(self, path: str) -> List[FileStat]:
+        with self.lock:
+            if path not in self.dirs:
+                raise _error(errno.ENOTDIR if path in self.files else errno.ENOENT, path)
+            return [self._stat(posixpath.join(path, name)) for name in sorted(self.children[path])]
+
+    def open_read(self, path: str):
+        with self.lock:
+            if path in self.dirs:
+                raise _error(errno.EISDIR, path)
+            if path not in self.files:
+                raise _error(errno.ENOENT, path)
+            return io.BytesIO(self.files[path][0])
+
+    def _check_parent(self, path: str) -> str:
+        """Validate that path can be created; the caller holds the lock"""
+        parent, name = _split(path)
+        if parent not in self.dirs:
+            raise _error(errno.ENOENT, path)
+        if path in self.dirs:
+            raise _error(errno.EISDIR, path)
+        return parent
+
+    def open_write(self, path: str, truncate: bool = True):
+        with self.lock:
+            parent = self._check_parent(path)
+            if path not in self.files:
+                self.files[path] = [b"", time.time()]
+                self.children[parent].add(posixpath.basename(path))
+            data = b"" if truncate else self.files[path][0]
+        return _MemoryWriter(self, path, data)
+
+    def open_staged(self, path: str, offset: int = 0):
+        with self.lock:
+            self._check_parent(path)
+            data = self.files[path][0] if path in self.files else b""
+        if len(data) < offset:
+            raise _error(errno.EINVAL, path)
+        writer = _MemoryWriter(self, path, data[:offset], staged=True)
+        writer.seek(offset)
+        return writer
+
+    def mkdir(self, path: str) -> None:
+        with self.lock:
+            if path in self.files or path in self.dirs:
+                raise _error(errno.EEXIST, path)
+            parent = self._check_parent(path)
+            self.dirs[path] = time.time()
+            self.children[path] = set()
+            self.children[parent].add(posixpath.basename(path))
+
+    def rmdir(self, path: str) -> None:
+        with self.lock:
+            if path not in self.dirs:
+                raise _error(errno.ENOTDIR if path in self.files else errno.ENOENT, path)
+            if path == "/" or self.children[path]:
+                raise _error(errno.ENOTEMPTY, path)
+            del self.dirs[path], self.children[path]
+            parent, name = _split(path)
+            self.children[parent].discard(name)
+
+    def remove(self, path: str) -> None:
+        with self.lock:
+            if path in self.dirs:
+                raise _error(errno.EISDIR, path)
+            if path not in self.files:
+                raise _error(errno.ENOENT, path)
+            del self.files[path]
+            parent, name = _split(path)
+            self.children[parent].discard(name)
+
+    def rename(self, source: str, target: str) -> None:
+        with self.lock:
+            if source not in self.files and source not in self.dirs:
+                raise _error(errno.ENOENT, source)
+            if source == "/" or target == source or target.startswith(source + "/"):
+                raise _error(errno.EINVAL, target)
+            if target in self.dirs:
+                raise _error(errno.EEXIST, target)
+            target_parent = self._check_parent(target)
+            # Move the entry and, for a directory, everything beneath it
+            prefix = source + "/"
+            for table in (self.files, self.dirs, self.children):
+                for path in [p for p in table if p == source or p.startswith(prefix)]:
+                    table[target + path[len(source):]] = table.pop(path)
+            source_parent, source_name = _split(source)
+            self.children[source_parent].discard(source_name)
+            self.children[target_parent].add(posixpath.basename(target))
+
+class _ArchiveMember:
+    """Read-only member stream that hides the archive's descriptor from sendfile()"""
+
+    def __init__(self, stream, archive=None):
+        self.stream = stream
+        self.archive = archive
+
+    def read(self, size: int = -1) -> bytes:
+        return self.stream.read(size)
+
+    def readinto(self, buffer) -> int:
+        return self.stream.readinto(buffer)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return self.stream.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self.stream.tell()
+
+    def fileno(self) -> int:
+        raise io.UnsupportedOperation("fileno")
+
+    def close(self) -> None:
+        self.stream.close()
+        if self.archive is not None:
+            self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+class ArchiveFS(FileSystem):
+    """Serves the contents of a tar (optionally compressed) or zip archive, read-only
+
+    The member index is built once when the archive is opened. Reads from
+    compressed tarballs have to decompress from the start of the archive.
+    """
+
+    readonly = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = {"/": FileStat("", 0, os.path.getmtime(path), True)}
+        self.children = {"/": set()}
+        self.members = {}
+        self.zip = None
+        if zipfile.is_zipfile(path):
+            self.zip = zipfile.ZipFile(path)
+            for info in self.zip.infolist():
+                mtime = time.mktime(info.date_time + (0, 0, -1))
+                self._add(info.filename, info.file_size, mtime, info.is_dir(), info)
+        else:
+            with tarfile.open(path) as tar:
+                for member in tar.getmembers():
+                    if member.isfile() or member.isdir():
+                        self._add(member.name, member.size, member.mtime, member.isdir(), member)
+
+    def _add(self, name: str, size: int, mtime: float, is_dir: bool, member) -> None:
+        """Index one archive member, creating any directories it implies"""
+        path = posixpath.normpath("/" + name.strip("/"))
+        if path == "/":
+            return
+        if is_dir:
+            self.entries[path] = FileStat(posixpath.basename(path), 0, mtime, True)
+            self.children.setdefault(path, set())
+        else:
+            self.entries[path] = FileStat(posixpath.basename(path), size, mtime, False)
+            self.members[path] = member
+        while path != "/":
+            parent, child = _split(path)
+            if parent not in self.entries:
+                self.entries[parent] = FileStat(posixpath.basename(parent), 0, mtime, True)
+            self.children.setdefault(parent, set()).add(child)
+            path = parent
+
+    def stat(self, path: str) -> FileStat:
+        entry = self.entries.get(path)
+        if entry is None:
+            raise _error(errno.ENOENT, path)
+        return entry
+
+    def listdir(self, path: str) -> List[FileStat]:
+        if path not in self.children:
+            raise _error(errno.ENOTDIR if path in self.entries else errno.ENOENT, path)
+        return [self.entries[posixpath.join(path, name)] for name in sorted(self.children[path])]
+
+    def open_read(self, path: str):
+        member = self.members.get(path)
+        if member is None:
+            raise _error(errno.EISDIR if path in self.entries else errno.ENOENT, path)
+        if self.zip is not None:
+            # ZipFile serialises access to the shared handle itself
+            return _ArchiveMember(self.zip.open(member))
+        # TarFile handles are not thread-safe, so each reader gets its own
+        tar = tarfile.open(self.path)
+        return _ArchiveMember(tar.extractfile(member), tar)
+
+    def close(self) -> None:
+        if self.zip is not None:
+            self.zip.close()
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+_EVENT = struct.Struct("iIII")
+
+class InotifyWatcher:
+    """Reports changes under watched LocalFS directories using Linux inotify
+
+    callback(path, tree) is called from a background thread with the virtual
+    path that changed; tree is True when it was (or may have been) a directory.
+    """
+
+    _libc = None
+
+    @classmethod
+    def available(cls) -> bool:
+        """Whether inotify can be used on this system"""
+        if cls._libc is None:
+            libc = load_libc()
+            try:
+                libc.inotify_init1, libc.inotify_add_watch, libc.inotify_rm_watch
+            except AttributeError:
+                libc = False
+            cls._libc = libc
+        return bool(cls._libc)
+
+    def __init__(self, fs: LocalFS, callback: Callable[[str, bool], None]):
+        self.fs = fs
+        self.callback = callback
+        self.libc = self._libc
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+        self.paths = {}
+        self.descriptors = {}
+        self.lock = threading.Lock()
+        self.running = True
+        self.thread = threading.Thread(target=self._read_events, daemon=True)
+        self.thread.start()
+
+    def watch(self, path: str) -> bool:
+        """Start watching a directory; returns False if it cannot be watched"""
+        try:
+            real = os.fsencode(self.fs.real_path(path))
+        except OSError:
+            return False
+        with self.lock:
+            if self.fd < 0:
+                return False
+            wd = self.libc.inotify_add_watch(self.fd, real, WATCH_MASK)
+            if wd < 0:
+                # Gone, not a directory, or the watch limit was reached
+                return False
+            # A directory that was renamed keeps its watch descriptor
+            old = self.paths.get(wd)
+            if old is not None and old != path:
+                self.descriptors.pop(old, None)
+            self.paths[wd] = path
+            self.descriptors[path] = wd
+        return True
+
+    def unwatch(self, path: str) -> None:
+        """Stop watching a directory"""
+        with self.lock:
+            wd = self.descriptors.pop(path, None)
+            if wd is not None:
+                self.paths.pop(wd, None)
+                if self.fd >= 0:
+                    self.libc.inotify_rm_watch(self.fd, wd)
+
+    def _read_events(self) -> None:
+        while self.running:
+            try:
+                ready, _, _ = select.select([self.fd], [], [], 0.5)
+                if not ready:
+                    continue
+                data = os.read(self.fd, 65536)
+            except (OSError, ValueError):
+                if self.running:
+                    continue
+                break
+            offset = 0
+            while offset + _EVENT.size <= len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, offset)
+                name = data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b"\0")
+                offset += _EVENT.size + length
+                self._dispatch(wd, mask, os.fsdecode(name))
+
+    def _dispatch(self, wd: int, mask: int, name: str) -> None:
+        if mask & IN_Q_OVERFLOW:
+            # Events were dropped; anything may have changed
+            self.callback("/", True)
+            return
+        with self.lock:
+            path = self.paths.get(wd)
+            if mask & IN_IGNORED and path is not None:
+                del self.paths[wd]
+                if self.descriptors.get(path) == wd:
+                    del self.descriptors[path]
+        if path is None:
+            return
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+            self.callback(path, True)
+        elif name and not is_staging_name(name):
+            self.callback(posixpath.join(path, name), bool(mask & IN_ISDIR))
+
+    def close(self) -> None:
+        """Stop the event thread and release the inotify descriptor"""
+        self.running = False
+        self.thread.join()
+        with self.lock:
+            os.close(self.fd)
+            self.fd = -1
+            self.paths.clear()
+            self.descriptors.clear()
+
+class PollingWatcher:
+    """Fallback watcher that rescans watched directories every interval seconds"""
+
+    def __init__(self, fs: FileSystem, callback: Callable[[str, bool], None], interval: float = 1.0):
+        self.fs = fs
+        self.callback = callback
+        self.interval = interval
+        self.signatures = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._poll, daemon=True)
+        self.thread.start()
+
+    def _signature(self, path: str):
+        try:
+            return hash(tuple(self.fs.listdir(path)))
+        except OSError:
+            return None
+
+    def watch(self, path: str) -> bool:
+        with self.lock:
+            if path in self.signatures:
+                return True
+        signature = self._signature(path)
+        if signature is None:
+            return False
+        with self.lock:
+            self.signatures[path] = signature
+        return True
+
+    def unwatch(self, path: str) -> None:
+        with self.lock:
+            self.signatures.pop(path, None)
+
+    def _poll(self) -> None:
+        while not self.stopped.wait(self.interval):
+            with self.lock:
+                paths = list(self.signatures)
+            for path in paths:
+                signature = self._signature(path)
+                with self.lock:
+                    if path not in self.signatures or self.signatures[path] == signature:
+                        continue
+                    self.signatures[path] = signature
+                self.callback(path, signature is None)
+
+    def close(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+
+class _CachedDirectory:
+    """Cached metadata for one directory"""
+
+    __slots__ = ("listing", "names", "stats", "rendered")
+
+    def __init__(self):
+        self.listing = None
+        self.names = None
+        self.stats = {}
+        self.rendered = {}
+
+class CachedFS(FileSystem):
+    """Caches stat results, directory listings and rendered LIST output of another backend
+
+    Changes made through this object invalidate the cache directly; changes
+    made behind its back (local disk only) are reported by the backend's
+    watcher, which is started on first use and stopped by close(). At most
+    max_directories directories are cached and watched.
+    """
+
+    def __init__(self, fs: FileSystem, max_directories: int = 1024,
+                 metrics: MetricsRegistry = DISABLED):
+        self.fs = fs
+        self.readonly = fs.readonly
+        self.max_directories = max_directories
+        self.dirs = {}
+        self.watched = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = metrics.counter(
+            "termshare_server_vfs_cache_hits_total", "Metadata requests served from the cache")
+        self.misses = metrics.counter(
+            "termshare_server_vfs_cache_misses_total", "Metadata requests passed to the backend")
+        self.monitor = None
+        self.monitoring = False
+
+    def _directory(self, path: str) -> Optional[_CachedDirectory]:
+        """Return the cache slot for a directory, watching it first if needed"""
+        with self.lock:
+            if not self.monitoring:
+                self.monitor = self.fs.watcher(self.invalidate)
+                self.monitoring = True
+            if path in self.watched:
+                self.watched.move_to_end(path)
+            else:
+                if self.monitor is not None and not self.monitor.watch(path):
+                    return None
+                self.watched[path] = True
+                if len(self.watched) > self.max_directories:
+                    evicted, _ = self.watched.popitem(last=False)
+                    self.dirs.pop(evicted, None)
+                    if self.monitor is not None:
+                        self.monitor.unwatch(evicted)
+            entry = self.dirs.get(path)
+            if entry is None:
+                entry = self.dirs[path] = _CachedDirectory()
+            return entry
+
+    def _current(self, path: str, entry: _CachedDirectory) -> bool:
+        """Whether entry is still the live slot for path; the caller holds the lock"""
+        return self.dirs.get(path) is entry
+
+    def stat(self, path: str) -> FileStat:
+        if path == "/":
+            return self.fs.stat(path)
+        parent, name = _split(path)
+        entry = self._directory(parent)
+        if entry is not None:
+            if entry.names is not None:
+                self.hits.inc()
+                if name not in entry.names:
+                    raise _error(errno.ENOENT, path)
+                return entry.names[name]
+            cached = entry.stats.get(name)
+            if cached is not None:
+                self.hits.inc()
+                return cached
+        self.misses.inc()
+        result = self.fs.stat(path)
+        if entry is not None:
+            with self.lock:
+                if self._current(parent, entry):
+                    entry.stats[name] = result
+        return result
+
+    def listdir(self, path: str) -> List[FileStat]:
+        entry = self._directory(path)
+        if entry is not None and entry.listing is not None:
+            self.hits.inc()
+            return entry.listing
+        self.misses.inc()
+        listing = self.fs.listdir(path)
+        if entry is not None:
+            with self.lock:
+                if self._current(path, entry):
+                    entry.listing = listing
+                    entry.names = {item.name: item for item in listing}
+        return listing
+
+    def render(self, path: str, kind: str, build: Callable[[str], bytes]) -> bytes:
+        entry = self._directory(path)
+        if entry is not None:
+            cached = entry.rendered.get(kind)
+            if cached is not None:
+                self.hits.inc()
+                return cached
+        payload = build(path)
+        if entry is not None:
+            with self.lock:
+                if self._current(path, entry):
+                    entry.rendered[kind] = payload
+        return payload
+
+    def invalidate(self, path: str, tree: bool = False) -> None:
+        """Drop cached data for path, its parent directory and, if tree, its descendants"""
+        with self.lock:
+            self.dirs.pop(path, None)
+            self.dirs.pop(_split(path)[0], None)
+            if tree:
+                if path == "/":
+                    self.dirs.clear()
+                else:
+                    prefix = path + "/"
+                    for cached in [p for p in self.dirs if p.startswith(prefix)]:
+                        del self.dirs[cached]
+
+    def open_read(self, path: str):
+        return self.fs.open_read(path)
+
+    def open_write(self, path: str, truncate: bool = True):
+        writer = self.fs.open_write(path, truncate)
+        self.invalidate(path)
+        return writer
+
+    def open_staged(self, path: str, offset: int = 0):
+        # Nothing is visible until commit; the caller invalidates path afterwards
+        return self.fs.open_staged(path, offset)
+
+    def staged_size(self, path: str) -> Optional[int]:
+        return self.fs.staged_size(path)
+
+    def mkdir(self, path: str) -> None:
+        self.fs.mkdir(path)
+        self.invalidate(path)
+
+    def rmdir(self, path: str) -> None:
+        self.fs.rmdir(path)
+        self.invalidate(path, tree=True)
+
+    def remove(self, path: str) -> None:
+        self.fs.remove(path)
+        self.invalidate(path)
+
+    def rename(self, source: str, target: str) -> None:
+        try:
+            self.fs.rename(source, target)
+        finally:
+            self.invalidate(source, tree=True)
+            self.invalidate(target, tree=True)
+
+    def close(self) -> None:
+        with self.lock:
+            # Nothing can be trusted once changes stop being reported
+            monitor, self.monitor, self.monitoring = self.monitor, None, False
+            self.dirs.clear()
+            self.watched.clear()
+        if monitor is not None:
+            # Outside the lock: the watcher thread may be waiting for it in invalidate()
+            monitor.close()
+        self.fs.close()
+
+def open_filesystem(root: str, fsync: str = "never") -> FileSystem:
+    """Choose a backend for root: a directory, or a tar/zip archive served read-only
+
+    Raises OSError if root does not exist and ValueError if it is a file that
+    is not a readable archive.
+    """
+    if os.path.isdir(root):
+        return LocalFS(root, fsync)
+    if not os.path.exists(root):
+        raise _error(errno.ENOENT, root)
+    try:
+        return ArchiveFS(root)
+    except (tarfile.TarError, zipfile.BadZipFile) as e:
+        raise ValueError(f"{root} is not a directory or a tar/zip archive") from e